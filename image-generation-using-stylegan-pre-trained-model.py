@@ -5,48 +5,28 @@
 # https://www.kaggle.com/code/lmdm99/image-generation-using-stylegan-pre-trained-model/edit
 from utillc import *
 import torch, sys
-import torch.nn as nn
 import torch.nn.functional as F
 
-from collections import OrderedDict
-import pickle
-from facenet_pytorch import MTCNN, InceptionResnetV1
 import numpy as np
 
-import IPython
+# > The layers and networks live in the `stylegan` package (stylegan/networks.py) so that they
+# can be imported without running this notebook ; the cells below import them one at a time.
+# `python -m stylegan generate --checkpoint ... --seeds 0-19` renders images without it.
 
 
 # ### Step 2. Design Layers
 
+# > Inference mode : `MyLinear` and `MyConv2d` can be frozen, in which case the
+# equalized-lr scaling (and the fused upscale kernel) is computed once and cached.
+# The cache is keyed on the parameters' version counter and storage, so
+# `load_state_dict`, in-place updates or `.to(device)` invalidate it.
+
 # **2-a. Linear Layer**
 
 # In[2]:
 
 
-class MyLinear(nn.Module):
-    """Linear layer with equalized learning rate and custom learning rate multiplier."""
-    def __init__(self, input_size, output_size, gain=2**(0.5), use_wscale=False, lrmul=1, bias=True):
-        super().__init__()
-        he_std = gain * input_size**(-0.5) # He init
-        # Equalized learning rate and custom learning rate multiplier.
-        if use_wscale:
-            init_std = 1.0 / lrmul
-            self.w_mul = he_std * lrmul
-        else:
-            init_std = he_std / lrmul
-            self.w_mul = lrmul
-        self.weight = torch.nn.Parameter(torch.randn(output_size, input_size) * init_std)
-        if bias:
-            self.bias = torch.nn.Parameter(torch.zeros(output_size))
-            self.b_mul = lrmul
-        else:
-            self.bias = None
-
-    def forward(self, x):
-        bias = self.bias
-        if bias is not None:
-            bias = bias * self.b_mul
-        return F.linear(x, self.weight * self.w_mul, bias)
+from stylegan.networks import MyLinear
 
 
 # > With this Class, Targeted initialization is performed for each layer. 
@@ -113,60 +93,7 @@ F.linear(torch.randn(512,512), weight*w_mul, bias*b_mul)
 # In[10]:
 
 
-class MyConv2d(nn.Module):
-    """Conv layer with equalized learning rate and custom learning rate multiplier."""
-    def __init__(self, input_channels, output_channels, kernel_size, gain=2**(0.5), use_wscale=False, lrmul=1, bias=True,
-                intermediate=None, upscale=False):
-        super().__init__()
-        if upscale:
-            self.upscale = Upscale2d()
-        else:
-            self.upscale = None
-        he_std = gain * (input_channels * kernel_size ** 2) ** (-0.5) # He init
-        self.kernel_size = kernel_size
-        if use_wscale:
-            init_std = 1.0 / lrmul
-            self.w_mul = he_std * lrmul
-        else:
-            init_std = he_std / lrmul
-            self.w_mul = lrmul
-        self.weight = torch.nn.Parameter(torch.randn(output_channels, input_channels, kernel_size, kernel_size) * init_std)
-        if bias:
-            self.bias = torch.nn.Parameter(torch.zeros(output_channels))
-            self.b_mul = lrmul
-        else:
-            self.bias = None
-        self.intermediate = intermediate
-
-    def forward(self, x):
-        bias = self.bias
-        if bias is not None:
-            bias = bias * self.b_mul
-        
-        have_convolution = False
-        if self.upscale is not None and min(x.shape[2:]) * 2 >= 128:
-            # this is the fused upscale + conv from StyleGAN, sadly this seems incompatible with the non-fused way
-            # this really needs to be cleaned up and go into the conv...
-            w = self.weight * self.w_mul
-            w = w.permute(1, 0, 2, 3)
-            # probably applying a conv on w would be more efficient. also this quadruples the weight (average)?!
-            w = F.pad(w, (1,1,1,1))
-            w = w[:, :, 1:, 1:]+ w[:, :, :-1, 1:] + w[:, :, 1:, :-1] + w[:, :, :-1, :-1]
-            x = F.conv_transpose2d(x, w, stride=2, padding=(w.size(-1)-1)//2)
-            have_convolution = True
-        elif self.upscale is not None:
-            x = self.upscale(x)
-    
-        if not have_convolution and self.intermediate is None:
-            return F.conv2d(x, self.weight * self.w_mul, bias, padding=self.kernel_size//2)
-        elif not have_convolution:
-            x = F.conv2d(x, self.weight * self.w_mul, None, padding=self.kernel_size//2)
-        
-        if self.intermediate is not None:
-            x = self.intermediate(x)
-        if bias is not None:
-            x = x + bias.view(1, -1, 1, 1)
-        return x
+from stylegan.networks import MyConv2d
 
 
 # > Using the same metric(targeted initialization)
@@ -182,23 +109,20 @@ class MyConv2d(nn.Module):
 # In[11]:
 
 
-class NoiseLayer(nn.Module):
-    """adds noise. noise is per pixel (constant over channels) with per-channel weight"""
-    def __init__(self, channels):
-        super().__init__()
-        self.weight = nn.Parameter(torch.zeros(channels))
-        self.noise = None
-    
-    def forward(self, x, noise=None):
-        if noise is None and self.noise is None:
-            noise = torch.randn(x.size(0), 1, x.size(2), x.size(3), device=x.device, dtype=x.dtype)
-        elif noise is None:
-            # here is a little trick: if you get all the noiselayers and set each
-            # modules .noise attribute, you can have pre-defined noise.
-            # Very useful for analysis
-            noise = self.noise
-        x = x + self.weight.view(1, -1, 1, 1) * noise
-        return x
+from stylegan.networks import NoiseLayer
+
+
+# > Noise bank : instead of fresh `torch.randn` at every call, noise planes are addressed by
+# (seed, layer) and drawn on the device from a generator seeded with both. The noise of a sample
+# then only depends on its own seed, not on the batch it is rendered in.
+# - 'seeded' : per-sample planes from (seed of the sample, layer), optionally memoized
+# - 'cached' : one plane per layer from the bank seed, computed once and shared by the whole batch
+# - 'const' : user supplied planes (e.g. the noise variables of the official model), no noise if none
+
+# In[ ]:
+
+
+from stylegan.noise import NoiseBank
 
 
 # ![image](https://bloglunit.files.wordpress.com/2019/02/1_gwchaliormc1xlj7bh0zmg.png)
@@ -211,19 +135,7 @@ class NoiseLayer(nn.Module):
 # In[12]:
 
 
-class StyleMod(nn.Module):
-    def __init__(self, latent_size, channels, use_wscale):
-        super(StyleMod, self).__init__()
-        self.lin = MyLinear(latent_size,
-                            channels * 2,
-                            gain=1.0, use_wscale=use_wscale)
-        
-    def forward(self, x, latent):
-        style = self.lin(latent) # style => [batch_size, n_channels*2]
-        shape = [-1, 2, x.size(1)] + (x.dim() - 2) * [1]
-        style = style.view(shape)  # [batch_size, 2, n_channels, ...]
-        x = x * (style[:, 0] + 1.) + style[:, 1]
-        return x
+from stylegan.networks import StyleMod
 
 
 # ![image](https://bloglunit.files.wordpress.com/2019/02/0_uqn4slmhrfykfmjs.png)
@@ -255,12 +167,7 @@ latent.size()
 # In[16]:
 
 
-class PixelNormLayer(nn.Module):
-    def __init__(self, epsilon=1e-8):
-        super().__init__()
-        self.epsilon = epsilon
-    def forward(self, x):
-        return x * torch.rsqrt(torch.mean(x**2, dim=1, keepdim=True) + self.epsilon)
+from stylegan.networks import PixelNormLayer
 
 
 # **2-f. Blur Layer**
@@ -268,31 +175,7 @@ class PixelNormLayer(nn.Module):
 # In[17]:
 
 
-class BlurLayer(nn.Module):
-    def __init__(self, kernel=[1, 2, 1], normalize=True, flip=False, stride=1):
-        super(BlurLayer, self).__init__()
-        kernel=[1, 2, 1]
-        kernel = torch.tensor(kernel, dtype=torch.float32)
-        kernel = kernel[:, None] * kernel[None, :]
-        kernel = kernel[None, None]
-        if normalize:
-            kernel = kernel / kernel.sum()
-        if flip:
-            kernel = kernel[:, :, ::-1, ::-1]
-        self.register_buffer('kernel', kernel)
-        self.stride = stride
-    
-    def forward(self, x):
-        # expand kernel channels
-        kernel = self.kernel.expand(x.size(1), -1, -1, -1)
-        x = F.conv2d(
-            x,
-            kernel,
-            stride=self.stride,
-            padding=int((self.kernel.size(2)-1)/2),
-            groups=x.size(1)
-        )
-        return x
+from stylegan.networks import BlurLayer
 
 
 # **2-g. Upscaling Layer**
@@ -300,24 +183,7 @@ class BlurLayer(nn.Module):
 # In[18]:
 
 
-def upscale2d(x, factor=2, gain=1):
-    assert x.dim() == 4
-    if gain != 1:
-        x = x * gain
-    if factor != 1:
-        shape = x.shape
-        x = x.view(shape[0], shape[1], shape[2], 1, shape[3], 1).expand(-1, -1, -1, factor, -1, factor)
-        x = x.contiguous().view(shape[0], shape[1], factor * shape[2], factor * shape[3])
-    return x
-
-class Upscale2d(nn.Module):
-    def __init__(self, factor=2, gain=1):
-        super().__init__()
-        assert isinstance(factor, int) and factor >= 1
-        self.gain = gain
-        self.factor = factor
-    def forward(self, x):
-        return upscale2d(x, factor=self.factor, gain=self.gain)
+from stylegan.networks import upscale2d, Upscale2d
 
 
 # ### Step 3. Design Networks
@@ -327,36 +193,7 @@ class Upscale2d(nn.Module):
 # In[19]:
 
 
-class G_mapping(nn.Sequential):
-    def __init__(self, nonlinearity='lrelu', use_wscale=True):
-        act, gain = {'relu': (torch.relu, np.sqrt(2)),
-                     'lrelu': (nn.LeakyReLU(negative_slope=0.2), np.sqrt(2))}[nonlinearity]
-        layers = [
-            ('pixel_norm', PixelNormLayer()),
-            ('dense0', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
-            ('dense0_act', act),
-            ('dense1', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
-            ('dense1_act', act),
-            ('dense2', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
-            ('dense2_act', act),
-            ('dense3', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
-            ('dense3_act', act),
-            ('dense4', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
-            ('dense4_act', act),
-            ('dense5', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
-            ('dense5_act', act),
-            ('dense6', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
-            ('dense6_act', act),
-            ('dense7', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
-            ('dense7_act', act)
-        ]
-        super().__init__(OrderedDict(layers))
-        
-    def forward(self, x):
-        x = super().forward(x)
-        # Broadcast
-        x = x.unsqueeze(1).expand(-1, 18, -1)
-        return x
+from stylegan.networks import G_mapping
 
 
 # > sampling latent `z`(gaussian distribution) --> return `w` vector
@@ -364,20 +201,20 @@ class G_mapping(nn.Sequential):
 # > style information is contained in `w`
 # 
 
+# > `G_mapping` returns compact dlatents : one W per sample instead of 18 copies of it.
+# Per-layer differences (truncation, style mixing, ...) are stored as extra vectors,
+# each layer pointing to the vector it uses. `.dense()` gives the usual [batch, 18, 512] tensor.
+
+# In[ ]:
+
+
+from stylegan.networks import DLatents
+
+
 # In[20]:
 
 
-class Truncation(nn.Module):
-    def __init__(self, avg_latent, max_layer=8, threshold=0.7):
-        super().__init__()
-        self.max_layer = max_layer
-        self.threshold = threshold
-        self.register_buffer('avg_latent', avg_latent)
-    def forward(self, x):
-        assert x.dim() == 3
-        interp = torch.lerp(self.avg_latent, x, self.threshold)
-        do_trunc = (torch.arange(x.size(1)) < self.max_layer).view(1, -1, 1)
-        return torch.where(do_trunc, interp, x)
+from stylegan.networks import Truncation
 
 
 # **3-b. Generator Synthesis Blocks**
@@ -385,86 +222,19 @@ class Truncation(nn.Module):
 # In[21]:
 
 
-class LayerEpilogue(nn.Module):
-    """Things to do at the end of each layer."""
-    def __init__(self, channels, dlatent_size, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer):
-        super().__init__()
-        layers = []
-        if use_noise:
-            layers.append(('noise', NoiseLayer(channels)))
-        layers.append(('activation', activation_layer))
-        if use_pixel_norm:
-            layers.append(('pixel_norm', PixelNorm()))
-        if use_instance_norm:
-            layers.append(('instance_norm', nn.InstanceNorm2d(channels)))
-        self.top_epi = nn.Sequential(OrderedDict(layers))
-        if use_styles:
-            self.style_mod = StyleMod(dlatent_size, channels, use_wscale=use_wscale)
-        else:
-            self.style_mod = None
-    def forward(self, x, dlatents_in_slice=None):
-        x = self.top_epi(x)
-        if self.style_mod is not None:
-            x = self.style_mod(x, dlatents_in_slice)
-        else:
-            assert dlatents_in_slice is None
-        return x
+from stylegan.networks import LayerEpilogue
 
 
 # In[22]:
 
 
-class InputBlock(nn.Module):
-    def __init__(self, nf, dlatent_size, const_input_layer, gain, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer):
-        super().__init__()
-        self.const_input_layer = const_input_layer
-        self.nf = nf
-        if self.const_input_layer:
-            # called 'const' in tf
-            self.const = nn.Parameter(torch.ones(1, nf, 4, 4))
-            self.bias = nn.Parameter(torch.ones(nf))
-        else:
-            self.dense = MyLinear(dlatent_size, nf*16, gain=gain/4, use_wscale=use_wscale) # tweak gain to match the official implementation of Progressing GAN
-        self.epi1 = LayerEpilogue(nf, dlatent_size, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer)
-        self.conv = MyConv2d(nf, nf, 3, gain=gain, use_wscale=use_wscale)
-        self.epi2 = LayerEpilogue(nf, dlatent_size, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer)
-        
-    def forward(self, dlatents_in_range):
-        batch_size = dlatents_in_range.size(0)
-        if self.const_input_layer:
-            x = self.const.expand(batch_size, -1, -1, -1)
-            x = x + self.bias.view(1, -1, 1, 1)
-        else:
-            x = self.dense(dlatents_in_range[:, 0]).view(batch_size, self.nf, 4, 4)
-        x = self.epi1(x, dlatents_in_range[:, 0])
-        x = self.conv(x)
-        x = self.epi2(x, dlatents_in_range[:, 1])
-        return x
+from stylegan.networks import InputBlock
 
 
 # In[23]:
 
 
-class GSynthesisBlock(nn.Module):
-    def __init__(self, in_channels, out_channels, blur_filter, dlatent_size, gain, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer):
-        # 2**res x 2**res # res = 3..resolution_log2
-        super().__init__()
-        if blur_filter:
-            blur = BlurLayer(blur_filter)
-        else:
-            blur = None
-        self.conv0_up = MyConv2d(in_channels, out_channels, kernel_size=3, gain=gain, use_wscale=use_wscale,
-                                 intermediate=blur, upscale=True)
-        self.epi1 = LayerEpilogue(out_channels, dlatent_size, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer)
-        self.conv1 = MyConv2d(out_channels, out_channels, kernel_size=3, gain=gain, use_wscale=use_wscale)
-        self.epi2 = LayerEpilogue(out_channels, dlatent_size, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer)
-            
-    def forward(self, x, dlatents_in_range):
-        x = self.conv0_up(x)
-        x = self.epi1(x, dlatents_in_range[:, 0])
-        x = self.conv1(x)
-        x = self.epi2(x, dlatents_in_range[:, 1])
-        return x
+from stylegan.networks import GSynthesisBlock
 
 
 # **3-c. Generator Synthesis Network**
@@ -472,67 +242,12 @@ class GSynthesisBlock(nn.Module):
 # In[24]:
 
 
-class G_synthesis(nn.Module):
-    def __init__(self,
-        dlatent_size        = 512,          # Disentangled latent (W) dimensionality.
-        num_channels        = 3,            # Number of output color channels.
-        resolution          = 1024,         # Output resolution.
-        fmap_base           = 8192,         # Overall multiplier for the number of feature maps.
-        fmap_decay          = 1.0,          # log2 feature map reduction when doubling the resolution.
-        fmap_max            = 512,          # Maximum number of feature maps in any layer.
-        use_styles          = True,         # Enable style inputs?
-        const_input_layer   = True,         # First layer is a learned constant?
-        use_noise           = True,         # Enable noise inputs?
-        randomize_noise     = True,         # True = randomize noise inputs every time (non-deterministic), False = read noise inputs from variables.
-        nonlinearity        = 'lrelu',      # Activation function: 'relu', 'lrelu'
-        use_wscale          = True,         # Enable equalized learning rate?
-        use_pixel_norm      = False,        # Enable pixelwise feature vector normalization?
-        use_instance_norm   = True,         # Enable instance normalization?
-        dtype               = torch.float32,  # Data type to use for activations and outputs.
-        blur_filter         = [1,2,1],      # Low-pass filter to apply when resampling activations. None = no filtering.
-        ):
-        
-        super().__init__()
-        def nf(stage):
-            return min(int(fmap_base / (2.0 ** (stage * fmap_decay))), fmap_max)
-        self.dlatent_size = dlatent_size
-        resolution_log2 = int(np.log2(resolution))
-        assert resolution == 2**resolution_log2 and resolution >= 4
-
-        act, gain = {'relu': (torch.relu, np.sqrt(2)),
-                     'lrelu': (nn.LeakyReLU(negative_slope=0.2), np.sqrt(2))}[nonlinearity]
-        num_layers = resolution_log2 * 2 - 2
-        num_styles = num_layers if use_styles else 1
-        torgbs = []
-        blocks = []
-        for res in range(2, resolution_log2 + 1):
-            channels = nf(res-1)
-            name = '{s}x{s}'.format(s=2**res)
-            if res == 2:
-                blocks.append((name,
-                               InputBlock(channels, dlatent_size, const_input_layer, gain, use_wscale,
-                                      use_noise, use_pixel_norm, use_instance_norm, use_styles, act)))
-                
-            else:
-                blocks.append((name,
-                               GSynthesisBlock(last_channels, channels, blur_filter, dlatent_size, gain, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, act)))
-            last_channels = channels
-        self.torgb = MyConv2d(channels, num_channels, 1, gain=1, use_wscale=use_wscale)
-        self.blocks = nn.ModuleDict(OrderedDict(blocks))
-        
-    def forward(self, dlatents_in):
-        # Input: Disentangled latents (W) [minibatch, num_layers, dlatent_size].
-        # lod_in = tf.cast(tf.get_variable('lod', initializer=np.float32(0), trainable=False), dtype)
-        batch_size = dlatents_in.size(0)       
-        for i, m in enumerate(self.blocks.values()):
-            if i == 0:
-                x = m(dlatents_in[:, 2*i:2*i+2])
-            else:
-                x = m(x, dlatents_in[:, 2*i:2*i+2])
-        rgb = self.torgb(x)
-        return rgb
+from stylegan.networks import G_synthesis
 
 
+# > Tiled execution : g_synthesis.set_tiling(tile_size) renders the large blocks by tiles with
+# their halo, so the peak memory does not grow with the resolution (see stylegan/networks.py).
+
 # ### Step 4. Define the Model (Image Generator)
 
 # **4-a. data flow : z to image**
@@ -540,15 +255,37 @@ class G_synthesis(nn.Module):
 # In[25]:
 
 
-g_all = nn.Sequential(OrderedDict([
-    ('g_mapping', G_mapping()),
-    ('g_synthesis', G_synthesis())    
-]))
+from stylegan.networks import G_style
+
+
+g_all = G_style(G_mapping(), G_synthesis())
 
 
 # > If latent z is put into g_mapping network, w is returned, and if the returned w is put into g_synthesis, an image is created. This process is chained sequentially and occurs one after another.
 
-# **4-b. load pre-trained weight**
+# **4-b. inference mode**
+
+# In[26]:
+
+
+from stylegan.networks import freeze
+from stylegan.render import to_uint8
+
+
+# **4-c. generation service**
+
+# > Single-image requests (seed or z, truncation psi, noise seed) from many asyncio clients are
+# coalesced into batches : a batch leaves when it is full or max_delay after its oldest request.
+# Inference runs on a worker thread, so the event loop keeps accepting requests meanwhile.
+# The queue is bounded : when it is full, generate() waits (or raises QueueFull with wait=False).
+
+# In[ ]:
+
+
+from stylegan.serve import GenerationService
+
+
+# **4-d. load pre-trained weight**
 
 # In[29]:
 
@@ -563,10 +300,59 @@ import os
 #os.listdir('./ffhq-1024x1024-pretrained')
 
 
+# > `python -m stylegan bench freeze|serve|load|startup` times the frozen mode, the generation
+# service, the checkpoint loading and the import of the package (random weights are fine for that)
+
+# > Blob checkpoint : an 8 byte magic, the 8 byte length of a JSON index, the index, then every
+# tensor at a 64 byte aligned offset. It is memory-mapped copy-on-write and the mapped tensors
+# become the model parameters (load_state_dict(assign=True)), so nothing is deserialized or copied
+# and the processes of a host share the weights through the page cache.
+
+# In[ ]:
+
+
+from stylegan.checkpoint import blob_path, load_blob, convert_tf_pickle
+
+
+# > Converter from the official pickle (karras2019stylegan-ffhq-1024x1024.pkl). The dnnlib Network
+# objects are unpickled into plain state holders, so neither TensorFlow nor dnnlib are needed.
+# The constant noise inputs are kept in the blob as const_noise.N (see NoiseBank('const')) and
+# dlatent_avg is saved as the avg_latent of the checkpoint (see 4-e).
+
+# In[ ]:
+
+
+# > With a .blob next to the checkpoint (first created by convert_tf_pickle or save_blob),
+# it is used instead of torch.load.
+
 # In[32]:
 
 EKO()
-g_all.load_state_dict(torch.load('./karras2019stylegan-ffhq-1024x1024.for_g_all.pt'))
+checkpoint = './karras2019stylegan-ffhq-1024x1024.for_g_all.pt'
+if os.path.exists(blob_path(checkpoint)):
+    load_blob(g_all, blob_path(checkpoint))
+else:
+    g_all.load_state_dict(torch.load(checkpoint))
+
+
+# **4-e. average w for the truncation trick**
+
+# > The W-space mean is estimated by streaming z through g_mapping with a float64 running sum
+# (constant memory), optionally sharded over worker processes, and saved next to the checkpoint
+# (`python -m stylegan avg-latent`). It is loaded here when it exists; truncation stays opt-in,
+# per call : `g_all(latents, psi=0.7)`. The images below are untruncated.
+
+# In[ ]:
+
+
+from stylegan.avg_latent import avg_latent_path, load_avg_latent
+
+
+# In[ ]:
+
+EKO()
+if os.path.exists(avg_latent_path(checkpoint)):
+    g_all.truncation.avg_latent = load_avg_latent(checkpoint)
 
 
 # ### Step 5. Test the Model
@@ -579,6 +365,7 @@ g_all.load_state_dict(torch.load('./karras2019stylegan-ffhq-1024x1024.for_g_all.
 device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
 g_all.eval()
 g_all.to(device)
+freeze(g_all)
 
 
 # In[44]:
@@ -622,6 +409,7 @@ latents.shape
 
 import torchvision
 import matplotlib.pyplot as plt
+from facenet_pytorch import MTCNN, InceptionResnetV1
 
 
 # In[50]:
@@ -640,7 +428,7 @@ EKOX(TYPE(img))
 image_size, margin=512, 12
 
 mtcnn = MTCNN(image_size=image_size, margin=margin)
-resnet = InceptionResnetV1(pretrained='vggface2').eval().cuda()
+resnet = InceptionResnetV1(pretrained='vggface2').eval().to(device)
 from PIL import Image
 img = Image.fromarray((img*255).astype(np.uint8))
 
@@ -753,7 +541,7 @@ plt.show()
 # In[ ]:
 
 
-g_mapping = g_all[0] # We can extract mapping network like this.
+g_mapping = g_all[0] # We can extract mapping network like this. (or g_all.g_mapping)
 g_mapping
 
 
@@ -805,14 +593,23 @@ plt.show()
 
 # **6-e. Image Interpolation Comparison**
 
+# > Interpolation paths are generated lazily, a batch of frames at a time, so a long walk
+# costs one batch of latents and images in memory. Keyframes are either z / w tensors
+# [K, 512] or DLatents with K samples (interpolated on their vectors).
+
+# In[ ]:
+
+
+from stylegan.render import latent_path, render_frames, write_png_sequence
+
+
 # In[ ]:
 
 
 itp_imgs = []
 
 with torch.no_grad():
-    for a in np.linspace(0, 1, 10):
-        z = ((1-a) * latent1) + (a * latent2)
+    for z in latent_path(torch.cat([latent1, latent2]), 9, batch_size=10):
         result = g_all(z)
         result = result.clamp(-1,1)+1/2.0
         result = result.cpu()
@@ -853,8 +650,7 @@ plt.show()
 itp_imgs2 = []
 
 with torch.no_grad():
-    for a in np.linspace(0, 1, 10):
-        w = ((1-a) * w_1) + (a * w_2)
+    for w in latent_path(DLatents.cat([w_1, w_2]), 9, batch_size=10):
         result2 = g_synthesis(w)
         result2 = result2.clamp(-1,1)+1/2.0
         result2 = result2.cpu()
@@ -889,6 +685,19 @@ plt.axis('off')
 plt.show()
 
 
+# **6-f. streaming walk**
+
+# > A looping slerp walk through 8 random z, 60 frames per keyframe, written as a png sequence.
+# Memory stays at one batch whatever the number of frames.
+
+# In[ ]:
+
+
+keyframes = torch.randn(8, 512, device=device)
+NoiseBank('cached').attach(g_all)
+write_png_sequence(render_frames(g_all, latent_path(keyframes, 60, method='slerp', loop=True, batch_size=8)), 'walk')
+
+
 # Yes. It's so much more natural! Here we can see the strengths of stylegan. The traditional image generation model immediately generates an image from a random vector(gaussian distribution) z. That have showed how high the degree of freedom is, in other words, the low degree of feature separation(**It is said to be entangled**). stylegan captured this core 'style' through the mapping network, and we confirmed this through the interpolation results. 
 # 
 # in Abstract..
@@ -0,0 +1,42 @@
+"""StyleGAN generator (pytorch port of the official ffhq model).
+
+The submodules are imported on first attribute access, so `import stylegan` stays cheap
+(no torch) until something is actually used.
+"""
+import importlib
+
+_EXPORTS = {
+    'networks': ['MyLinear', 'MyConv2d', 'NoiseLayer', 'StyleMod', 'PixelNormLayer', 'BlurLayer', 'Upscale2d',
+                 'upscale2d', 'G_mapping', 'DLatents', 'Truncation', 'LayerEpilogue', 'InputBlock',
+                 'GSynthesisBlock', 'G_synthesis', 'G_style', 'freeze'],
+    'noise': ['NoiseBank'],
+    'render': ['to_uint8', 'slerp', 'latent_path', 'render_frames', 'write_png_sequence', 'write_video'],
+    'serve': ['GenerationService'],
+    'checkpoint': ['save_blob', 'open_blob', 'load_blob', 'blob_path', 'convert_tf_pickle'],
+    'avg_latent': ['estimate_avg_latent', 'load_avg_latent', 'avg_latent_path'],
+    'profiling': ['instrument'],
+    'export': ['StaticGenerator', 'export_generator', 'load_generator', 'check_parity'],
+    'int8': ['calibrate', 'quantize', 'dequantize', 'quantization_report'],
+    'dataset': ['generate_dataset', 'render_shard'],
+    'encode': ['EncodePool', 'encode_image'],
+    'embed': ['FaceEmbedder', 'EmbeddingCache', 'embed_seeds', 'state_hash'],
+    'index': ['VectorIndex', 'index_dataset', 'kmeans'],
+    'project': ['Projector', 'w_mean'],
+    'prefix': ['PrefixCache', 'style_mixing_grid'],
+    'memory': ['MemoryPlanner'],
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_MODULES)
+
+
+def __getattr__(name):
+    if name not in _MODULES:
+        raise AttributeError("module 'stylegan' has no attribute %r" % name)
+    value = getattr(importlib.import_module('.' + _MODULES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,249 @@
+"""Static shape execution of G_synthesis, for workers calling it with the same batch size.
+
+    g_all.g_synthesis.set_static()
+    with torch.no_grad():
+        for z in batches:        # same batch size each time
+            images = g_all(z)    # a view of the arena : consume it before the next call
+
+The dynamic forward allocates and frees every activation of every layer at each call (upscale
+copies, conv and blur outputs, epilogue intermediates) : gigabytes per call at 1024x1024, which on
+CPU means page faults and a fragmented heap. An Arena is planned once per (batch size, dtype,
+device) and runs the synthesis in buffers it owns :
+ - two ping-pong slabs for the activations. A block reads its input in slab 0, its upscale conv
+   writes slab 1 and its second conv writes the block output back in slab 0;
+ - two scratch slabs for the upscale intermediates, the float32 copies the instance norm
+   statistics of reduced precision activations and torgb read, and the 4x4 block;
+ - the per-(sample, channel) statistics, the random noise planes and the output image.
+Slabs are sized for the largest level and each level views their head. The buffers are
+channels_last : on CPU the convolutions write their buffer with oneDNN's in place conv + add
+(zeroed first), the one convolution that does not allocate its output. Elsewhere they fall back
+to conv + copy_. Epilogues run in place (LayerEpilogue.fused_forward arithmetic), upscales and
+phase interleaving write into their buffer. allocations() counts what a call still allocates.
+
+Same output as the dynamic forward within float rounding. Autograd, tiling and crop use the
+dynamic forward.
+"""
+import torch
+import torch.nn.functional as F
+
+from .networks import REDUCED_DTYPES, _foldable, _params_key, polyphase_weight, resample_edges
+
+
+def _has_inplace_conv():
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._convolution_pointwise_.binary is not None
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def _view(slab, shape, dtype):
+    """channels_last [b, c, h, w] tensor of dtype at the head of slab"""
+    b, c, h, w = shape
+    return slab.view(dtype)[:b * c * h * w].view(b, h, w, c).permute(0, 3, 1, 2)
+
+
+def _nbytes(shape, dtype):
+    n = 1
+    for d in shape:
+        n *= d
+    return -(-n * torch.empty((), dtype=dtype).element_size() // 8) * 8
+
+
+def allocations(fn, *args, **kwargs):
+    """(count, bytes) of the tensors allocated by fn(*args, **kwargs), from the profiler memory events"""
+    from torch.profiler import ProfilerActivity, profile
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn(*args, **kwargs)
+    sizes = [e.self_cpu_memory_usage for e in prof.events() if e.self_cpu_memory_usage > 0]
+    if torch.cuda.is_available():
+        sizes += [e.self_device_memory_usage for e in prof.events() if e.self_device_memory_usage > 0]
+    return len(sizes), sum(sizes)
+
+
+class Arena:
+    def __init__(self, g_synthesis, batch_size, device):
+        self.key = _params_key(*g_synthesis.parameters())
+        self.batch_size = batch_size
+        self.dtype = g_synthesis.dtype
+        self.device = torch.device(device)
+        self.inplace = self.device.type == 'cpu' and self.dtype in (torch.float32, torch.bfloat16) and _has_inplace_conv()
+        cl = torch.channels_last
+        sizes = [0, 0, 0, 0] # slab 0, slab 1, scratch 0, scratch 1 (bytes)
+
+        def need(slab, shape, dtype):
+            sizes[slab] = max(sizes[slab], _nbytes(shape, dtype))
+            return (slab, shape, dtype)
+
+        def small(shape, dtype=torch.float32):
+            return torch.empty(shape, dtype=dtype, device=self.device)
+
+        with torch.no_grad():
+            self.levels = []
+            b = batch_size
+            for i, block in enumerate(g_synthesis.blocks.values()):
+                size = 2**(i + 2)
+                dtype = torch.float32 if i == 0 else self.dtype
+                c = (block.conv if i == 0 else block.conv1).weight.size(0)
+                level = {'size': size, 'channels': c, 'dtype': dtype,
+                         'stats': (small((b, c, 1, 1)), small((b, c, 1, 1))),
+                         'noise': small((b, 1, size, size), dtype),
+                         'inv_n': torch.tensor(1 / size**2, device=self.device),
+                         'epi': [self._epilogue_params(epi, dtype) for epi in (block.epi1, block.epi2)]}
+                if i == 0:
+                    level['const'] = (block.const + block.bias.view(1, -1, 1, 1)).detach()
+                    level['y'] = need(1, (b, c, size, size), dtype)
+                    level['t'] = need(2, (b, c, size, size), dtype)
+                    level['x'] = need(0, (b, c, size, size), self.dtype)
+                    level['conv'] = self._conv_params(block.conv, dtype)
+                else:
+                    level['y'] = need(1, (b, c, size, size), dtype)
+                    level['x'] = need(0, (b, c, size, size), dtype)
+                    level['conv'] = self._conv_params(block.conv1, dtype)
+                    level['up'] = self._upconv_plan(block.conv0_up, self.levels[-1]['channels'], c, size, dtype, need)
+                if dtype in REDUCED_DTYPES:
+                    level['stats_in'] = need(2, (b, c, size, size), torch.float32)
+                    level['stats_x'] = tuple(small((b, c, 1, 1), dtype) for _ in range(3))
+                self.levels.append(level)
+            last = self.levels[-1]
+            size, c = last['size'], last['channels']
+            if self.dtype in REDUCED_DTYPES:
+                self.torgb_in = need(2, (b, c, size, size), torch.float32)
+            self.torgb = self._conv_params(g_synthesis.torgb, torch.float32)
+            n_rgb = g_synthesis.torgb.weight.size(0)
+            self.rgb_cl = small((b, n_rgb, size, size)).contiguous(memory_format=cl)
+            self.rgb = small((b, n_rgb, size, size))
+            self.slabs = [torch.empty(n, dtype=torch.uint8, device=self.device) for n in sizes]
+
+    def nbytes(self):
+        tensors = self.slabs + [self.rgb, self.rgb_cl] + [t for level in self.levels for t in level['stats']]
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def _buffer(self, spec):
+        slab, shape, dtype = spec
+        return _view(self.slabs[slab], shape, dtype)
+
+    def _cl(self, weight, dtype):
+        return weight.detach().to(dtype).contiguous(memory_format=torch.channels_last)
+
+    def _conv_params(self, conv, dtype):
+        weight, bias = conv.scaled_params()
+        return self._cl(weight, dtype), None if bias is None else bias.detach().to(dtype), conv.kernel_size // 2
+
+    def _epilogue_params(self, epi, dtype):
+        if not epi.fusable():
+            raise NotImplementedError('static execution needs the [noise,] lrelu, instance norm epilogue')
+        layers = epi.top_epi._modules
+        noise = layers.get('noise')
+        return {'noise': noise, 'noise_weight': None if noise is None else noise.weight.detach().view(1, -1, 1, 1).to(dtype),
+                'slope': layers['activation'].negative_slope,
+                'eps': torch.tensor(layers['instance_norm'].eps, device=self.device)}
+
+    def _upconv_plan(self, conv, c_in, c, size, dtype, need):
+        """the upscale + conv (+ blur) of a block, with the same fused / folded choice as MyConv2d"""
+        b, half = self.batch_size, size // 2
+        fused = size >= conv.fuse_min_size
+        blur = conv.intermediate
+        plan = {'blur': None}
+        if blur is not None:
+            assert blur.stride == 1
+            plan['blur'] = (self._cl(blur.kernel.expand(c, -1, -1, -1), dtype), (blur.kernel.size(-1) - 1) // 2)
+        if size >= conv.fold_min_size and _foldable(blur):
+            weight, bias, edges = conv.folded_params(fused)
+            plan.update(mode='folded', weight=self._cl(weight, dtype), bias=bias.detach().to(dtype),
+                        edges=[(k.detach().to(dtype), e.detach().to(dtype)) for k, e in edges],
+                        phases=need(2, (b, 4 * c, half, half), dtype))
+            return plan
+        weight, bias = conv.scaled_params(fused)
+        plan['bias'] = None if bias is None else bias.detach().to(dtype)
+        if blur is not None:
+            plan['conv_out'] = need(3, (b, c, size, size), dtype)
+        if fused:
+            plan.update(mode='fused', weight=self._cl(polyphase_weight(weight), dtype),
+                        phases=need(2, (b, 4 * c, half + 1, half + 1), dtype))
+        else:
+            plan.update(mode='unfused', weight=self._cl(weight, dtype), padding=conv.kernel_size // 2,
+                        upscaled=need(2, (b, c_in, size, size), dtype))
+        return plan
+
+    def _conv(self, out, x, weight, bias, padding, groups=1):
+        if self.inplace:
+            out.zero_()
+            return torch.ops.mkldnn._convolution_pointwise_.binary(out, x, weight, bias, [padding, padding], [1, 1],
+                                                                   [1, 1], groups, 'add', None, None, [], None)
+        return out.copy_(F.conv2d(x, weight, bias, padding=padding, groups=groups))
+
+    def _upconv(self, plan, x, y):
+        c = y.size(1)
+        h, w = x.shape[2:]
+        if plan['mode'] == 'folded':
+            phases = self._conv(self._buffer(plan['phases']), x, plan['weight'], plan['bias'], 1)
+            for a in (0, 1):
+                for b in (0, 1):
+                    y[:, :, a::2, b::2].copy_(phases[:, 2 * a + b::4]) # pixel_shuffle
+            resample_edges(x, y, plan['edges'])
+            return y
+        out = y if plan['blur'] is None else self._buffer(plan['conv_out'])
+        if plan['mode'] == 'fused':
+            phases = self._conv(self._buffer(plan['phases']), x, plan['weight'], None, 1)
+            for k, (a, b) in enumerate(((0, 0), (0, 1), (1, 0), (1, 1))):
+                out[:, :, a::2, b::2].copy_(phases[:, k * c:(k + 1) * c, a:a + h, b:b + w])
+            if plan['blur'] is None and plan['bias'] is not None:
+                out.add_(plan['bias'].view(1, -1, 1, 1))
+        else:
+            upscaled = self._buffer(plan['upscaled'])
+            torch.ops.aten.upsample_nearest2d.out(x, [2 * h, 2 * w], out=upscaled)
+            self._conv(out, upscaled, plan['weight'], plan['bias'] if plan['blur'] is None else None, plan['padding'])
+        if plan['blur'] is not None:
+            kernel, padding = plan['blur']
+            self._conv(y, out, kernel, plan['bias'], padding, groups=c)
+        return y
+
+    def _epilogue(self, params, x, style, level):
+        """LayerEpilogue.fused_forward in place, with float32 statistics"""
+        noise_layer = params['noise']
+        if noise_layer is not None:
+            if noise_layer.noise is not None:
+                noise = noise_layer.noise
+            elif noise_layer.noise_bank is not None:
+                noise = noise_layer.noise_bank.noise(noise_layer.noise_index, x)
+            else:
+                noise = level['noise'].normal_()
+            if noise is not None:
+                x.addcmul_(params['noise_weight'], noise)
+        F.leaky_relu(x, params['slope'], inplace=True)
+        scale, mean = level['stats']
+        src = x if x.dtype not in REDUCED_DTYPES else self._buffer(level['stats_in']).copy_(x)
+        torch.sum(src, (2, 3), keepdim=True, out=mean).mul_(level['inv_n']) # torch.mean(out=) allocates
+        torch.var(src, (2, 3), correction=0, keepdim=True, out=scale).add_(params['eps']).rsqrt_()
+        shift = None
+        if style is not None:
+            style = style.view(-1, 2, x.size(1), 1, 1)
+            torch.addcmul(scale, scale, style[:, 0], out=scale) # scale * (s0 + 1)
+            shift = style[:, 1]
+        if src is not x:
+            # reduced precision : in place ops mixing x and float32 operands allocate a float32 x
+            mean_x, scale_x, shift_x = level['stats_x']
+            mean, scale = mean_x.copy_(mean), scale_x.copy_(scale)
+            shift = None if shift is None else shift_x.copy_(shift)
+        x.sub_(mean)
+        if shift is None:
+            return x.mul_(scale)
+        return torch.addcmul(shift, x, scale, out=x)
+
+    def __call__(self, styles):
+        """g_synthesis output for the per-layer styles of G_synthesis.styles (a view of the arena)"""
+        for i, level in enumerate(self.levels):
+            if i == 0:
+                y = self._buffer(level['y']).copy_(level['const'])
+                self._epilogue(level['epi'][0], y, styles[0], level)
+                t = self._conv(self._buffer(level['t']), y, *level['conv'])
+                self._epilogue(level['epi'][1], t, styles[1], level)
+                x = self._buffer(level['x']).copy_(t)
+                continue
+            y = self._upconv(level['up'], x, self._buffer(level['y']))
+            self._epilogue(level['epi'][0], y, styles[2 * i], level)
+            x = self._conv(self._buffer(level['x']), y, *level['conv']) # overwrites the block input
+            self._epilogue(level['epi'][1], x, styles[2 * i + 1], level)
+        if x.dtype in REDUCED_DTYPES:
+            x = self._buffer(self.torgb_in).copy_(x)
+        return self.rgb.copy_(self._conv(self.rgb_cl, x, *self.torgb))
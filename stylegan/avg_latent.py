@@ -0,0 +1,68 @@
+"""W-space mean for the truncation trick.
+
+It is estimated by streaming z through g_mapping with a float64 running sum (constant memory),
+optionally sharded over worker processes, and saved next to the checkpoint.
+"""
+import os
+
+import torch
+
+from .networks import DLatents
+
+
+def _avg_latent_shard(g_mapping, nb_samples, batch_size, seed, device):
+    """float64 sum of g_mapping(z) over nb_samples z drawn from seed"""
+    generator = torch.Generator().manual_seed(seed)
+    total = torch.zeros(512, dtype=torch.float64, device=device)
+    with torch.no_grad():
+        for start in range(0, nb_samples, batch_size):
+            z = torch.randn(min(batch_size, nb_samples - start), 512, generator=generator).to(device)
+            w = g_mapping(z)
+            w = w.vectors[:, 0] if isinstance(w, DLatents) else w[:, 0]
+            total += w.sum(0, dtype=torch.float64)
+    return total
+
+
+_avg_latent_worker = {}
+
+
+def _avg_latent_init(g_mapping, nb_threads):
+    _avg_latent_worker['g_mapping'] = g_mapping
+    torch.set_num_threads(nb_threads)
+
+
+def _avg_latent_job(args):
+    return _avg_latent_shard(_avg_latent_worker['g_mapping'], *args)
+
+
+def estimate_avg_latent(g_mapping, nb_samples=1000000, batch_size=8192, seed=0, nb_workers=1, device='cpu'):
+    """mean of g_mapping(z), z ~ N(0, I). shards of shard_size samples are seeded by (seed, shard index),
+    so the result does not depend on nb_workers (up to the order of the float64 sums)."""
+    g_mapping = g_mapping.eval()
+    shard_size = batch_size * 16
+    jobs = [(min(shard_size, nb_samples - start), batch_size, seed * 1000003 + i, device)
+            for i, start in enumerate(range(0, nb_samples, shard_size))]
+    if nb_workers > 1:
+        import multiprocessing
+        nb_threads = max(1, torch.get_num_threads() // nb_workers)
+        # fork : the workers inherit g_mapping instead of unpickling it
+        with multiprocessing.get_context('fork').Pool(nb_workers, _avg_latent_init, (g_mapping, nb_threads)) as pool:
+            sums = pool.map(_avg_latent_job, jobs)
+    else:
+        sums = [_avg_latent_shard(g_mapping, *job) for job in jobs]
+    return (sum(s.cpu() for s in sums) / nb_samples).float()
+
+
+def avg_latent_path(checkpoint):
+    return os.path.splitext(checkpoint)[0] + '.avg_latent.pt'
+
+
+def load_avg_latent(checkpoint, g_mapping=None, **kwargs):
+    """the avg_latent saved next to checkpoint, estimated (kwargs) and saved first if missing"""
+    path = avg_latent_path(checkpoint)
+    if not os.path.exists(path):
+        if g_mapping is None:
+            raise FileNotFoundError(path)
+        kwargs.setdefault('nb_workers', os.cpu_count())
+        torch.save({'avg_latent': estimate_avg_latent(g_mapping, **kwargs), 'kwargs': kwargs}, path)
+    return torch.load(path)['avg_latent']
@@ -0,0 +1,413 @@
+"""Benchmarks that need no checkpoint : they run on randomly initialized weights."""
+import fnmatch
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import torch
+
+from .networks import REDUCED_DTYPES, G_mapping, G_style, G_synthesis, freeze
+from .noise import NoiseBank
+
+
+def bench_freeze(model, nb_images=4, batch_size=1, device='cpu'):
+    """per-image time of model, eager vs frozen, on random latents"""
+    model = model.eval().to(device)
+    NoiseBank('cached').attach(model) # same noise for both runs
+    latents = torch.randn(batch_size, 512, device=device)
+    timings = {}
+    with torch.no_grad():
+        for mode in (False, True):
+            freeze(model, mode)
+            model(latents) # warm-up, fills the cache when frozen
+            t0 = time.perf_counter()
+            for _ in range(nb_images // batch_size):
+                out = model(latents)
+            timings[mode] = (time.perf_counter() - t0) / (nb_images // batch_size * batch_size)
+            timings[mode, 'out'] = out
+    freeze(model, False)
+    NoiseBank.detach(model)
+    print('eager  : %.1f ms/img' % (timings[False] * 1e3))
+    print('frozen : %.1f ms/img' % (timings[True] * 1e3))
+    print('saving : %.1f ms/img, max abs diff %.2e' % ((timings[False] - timings[True]) * 1e3,
+                                                     (timings[False, 'out'] - timings[True, 'out']).abs().max()))
+    return timings[False], timings[True]
+
+
+STARTUP_COMMANDS = [
+    ('python', ['-c', 'pass']),
+    ('import torch', ['-c', 'import torch']),
+    ('import stylegan', ['-c', 'import stylegan']),
+    ('import stylegan.networks', ['-c', 'import stylegan.networks']),
+    ('stylegan --help', ['-m', 'stylegan', '--help']),
+    ('stylegan generate --help', ['-m', 'stylegan', 'generate', '--help']),
+]
+
+
+def bench_startup(nb=5, commands=STARTUP_COMMANDS):
+    """median wall time of fresh interpreters running each command"""
+    results = {}
+    for name, args in commands:
+        timings = []
+        for _ in range(nb):
+            t0 = time.perf_counter()
+            subprocess.run([sys.executable] + args, check=True, stdout=subprocess.DEVNULL)
+            timings.append(time.perf_counter() - t0)
+        results[name] = np.median(timings)
+        print('%-28s %7.1f ms' % (name, results[name] * 1e3))
+    return results
+
+
+def random_g_all(resolution=1024):
+    return G_style(G_mapping(), G_synthesis(resolution=resolution)).eval()
+
+
+# Benchmark suite : latency and throughput of the generator hot paths, swept over batch size,
+# dtype and number of threads. Results are saved as JSON and compared against a baseline.
+
+DTYPES = {'float32': torch.float32, 'float64': torch.float64, 'bfloat16': torch.bfloat16, 'float16': torch.float16}
+
+
+def suite_stages(g_all):
+    """name -> make(batch_size) returning the function to time. Inputs are drawn once per config."""
+    g_mapping, g_synthesis = g_all.g_mapping, g_all.g_synthesis
+    device = next(g_all.parameters()).device
+    num_layers = g_synthesis.num_layers
+
+    def randn(*shape):
+        return torch.randn(*shape, device=device)
+
+    def activation(*shape):
+        # input of a synthesis layer, in the precision mode of g_synthesis
+        memory_format = torch.channels_last if g_synthesis.channels_last else torch.contiguous_format
+        return randn(*shape).to(g_synthesis.dtype, memory_format=memory_format)
+
+    def mapping(batch_size):
+        z = randn(batch_size, 512)
+        return lambda: g_mapping(z)
+
+    def end_to_end(batch_size):
+        z = randn(batch_size, 512)
+        return lambda: g_all(z)
+
+    def end_to_end_static(batch_size):
+        z = randn(batch_size, 512)
+
+        def run():
+            g_synthesis.static = True # keeps the arenas of previous calls, unlike set_static
+            try:
+                return g_all(z)
+            finally:
+                g_synthesis.static = False
+        return run
+
+    stages = {'mapping': mapping}
+    channels = None
+    for i, (name, block) in enumerate(g_synthesis.blocks.items()):
+        size = 2**(i + 2)
+        if i == 0:
+            def run_block(batch_size, block=block, i=i):
+                w = randn(batch_size, num_layers, 512)
+                return lambda: block(w[:, 2*i:2*i+2])
+        else:
+            def run_block(batch_size, block=block, i=i, channels=channels, size=size):
+                x, w = activation(batch_size, channels, size // 2, size // 2), randn(batch_size, num_layers, 512)
+                return lambda: block(x, w[:, 2*i:2*i+2])
+
+            for mode in ('folded', 'fused', 'unfused'):
+                def run_conv(batch_size, conv=block.conv0_up, channels=channels, size=size, mode=mode):
+                    x = activation(batch_size, channels, size // 2, size // 2)
+
+                    def run():
+                        conv.fold_min_size = 0 if mode == 'folded' else float('inf')
+                        conv.fuse_min_size = 0 if mode == 'fused' else float('inf')
+                        try:
+                            return conv(x)
+                        finally:
+                            del conv.fold_min_size, conv.fuse_min_size # back to the class defaults
+                    return run
+                stages['conv_up.%s.%s' % (name, mode)] = run_conv
+        stages['block.' + name] = run_block
+
+        for fused in (False, True):
+            def run_epilogue(batch_size, epi=block.epi1, size=size, fused=fused):
+                x, w = activation(batch_size, epi.style_mod.lin.weight.size(0) // 2, size, size), randn(batch_size, 512)
+                run = epi.fused_forward if fused else epi.forward # fused_forward updates x in place
+                return lambda: run(x, w)
+            stages['epilogue.' + name + ('.fused' if fused else '')] = run_epilogue
+        channels = block.epi2.style_mod.lin.weight.size(0) // 2
+    stages['g_all'] = end_to_end
+    stages['g_all.static'] = end_to_end_static
+    return stages
+
+
+def _time(fn, repeat, warmup, device):
+    sync = torch.cuda.synchronize if torch.device(device).type == 'cuda' else (lambda: None)
+    for _ in range(warmup):
+        fn()
+    sync()
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        sync()
+        timings.append(time.perf_counter() - t0)
+    return np.array(timings)
+
+
+def run_suite(resolution=1024, batch_sizes=(1, 4), dtypes=('float32',), threads=(None,), stages=('*',),
+              repeat=5, warmup=1, device='cpu', frozen=True, seed=0, channels_last=False):
+    """times every stage matching one of the fnmatch patterns of stages, for each
+    (threads, dtype, batch size). dtype and channels_last are the precision mode of g_synthesis
+    (see G_synthesis.set_precision), the mapping network stays float32.
+    Returns a JSON-serializable dict."""
+    nb_threads = torch.get_num_threads()
+    results = []
+    try:
+        for dtype in dtypes:
+            torch.manual_seed(seed)
+            g_all = random_g_all(resolution).to(device)
+            g_all.g_synthesis.set_precision(DTYPES[dtype], channels_last)
+            freeze(g_all, frozen)
+            NoiseBank('cached', seed=seed).attach(g_all)
+            makers = suite_stages(g_all)
+            names = [n for n in makers if any(fnmatch.fnmatch(n, p) for p in stages)]
+            for n_threads in threads:
+                torch.set_num_threads(n_threads or nb_threads)
+                for batch_size in batch_sizes:
+                    for name in names:
+                        result = {'stage': name, 'resolution': resolution, 'batch_size': batch_size, 'dtype': dtype,
+                                  'channels_last': channels_last, 'threads': torch.get_num_threads(),
+                                  'device': str(device)}
+                        torch.manual_seed(seed)
+                        try:
+                            with torch.no_grad():
+                                timings = _time(makers[name](batch_size), repeat, warmup, device)
+                        except RuntimeError as e: # e.g. a dtype without a cpu kernel
+                            result['error'] = str(e).splitlines()[0]
+                            print('%-28s b=%-3d %-8s t=%-3d  error : %s' % (
+                                name, batch_size, dtype, result['threads'], result['error']))
+                        else:
+                            result.update(median_ms=np.median(timings) * 1e3, min_ms=timings.min() * 1e3,
+                                          p90_ms=np.percentile(timings, 90) * 1e3,
+                                          items_per_s=batch_size / np.median(timings), repeat=repeat)
+                            print('%-28s b=%-3d %-8s t=%-3d %10.2f ms %10.1f /s' % (
+                                name, batch_size, dtype, result['threads'], result['median_ms'], result['items_per_s']))
+                        results.append(result)
+    finally:
+        torch.set_num_threads(nb_threads)
+    meta = {'resolution': resolution, 'frozen': frozen, 'seed': seed, 'warmup': warmup,
+            'torch': torch.__version__, 'python': platform.python_version(), 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+    return {'meta': meta, 'results': results}
+
+
+def _config(result):
+    return (result['stage'], result['resolution'], result['batch_size'], result['dtype'],
+            result.get('channels_last', False), result['threads'], result['device'])
+
+
+def compare_suite(baseline, current, threshold=0.1):
+    """median latency of current vs baseline (dicts or JSON paths), config by config.
+    Prints one line per common config and returns the configs slower by more than threshold."""
+    if isinstance(baseline, str):
+        with open(baseline) as f:
+            baseline = json.load(f)
+    if isinstance(current, str):
+        with open(current) as f:
+            current = json.load(f)
+    base = {_config(r): r for r in baseline['results'] if 'error' not in r}
+    regressions = []
+    for r in current['results']:
+        b = base.get(_config(r))
+        if b is None or 'error' in r:
+            continue
+        ratio = r['median_ms'] / b['median_ms']
+        flag = 'REGRESSION' if ratio > 1 + threshold else ('faster' if ratio < 1 - threshold else '')
+        if flag == 'REGRESSION':
+            regressions.append(dict(r, baseline_ms=b['median_ms'], ratio=ratio))
+        print('%-28s b=%-3d %-8s t=%-3d %10.2f -> %10.2f ms  x%.2f %s' % (
+            r['stage'], r['batch_size'], r['dtype'], r['threads'], b['median_ms'], r['median_ms'], ratio, flag))
+    print('%d regression(s) above %d%%' % (len(regressions), threshold * 100))
+    return regressions
+
+
+def psnr(x, ref):
+    """per-image PSNR (dB) of images in [-1, 1] (clamped) against ref"""
+    mse = (x.clamp(-1, 1) - ref.clamp(-1, 1)).double().pow(2).flatten(1).mean(1)
+    return 10 * torch.log10(4 / mse) # peak to peak is 2
+
+
+def precision_report(g_all, dtype=torch.bfloat16, channels_last=True, nb_samples=8, batch_size=4, seed=0):
+    """renders the same latents and noise in float32 and in the reduced precision mode of g_synthesis,
+    prints and returns the PSNR / max abs error of the reduced images and the time per image of both"""
+    g_synthesis = g_all.g_synthesis
+    previous = g_synthesis.dtype, g_synthesis.channels_last
+    device = next(g_all.parameters()).device
+    NoiseBank('cached', seed=seed).attach(g_all)
+    z = torch.from_numpy(np.random.RandomState(seed).randn(nb_samples, 512)).float().to(device)
+    outputs, timings = {}, {}
+    try:
+        with torch.no_grad():
+            for mode in ('float32', 'reduced'):
+                if mode == 'reduced':
+                    g_synthesis.set_precision(dtype, channels_last)
+                else:
+                    g_synthesis.set_precision(torch.float32, False)
+                g_all(z[:batch_size]) # warm-up (and frozen weight casts)
+                t0 = time.perf_counter()
+                outputs[mode] = torch.cat([g_all(z[i:i + batch_size]) for i in range(0, nb_samples, batch_size)])
+                timings[mode] = (time.perf_counter() - t0) / nb_samples
+    finally:
+        g_synthesis.set_precision(*previous)
+        NoiseBank.detach(g_all)
+    ref, out = outputs['float32'], outputs['reduced']
+    values = psnr(out, ref)
+    report = {'dtype': str(dtype).replace('torch.', ''), 'channels_last': channels_last,
+              'psnr_mean': values.mean().item(), 'psnr_min': values.min().item(),
+              'max_abs_error': (out.clamp(-1, 1) - ref.clamp(-1, 1)).abs().max().item(),
+              'float32_ms': timings['float32'] * 1e3, 'reduced_ms': timings['reduced'] * 1e3}
+    print('%s%s vs float32 : PSNR mean %.2f dB, min %.2f dB, max abs error %.4f' % (
+        report['dtype'], ' channels_last' if channels_last else '', report['psnr_mean'], report['psnr_min'],
+        report['max_abs_error']))
+    print('float32 %.1f ms/img, %s %.1f ms/img (x%.2f)' % (report['float32_ms'], report['dtype'], report['reduced_ms'],
+                                                         report['float32_ms'] / report['reduced_ms']))
+    return report
+
+
+def epilogue_report(g_all, dtype=torch.float32, channels_last=False, nb_samples=8, batch_size=4, seed=0, atol=1e-3):
+    """renders the same latents and noise with the LayerEpilogue modules and with the fused epilogue
+    (G_synthesis.set_fused_epilogue), prints and returns the max abs difference and the time per
+    image of both. Raises AssertionError above atol in float32 (the reduced precision modes only
+    report it, their rounding differs between the two)."""
+    g_synthesis = g_all.g_synthesis
+    previous = g_synthesis.dtype, g_synthesis.channels_last, g_synthesis.blocks['4x4'].epi1.fused
+    device = next(g_all.parameters()).device
+    NoiseBank('cached', seed=seed).attach(g_all)
+    z = torch.from_numpy(np.random.RandomState(seed).randn(nb_samples, 512)).float().to(device)
+    outputs, timings = {}, {}
+    try:
+        g_synthesis.set_precision(dtype, channels_last)
+        with torch.no_grad():
+            for fused in (False, True):
+                g_synthesis.set_fused_epilogue(fused)
+                g_all(z[:batch_size]) # warm-up
+                t0 = time.perf_counter()
+                outputs[fused] = torch.cat([g_all(z[i:i + batch_size]) for i in range(0, nb_samples, batch_size)])
+                timings[fused] = (time.perf_counter() - t0) / nb_samples
+    finally:
+        g_synthesis.set_precision(*previous[:2])
+        g_synthesis.set_fused_epilogue(previous[2])
+        NoiseBank.detach(g_all)
+    error = (outputs[True] - outputs[False]).abs().max().item()
+    report = {'dtype': str(dtype).replace('torch.', ''), 'channels_last': channels_last, 'max_abs_diff': error,
+              'psnr_min': psnr(outputs[True], outputs[False]).min().item(),
+              'modules_ms': timings[False] * 1e3, 'fused_ms': timings[True] * 1e3}
+    print('fused epilogue vs modules (%s%s) : max abs diff %.2e, PSNR min %.2f dB' % (
+        report['dtype'], ' channels_last' if channels_last else '', error, report['psnr_min']))
+    print('modules %.1f ms/img, fused %.1f ms/img (x%.2f)' % (report['modules_ms'], report['fused_ms'],
+                                                            report['modules_ms'] / report['fused_ms']))
+    assert dtype in REDUCED_DTYPES or error <= atol, 'fused epilogue differs from the modules (%.2e > %.2e)' % (error, atol)
+    return report
+
+
+def arena_report(g_all, batch_size=4, nb_calls=5, seed=0):
+    """g_synthesis calls on the same dlatents and noise with and without static shape execution
+    (G_synthesis.set_static) : prints and returns the tensors allocated by a steady-state call
+    (count and bytes), the time per call and the max abs difference of the outputs"""
+    from .arena import allocations
+    g_synthesis = g_all.g_synthesis
+    previous = g_synthesis.static
+    device = next(g_all.parameters()).device
+    NoiseBank('cached', seed=seed).attach(g_all)
+    z = torch.from_numpy(np.random.RandomState(seed).randn(batch_size, 512)).float().to(device)
+    report, outputs = {'batch_size': batch_size}, {}
+    try:
+        with torch.no_grad():
+            w = g_all.truncation(g_all.g_mapping(z))
+            for static in (False, True):
+                g_synthesis.set_static(static)
+                name = 'static' if static else 'dynamic'
+                outputs[name] = g_synthesis(w).clone() # first call plans the arena
+                count, nbytes = allocations(g_synthesis, w)
+                t0 = time.perf_counter()
+                for _ in range(nb_calls):
+                    g_synthesis(w)
+                report[name] = {'allocations': count, 'allocated_mb': nbytes / 2**20,
+                                'ms': (time.perf_counter() - t0) / nb_calls * 1e3}
+            report['arena_mb'] = g_synthesis.arena(batch_size, device).nbytes() / 2**20
+    finally:
+        g_synthesis.set_static(previous)
+        NoiseBank.detach(g_all)
+    report['max_abs_diff'] = (outputs['static'] - outputs['dynamic']).abs().max().item()
+    for name in ('dynamic', 'static'):
+        r = report[name]
+        print('%-8s %5d allocations %9.1f MB per call %9.1f ms' % (name, r['allocations'], r['allocated_mb'], r['ms']))
+    print('arena %.1f MB, max abs diff %.2e' % (report['arena_mb'], report['max_abs_diff']))
+    return report
+
+
+def encode_report(g_all, batch_size=4, nb_batches=4, format='png', workers=2, seed=0):
+    """images/s of g_all + to_uint8 + encode, the encodes done serially after each batch vs
+    overlapped with the next batches in an EncodePool"""
+    from .encode import EncodePool, encode_image
+    from .render import to_uint8
+    device = next(g_all.parameters()).device
+    z = torch.from_numpy(np.random.RandomState(seed).randn(batch_size, 512)).float().to(device)
+    report = {'batch_size': batch_size, 'format': format, 'workers': workers}
+    with torch.no_grad():
+        g_all(z) # warm-up
+        t0 = time.perf_counter()
+        for _ in range(nb_batches):
+            sizes = [len(encode_image(image, format)) for image in to_uint8(g_all(z))]
+        report['serial'] = nb_batches * batch_size / (time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        with EncodePool(workers) as pool:
+            for _ in range(nb_batches):
+                for image in to_uint8(g_all(z)):
+                    pool.submit(image, format=format)
+        report['pool'] = nb_batches * batch_size / (time.perf_counter() - t0)
+    report['kb_per_image'] = np.mean(sizes) / 1024
+    print('%s %.0f KB per image : serial %.2f images/s, pool of %d %.2f images/s' %
+          (format, report['kb_per_image'], report['serial'], workers, report['pool']))
+    return report
+
+
+def prefix_report(g_all, m=4, n=4, layers=(8, 12), max_bytes=1 << 30, seed=0):
+    """M x N style mixing grid : full forward of the M * N mixed dlatents vs style_mixing_grid
+    (each coarse prefix once) vs the same grid again with the prefixes in a PrefixCache"""
+    from .networks import DLatents
+    from .prefix import PrefixCache, style_mixing_grid
+    g_synthesis = g_all.g_synthesis
+    device = next(g_all.parameters()).device
+    z = torch.from_numpy(np.random.RandomState(seed).randn(m + n, 512)).float().to(device)
+    noise_seeds = list(range(m))
+    report = {}
+    with torch.no_grad():
+        w = g_all.g_mapping(z)
+        w = w.vectors[:, 0] if isinstance(w, DLatents) else w[:, 0]
+        coarse, fine = w[:m], w[m:]
+        for layer in layers:
+            mixed = DLatents(torch.stack([coarse.repeat_interleave(n, 0), fine.repeat(m, 1)], 1),
+                             [0 if i < layer else 1 for i in range(g_synthesis.num_layers)])
+            bank = NoiseBank('seeded').attach(g_synthesis)
+            t0 = time.perf_counter()
+            with bank.use([s for s in noise_seeds for _ in range(n)]):
+                ref = g_synthesis(mixed)
+            timings = {'full': time.perf_counter() - t0}
+            NoiseBank.detach(g_synthesis)
+            cache = PrefixCache(g_synthesis, max_bytes)
+            for name in ('grid', 'grid.cached'):
+                t0 = time.perf_counter()
+                grid = style_mixing_grid(g_synthesis, coarse, fine, layer, noise_seeds, cache)
+                timings[name] = time.perf_counter() - t0
+            report[layer] = dict(timings, max_abs_diff=(grid.reshape(ref.shape) - ref).abs().max().item(),
+                                 cache_mb=cache.nbytes / 2**20)
+            r = report[layer]
+            print('%dx%d grid, layers >= %d mixed : full %.0f ms, grid %.0f ms, cached %.0f ms (%.1f MB), max abs diff %.1e' %
+                  (m, n, layer, r['full'] * 1e3, r['grid'] * 1e3, r['grid.cached'] * 1e3, r['cache_mb'], r['max_abs_diff']))
+    return report
@@ -0,0 +1,183 @@
+"""Memory-mapped blob checkpoints and the converter from the official TF pickle.
+
+Blob checkpoint : an 8 byte magic, the 8 byte length of a JSON index, the index, then every
+tensor at a 64 byte aligned offset. It is memory-mapped copy-on-write and the mapped tensors
+become the model parameters (load_state_dict(assign=True)), so nothing is deserialized or copied
+and the processes of a host share the weights through the page cache.
+
+The official pickle (karras2019stylegan-ffhq-1024x1024.pkl) is read with its dnnlib Network
+objects unpickled into plain state holders, so neither TensorFlow nor dnnlib are needed.
+The constant noise inputs are kept in the blob as const_noise.N (see NoiseBank('const')) and
+dlatent_avg is saved as the avg_latent of the checkpoint (see avg_latent.py).
+"""
+import json
+import os
+import pickle
+import time
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+from .avg_latent import avg_latent_path
+from .networks import G_mapping, G_style, G_synthesis, freeze
+
+
+BLOB_MAGIC = b'SGBLOB01'
+BLOB_ALIGN = 64
+
+
+def blob_path(checkpoint):
+    return os.path.splitext(checkpoint)[0] + '.blob'
+
+
+def save_blob(tensors, path):
+    """tensors : name -> tensor (a state_dict, possibly with extra entries)"""
+    index, offset = OrderedDict(), 0
+    for name, t in tensors.items():
+        t = t.detach().cpu().contiguous()
+        offset = -(-offset // BLOB_ALIGN) * BLOB_ALIGN
+        index[name] = {'dtype': str(t.numpy().dtype), 'shape': list(t.shape), 'offset': offset}
+        offset += t.numel() * t.element_size()
+    header = json.dumps(index).encode()
+    start = -(-(16 + len(header)) // BLOB_ALIGN) * BLOB_ALIGN
+    with open(path, 'wb') as f:
+        f.write(BLOB_MAGIC + np.uint64(len(header)).tobytes() + header)
+        for name, t in tensors.items():
+            f.seek(start + index[name]['offset'])
+            f.write(t.detach().cpu().contiguous().numpy().tobytes())
+        f.truncate(start + offset)
+
+
+def open_blob(path):
+    """name -> tensor, memory-mapped (copy-on-write) from path"""
+    with open(path, 'rb') as f:
+        magic, length = f.read(8), int(np.frombuffer(f.read(8), np.uint64)[0])
+        if magic != BLOB_MAGIC:
+            raise ValueError('%s is not a blob checkpoint' % path)
+        index = json.loads(f.read(length))
+    start = -(-(16 + length) // BLOB_ALIGN) * BLOB_ALIGN
+    data = np.memmap(path, mode='c', offset=start) if os.path.getsize(path) > start else np.zeros(0, np.uint8)
+    tensors = OrderedDict()
+    for name, entry in index.items():
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        a = data[entry['offset']:entry['offset'] + count * dtype.itemsize].view(dtype).reshape(entry['shape'])
+        tensors[name] = torch.from_numpy(a)
+    return tensors
+
+
+def load_blob(model, path):
+    """makes the mapped tensors of path the parameters and buffers of model, without copy"""
+    tensors = open_blob(path)
+    state = model.state_dict()
+    model.load_state_dict(OrderedDict((k, v) for k, v in tensors.items() if k in state), assign=True)
+    return tensors
+
+
+class _TFNetwork:
+    def __setstate__(self, state):
+        self.state = state
+    def variables(self):
+        return OrderedDict(self.state['variables'])
+    def component(self, name):
+        return self.state['components'][name]
+
+
+class _TFUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module.startswith('dnnlib'):
+            return dict if name == 'EasyDict' else _TFNetwork
+        return super().find_class(module, name)
+
+
+def _tf_synthesis_key(name):
+    # '8x8/Conv0_up/StyleMod/weight' -> 'g_synthesis.blocks.8x8.epi1.style_mod.lin.weight'
+    if name.startswith('ToRGB_lod0/'):
+        return 'g_synthesis.torgb.' + name.split('/')[-1]
+    res, layer, *rest = name.split('/')
+    if rest == ['const']:
+        return 'g_synthesis.blocks.%s.const' % res
+    epi = {'Const': 'epi1', 'Conv': 'epi2', 'Conv0_up': 'epi1', 'Conv1': 'epi2'}[layer]
+    if rest[0] == 'Noise':
+        return 'g_synthesis.blocks.%s.%s.top_epi.noise.weight' % (res, epi)
+    if rest[0] == 'StyleMod':
+        return 'g_synthesis.blocks.%s.%s.style_mod.lin.%s' % (res, epi, rest[1])
+    if layer == 'Const':
+        return 'g_synthesis.blocks.%s.bias' % res
+    return 'g_synthesis.blocks.%s.%s.%s' % (res, layer.lower(), rest[0])
+
+
+def _tf_layout(name, v):
+    # tf stores dense weights as [in, out] and conv weights as [kh, kw, in, out],
+    # the learned constant is already [1, nf, 4, 4]
+    if v.dim() == 4 and not name.endswith('/const'):
+        return v.permute(3, 2, 0, 1)
+    return v.t() if v.dim() == 2 else v
+
+
+def convert_tf_pickle(pkl, path, model=None):
+    """writes the blob checkpoint of the official pickle (and its avg_latent)"""
+    with open(pkl, 'rb') as f:
+        _G, _D, Gs = _TFUnpickler(f).load()
+    params = OrderedDict()
+    for name, v in Gs.component('mapping').variables().items():
+        params['g_mapping.' + name.replace('/', '.').lower()] = _tf_layout(name, torch.from_numpy(v))
+    const_noise = OrderedDict()
+    for name, v in Gs.component('synthesis').variables().items():
+        if name.startswith('ToRGB_lod') and not name.startswith('ToRGB_lod0/') or name == 'lod':
+            continue # only the full resolution output is used
+        v = torch.from_numpy(np.asarray(v))
+        if name.startswith('noise'):
+            const_noise['const_' + name.replace('noise', 'noise.')] = v.view(v.shape[-2:])
+        else:
+            params[_tf_synthesis_key(name)] = _tf_layout(name, v)
+    model = model if model is not None else G_style(G_mapping(), G_synthesis())
+    missing, unexpected = model.load_state_dict(params, strict=False)
+    assert not unexpected and all(k.endswith('kernel') for k in missing), (missing, unexpected)
+    state = model.state_dict()
+    state.pop('truncation.avg_latent', None)
+    save_blob(OrderedDict(list(state.items()) + list(const_noise.items())), path)
+    avg_latent = torch.from_numpy(Gs.variables()['dlatent_avg'])
+    torch.save({'avg_latent': avg_latent, 'kwargs': {'source': pkl}}, avg_latent_path(path))
+    return path
+
+
+def bench_checkpoint_load(checkpoint, model, nb=5):
+    """time to weights-ready : torch.load + load_state_dict vs load_blob, cold (evicted from the
+    page cache with posix_fadvise) and warm"""
+    blob = blob_path(checkpoint)
+    if not os.path.exists(blob):
+        save_blob(torch.load(checkpoint), blob)
+    def evict(path):
+        with open(path, 'rb') as f:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    loaders = {'torch.load': (checkpoint, lambda: model.load_state_dict(torch.load(checkpoint))),
+               'blob': (blob, lambda: load_blob(model, blob))}
+    results = {}
+    for name, (path, load) in loaders.items():
+        for cache in ('cold', 'warm'):
+            timings = []
+            for _ in range(nb):
+                if cache == 'cold':
+                    evict(path)
+                t0 = time.perf_counter()
+                load()
+                timings.append(time.perf_counter() - t0)
+            results[name, cache] = np.median(timings)
+            print('%-10s %s : %.1f ms' % (name, cache, results[name, cache] * 1e3))
+    return results
+
+
+def load_g_all(checkpoint, device='cpu'):
+    """G_style ready for inference : weights from the .blob next to checkpoint when there is one,
+    avg_latent when it has been estimated, frozen"""
+    from .avg_latent import load_avg_latent
+    g_all = G_style(G_mapping(), G_synthesis())
+    if os.path.exists(blob_path(checkpoint)):
+        load_blob(g_all, blob_path(checkpoint))
+    else:
+        g_all.load_state_dict(torch.load(checkpoint, map_location='cpu'))
+    if os.path.exists(avg_latent_path(checkpoint)):
+        g_all.truncation.avg_latent = load_avg_latent(checkpoint)
+    return freeze(g_all.eval().to(device))
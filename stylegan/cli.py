@@ -0,0 +1,462 @@
+"""Command line : python -m stylegan {generate, dataset, embed, index, project, convert, avg-latent, bench} ...
+
+Only argparse is imported up front; torch and the optional dependencies (PIL, matplotlib)
+are imported by the subcommands that use them, so `--help` and short jobs start fast.
+"""
+import argparse
+import os
+import sys
+
+CHECKPOINT = './karras2019stylegan-ffhq-1024x1024.for_g_all.pt'
+
+
+def parse_seeds(text):
+    """'0-19' or '1,5,7' or '0-3,10' -> list of ints"""
+    seeds = []
+    for part in text.split(','):
+        if '-' in part:
+            lo, hi = part.split('-')
+            seeds += range(int(lo), int(hi) + 1)
+        else:
+            seeds.append(int(part))
+    return seeds
+
+
+def parse_bytes(text):
+    """'8G', '512M', '1.5g' or a number of bytes -> int"""
+    text = text.strip().upper().rstrip('B')
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text))
+
+
+def default_device():
+    import torch
+    return 'cuda:0' if torch.cuda.is_available() else 'cpu'
+
+
+def generate(args):
+    import numpy as np
+    import torch
+    from PIL import Image
+    from .checkpoint import load_g_all
+    from .encode import EncodePool
+    from .noise import NoiseBank
+    from .render import to_uint8
+
+    device = args.device or default_device()
+    g_all = load_g_all(args.checkpoint, device)
+    if args.psi != 1 and g_all.truncation.avg_latent is None:
+        print('no avg_latent for %s (see `avg-latent`), rendering without truncation' % args.checkpoint,
+              file=sys.stderr)
+    if args.tile_size:
+        g_all.g_synthesis.set_tiling(args.tile_size)
+    if args.dtype != 'float32':
+        g_all.g_synthesis.set_precision(getattr(torch, args.dtype), channels_last=True)
+    if args.fused_epilogue:
+        g_all.g_synthesis.set_fused_epilogue()
+    if args.memory_budget:
+        from .memory import MemoryPlanner
+        with torch.no_grad():
+            args.batch_size = MemoryPlanner(g_all.g_synthesis).probe().max_batch_size(parse_bytes(args.memory_budget))
+        print('batch size %d' % args.batch_size, file=sys.stderr)
+    noise_bank = NoiseBank('seeded').attach(g_all)
+    os.makedirs(args.out, exist_ok=True)
+    images = []
+    with torch.no_grad(), EncodePool(args.encode_workers) as pool:
+        for start in range(0, len(args.seeds), args.batch_size):
+            seeds = args.seeds[start:start + args.batch_size]
+            z = torch.from_numpy(np.stack([np.random.RandomState(s).randn(512) for s in seeds])).float().to(device)
+            with noise_bank.use(seeds):
+                batch = to_uint8(g_all(z, psi=args.psi))
+            for seed, image in zip(seeds, batch):
+                pool.submit(image, format=args.format, path=os.path.join(args.out, 'seed%06d.%s' % (seed, args.format)))
+            if args.grid or args.show:
+                images += list(batch)
+    if images:
+        cols = args.grid or 5
+        rows = -(-len(images) // cols)
+        images += [np.zeros_like(images[0])] * (rows * cols - len(images))
+        h, w, c = images[0].shape
+        grid = np.stack(images).reshape(rows, cols, h, w, c).transpose(0, 2, 1, 3, 4).reshape(rows * h, cols * w, c)
+        Image.fromarray(grid).save(os.path.join(args.out, 'grid.png'))
+        if args.show:
+            import matplotlib.pyplot as plt
+            plt.figure(figsize=(15, 6))
+            plt.imshow(grid)
+            plt.axis('off')
+            plt.show()
+
+
+def dataset(args):
+    from .dataset import generate_dataset
+    try:
+        stats = generate_dataset(args.checkpoint, args.out, args.seeds, args.shard_size, args.workers, args.psi,
+                                 args.batch_size, args.format, args.dtype, args.static, args.threads,
+                                 args.device or default_device())
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    print('%d images in %.1f s : %.2f images/s' % (stats['images'], stats['seconds'], stats['images_per_second']))
+
+
+def embed(args):
+    import time
+    import numpy as np
+    from .checkpoint import load_g_all
+    from .embed import EmbeddingCache, FaceEmbedder, embed_seeds
+    device = args.device or default_device()
+    try:
+        embedder = FaceEmbedder(image_size=args.image_size or None, device=device)
+    except ImportError as e:
+        sys.exit('%s : pip install facenet-pytorch' % e)
+    g_all = load_g_all(args.checkpoint, device)
+    try:
+        cache = EmbeddingCache(args.cache, g_all, embedder, args.psi) if args.cache else None
+        cached = 0 if cache is None else int((cache.lookup(args.seeds, args.seeds) >= 0).sum())
+        t0 = time.perf_counter()
+        embeddings, logits = embed_seeds(g_all, embedder, args.seeds, args.psi, batch_size=args.batch_size,
+                                         cache=cache)
+    except FileNotFoundError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    elapsed = time.perf_counter() - t0
+    arrays = {'seeds': np.array(args.seeds), 'embeddings': embeddings}
+    if logits is not None:
+        arrays['logits'] = logits
+    np.savez(args.out, **arrays)
+    print('%d embeddings (%d cached), %d rendered in %.1f s : %.2f images/s' %
+          (len(args.seeds), cached, len(args.seeds) - cached, elapsed, (len(args.seeds) - cached) / elapsed))
+
+
+def index(args):
+    from .index import VectorIndex, index_dataset
+    vectors = VectorIndex(args.path, 512, 'l2')
+    if args.dataset:
+        print('%d shards added, %d vectors' % (index_dataset(vectors, args.dataset), len(vectors)))
+    if args.train_ivf:
+        vectors.train_ivf(args.train_ivf, args.m)
+
+
+def project(args):
+    import numpy as np
+    import torch
+    from PIL import Image
+    from .checkpoint import load_g_all
+    from .project import Projector
+    device = args.device or default_device()
+    g_all = load_g_all(args.checkpoint, device)
+    embedder = None
+    if args.identity_weight:
+        from .embed import FaceEmbedder
+        try:
+            embedder = FaceEmbedder(device=device)
+        except ImportError as e:
+            sys.exit('%s : pip install facenet-pytorch, or --identity-weight 0' % e)
+    projector = Projector(g_all, embedder, args.mode, args.batch_size, max_steps=args.steps, lr=args.lr,
+                          identity_weight=args.identity_weight)
+    def targets():
+        for path in args.images:
+            image = np.asarray(Image.open(path).convert('RGB'), dtype=np.float32) / 127.5 - 1
+            yield os.path.basename(path), torch.from_numpy(image).permute(2, 0, 1)
+    results = {}
+    for r in projector.project(targets()):
+        results[r['key']] = r['w'].numpy()
+        print('%s : loss %.4f after %d steps' % (r['key'], r['loss'], r['steps']))
+    np.savez(args.out, **results)
+    print('%d targets, %.1f targets/hour' % (len(results), projector.targets_per_hour()))
+
+
+def convert(args):
+    from .checkpoint import convert_tf_pickle
+    print(convert_tf_pickle(args.pickle, args.out))
+
+
+def avg_latent(args):
+    from .avg_latent import load_avg_latent
+    from .checkpoint import load_g_all
+    g_all = load_g_all(args.checkpoint)
+    load_avg_latent(args.checkpoint, g_all.g_mapping, nb_samples=args.nb_samples,
+                    batch_size=args.batch_size, nb_workers=args.workers)
+
+
+def export(args):
+    from . import bench as benchmarks
+    from .export import check_parity, export_generator
+    g_all = _bench_model(args, benchmarks)
+    print(export_generator(g_all, args.out, args.format, args.batch_size, args.psi, args.noise, args.seed))
+    if args.check:
+        if args.noise != 'const':
+            sys.exit('--check needs --noise const')
+        try:
+            check_parity(g_all, args.out, args.format, args.batch_size, args.psi, args.seed)
+        except AssertionError as e:
+            sys.exit(str(e))
+
+
+def _bench_model(args, benchmarks):
+    """the checkpoint when it exists, random weights otherwise"""
+    from .networks import freeze
+    if os.path.exists(args.checkpoint):
+        from .checkpoint import load_g_all
+        return load_g_all(args.checkpoint)
+    print('no %s, random weights' % args.checkpoint)
+    return freeze(benchmarks.random_g_all(args.resolution))
+
+
+def bench(args):
+    from . import bench as benchmarks
+    if args.what == 'startup':
+        benchmarks.bench_startup(args.repeat)
+    elif args.what == 'freeze':
+        benchmarks.bench_freeze(benchmarks.random_g_all(args.resolution))
+    elif args.what == 'serve':
+        from .serve import bench_service
+        for max_batch_size in (1, 8):
+            bench_service(resolution=args.resolution, max_batch_size=max_batch_size)
+    elif args.what == 'load':
+        from .checkpoint import bench_checkpoint_load
+        bench_checkpoint_load(args.checkpoint, benchmarks.random_g_all(), args.repeat)
+    elif args.what == 'precision':
+        import torch
+        g_all = _bench_model(args, benchmarks)
+        for channels_last in (True, False):
+            benchmarks.precision_report(g_all, getattr(torch, args.dtype), channels_last,
+                                        batch_size=args.batch_size)
+    elif args.what == 'epilogue':
+        import torch
+        g_all = _bench_model(args, benchmarks)
+        dtype = getattr(torch, args.dtype)
+        try:
+            benchmarks.epilogue_report(g_all, dtype, dtype in (torch.bfloat16, torch.float16), batch_size=args.batch_size)
+        except AssertionError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+    elif args.what == 'arena':
+        g_all = _bench_model(args, benchmarks)
+        if args.dtype != 'float32':
+            import torch
+            g_all.g_synthesis.set_precision(getattr(torch, args.dtype), channels_last=True)
+        benchmarks.arena_report(g_all, args.batch_size, args.repeat)
+    elif args.what == 'encode':
+        benchmarks.encode_report(_bench_model(args, benchmarks), args.batch_size, args.repeat, args.format,
+                                 args.workers)
+    elif args.what == 'index':
+        import tempfile
+        from .index import bench_index
+        with tempfile.TemporaryDirectory() as path:
+            bench_index(path, args.nb_vectors, metric=args.metric, nb_queries=args.batch_size * 25)
+    elif args.what == 'project':
+        from .project import project_report
+        project_report(_bench_model(args, benchmarks), args.batch_size * 2, (1, args.batch_size), mode=args.mode,
+                       max_steps=args.steps)
+    elif args.what == 'prefix':
+        benchmarks.prefix_report(_bench_model(args, benchmarks), args.batch_size, args.batch_size)
+    elif args.what == 'memory':
+        import torch
+        from .memory import MemoryPlanner
+        g_all = _bench_model(args, benchmarks)
+        if args.dtype != 'float32':
+            g_all.g_synthesis.set_precision(getattr(torch, args.dtype), channels_last=True)
+        if args.fused_epilogue or args.static:
+            g_all.g_synthesis.set_fused_epilogue()
+        if args.static:
+            g_all.g_synthesis.set_static()
+        if args.tile_size:
+            g_all.g_synthesis.set_tiling(args.tile_size)
+        MemoryPlanner(g_all.g_synthesis).probe(args.batch_size).report(args.budgets)
+    elif args.what == 'int8':
+        from .int8 import quantization_report
+        quantization_report(_bench_model(args, benchmarks), args.psnr, batch_size=args.batch_size,
+                            reduce_range=not args.full_range)
+    elif args.what == 'profile':
+        import torch
+        from .profiling import instrument
+        from .networks import freeze
+        g_all = freeze(benchmarks.random_g_all(args.resolution))
+        z = torch.randn(args.batch_size, 512)
+        with torch.no_grad():
+            g_all(z) # warm-up
+            with instrument(g_all) as trace:
+                g_all(z)
+        trace.print_summary()
+        if args.trace:
+            trace.save(args.trace)
+
+
+def bench_suite(args):
+    import json
+    from . import bench as benchmarks
+    report = benchmarks.run_suite(args.resolution, args.batch_sizes, args.dtypes, args.threads, args.stages,
+                                  args.repeat, args.warmup, args.device or default_device(), not args.eager,
+                                  channels_last=args.channels_last)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.baseline and benchmarks.compare_suite(args.baseline, report, args.threshold):
+        sys.exit(1)
+
+
+def bench_compare(args):
+    from . import bench as benchmarks
+    if benchmarks.compare_suite(args.baseline, args.current, args.threshold):
+        sys.exit(1)
+
+
+def _list(kind=str):
+    return lambda text: [kind(v) for v in text.split(',')]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='stylegan')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('generate', help='render images for a list of seeds')
+    p.add_argument('--checkpoint', default=CHECKPOINT)
+    p.add_argument('--seeds', type=parse_seeds, default=parse_seeds('0-19'), help="e.g. '0-19' or '1,5,7'")
+    p.add_argument('--psi', type=float, default=0.7, help='truncation psi, 1 = no truncation')
+    p.add_argument('--batch-size', type=int, default=8)
+    p.add_argument('--memory-budget', default=None, metavar='BYTES',
+                   help="e.g. '8G' : batch size planned to fit, from a probe run (replaces --batch-size)")
+    p.add_argument('--device', default=None, help='default : cuda:0 when available, else cpu')
+    p.add_argument('--tile-size', type=int, default=None, help='tiled synthesis of the 512px and 1024px blocks')
+    p.add_argument('--dtype', default='float32', choices=['float32', 'bfloat16', 'float16'],
+                   help='synthesis activations, reduced precision ones in channels_last (check with `bench precision`)')
+    p.add_argument('--fused-epilogue', action='store_true',
+                   help='single pass layer epilogues (check with `bench epilogue`)')
+    p.add_argument('--out', default='out')
+    p.add_argument('--format', default='png', choices=['png', 'jpg', 'webp'])
+    p.add_argument('--encode-workers', type=int, default=2, help='encoder threads, overlapping the next batch')
+    p.add_argument('--grid', type=int, default=None, metavar='COLS', help='also write grid.png')
+    p.add_argument('--show', action='store_true', help='show the grid with matplotlib')
+    p.set_defaults(func=generate)
+
+    p = sub.add_parser('dataset', help='sharded, resumable rendering of a seed range over worker processes')
+    p.add_argument('out')
+    p.add_argument('--checkpoint', default=CHECKPOINT)
+    p.add_argument('--seeds', type=parse_seeds, required=True, help="e.g. '0-99999'")
+    p.add_argument('--shard-size', type=int, default=1000, help='images per shard (the unit of resume)')
+    p.add_argument('--format', default='npy', choices=['npy', 'tar'], help='uint8 array or tar of pngs')
+    p.add_argument('--workers', type=int, default=1, help='processes, each pinned to its share of the cores')
+    p.add_argument('--threads', type=int, default=None, help='torch threads per worker, default : its cores')
+    p.add_argument('--psi', type=float, default=0.7, help='truncation psi, 1 = no truncation')
+    p.add_argument('--batch-size', type=int, default=8)
+    p.add_argument('--dtype', default='float32', choices=['float32', 'bfloat16', 'float16'])
+    p.add_argument('--static', action='store_true', help='static shape execution (see `bench arena`)')
+    p.add_argument('--device', default=None)
+    p.set_defaults(func=dataset)
+
+    p = sub.add_parser('embed', help='facenet embeddings and vggface2 logits of the images of seeds (.npz)')
+    p.add_argument('out')
+    p.add_argument('--checkpoint', default=CHECKPOINT)
+    p.add_argument('--seeds', type=parse_seeds, required=True)
+    p.add_argument('--psi', type=float, default=0.7, help='truncation psi, 1 = no truncation')
+    p.add_argument('--batch-size', type=int, default=8)
+    p.add_argument('--image-size', type=int, default=160, help='facenet input side, 0 : as generated')
+    p.add_argument('--cache', default=None, help='embedding cache directory')
+    p.add_argument('--device', default=None)
+    p.set_defaults(func=embed)
+
+    p = sub.add_parser('index', help='k-NN index of the W latents of dataset shards (see stylegan.index)')
+    p.add_argument('path')
+    p.add_argument('--dataset', default=None, help='add the shards of this `dataset` directory not indexed yet')
+    p.add_argument('--train-ivf', type=int, default=None, metavar='NLIST', help='(re)train the IVF-PQ index')
+    p.add_argument('--m', type=int, default=16, help='PQ bytes per vector')
+    p.set_defaults(func=index)
+
+    p = sub.add_parser('project', help='W (or W+) of face images, optimized a batch of targets at a time (.npz)')
+    p.add_argument('out')
+    p.add_argument('images', nargs='+')
+    p.add_argument('--checkpoint', default=CHECKPOINT)
+    p.add_argument('--mode', default='w', choices=['w', 'w+'])
+    p.add_argument('--batch-size', type=int, default=8, help='targets optimized together')
+    p.add_argument('--steps', type=int, default=500, help='at most, per target')
+    p.add_argument('--lr', type=float, default=0.05)
+    p.add_argument('--identity-weight', type=float, default=0.1, help='facenet identity loss, 0 : pixel loss only')
+    p.add_argument('--device', default=None)
+    p.set_defaults(func=project)
+
+    p = sub.add_parser('convert', help='official TF pickle -> blob checkpoint')
+    p.add_argument('pickle')
+    p.add_argument('out')
+    p.set_defaults(func=convert)
+
+    p = sub.add_parser('avg-latent', help='estimate and save the avg_latent of a checkpoint')
+    p.add_argument('--checkpoint', default=CHECKPOINT)
+    p.add_argument('--nb-samples', type=int, default=1000000)
+    p.add_argument('--batch-size', type=int, default=8192)
+    p.add_argument('--workers', type=int, default=os.cpu_count())
+    p.set_defaults(func=avg_latent)
+
+    p = sub.add_parser('export', help='static-shape generator artifact (torchscript, torch.export or onnx)')
+    p.add_argument('out')
+    p.add_argument('--format', default='torchscript', choices=['torchscript', 'export', 'onnx'])
+    p.add_argument('--checkpoint', default=CHECKPOINT, help='random weights when it does not exist')
+    p.add_argument('--resolution', type=int, default=1024, help='of the random weights')
+    p.add_argument('--batch-size', type=int, default=1)
+    p.add_argument('--psi', type=float, default=None, help='truncation psi, default : 1 (none)')
+    p.add_argument('--noise', default='const', choices=['const', 'random', 'none'])
+    p.add_argument('--seed', type=int, default=0, help='of the const noise')
+    p.add_argument('--check', action='store_true', help='parity with the eager model (exit 1 if it fails)')
+    p.set_defaults(func=export)
+
+    p = sub.add_parser('bench', help='benchmarks')
+    bench_sub = p.add_subparsers(dest='what', required=True)
+    bench_parsers = {}
+    for what in ('startup', 'freeze', 'serve', 'load', 'profile', 'precision', 'int8', 'epilogue', 'arena',
+                 'encode', 'index', 'project', 'prefix', 'memory'):
+        q = bench_parsers[what] = bench_sub.add_parser(what)
+        q.add_argument('--checkpoint', default=CHECKPOINT)
+        q.add_argument('--resolution', type=int, default=64)
+        q.add_argument('--repeat', type=int, default=5)
+        q.add_argument('--batch-size', type=int, default=4)
+        q.set_defaults(func=bench)
+    bench_parsers['profile'].add_argument('--trace', default=None, help='write a Chrome trace JSON')
+    bench_parsers['precision'].add_argument('--dtype', default='bfloat16', help="e.g. 'bfloat16' or 'float16'")
+    bench_parsers['epilogue'].add_argument('--dtype', default='float32', help="e.g. 'float32' or 'bfloat16'")
+    bench_parsers['arena'].add_argument('--dtype', default='float32', help="e.g. 'float32' or 'bfloat16'")
+    bench_parsers['encode'].add_argument('--format', default='png', choices=['png', 'jpg', 'webp'])
+    bench_parsers['encode'].add_argument('--workers', type=int, default=2)
+    bench_parsers['index'].add_argument('--nb-vectors', type=int, default=200000)
+    bench_parsers['index'].add_argument('--metric', default='ip', choices=['ip', 'l2'])
+    bench_parsers['project'].add_argument('--mode', default='w', choices=['w', 'w+'])
+    bench_parsers['project'].add_argument('--steps', type=int, default=30)
+    bench_parsers['memory'].add_argument('--dtype', default='float32', help="e.g. 'float32' or 'bfloat16'")
+    bench_parsers['memory'].add_argument('--fused-epilogue', action='store_true')
+    bench_parsers['memory'].add_argument('--static', action='store_true')
+    bench_parsers['memory'].add_argument('--tile-size', type=int, default=None)
+    bench_parsers['memory'].add_argument('--budgets', type=_list(parse_bytes), default=[1 << 30, 4 << 30, 16 << 30],
+                                         help="batch size of each, e.g. '2G,8G'")
+    bench_parsers['int8'].add_argument('--psnr', type=float, default=30., help='quality budget (dB) of the int8 config')
+    bench_parsers['int8'].add_argument('--full-range', action='store_true',
+                                       help='8 bit activations (7 by default, safe on cpus without VNNI)')
+
+    q = bench_sub.add_parser('suite', help='latency / throughput of the hot paths, random weights')
+    q.add_argument('--resolution', type=int, default=1024)
+    q.add_argument('--batch-sizes', type=_list(int), default=[1, 4], help="e.g. '1,4,16'")
+    q.add_argument('--dtypes', type=_list(), default=['float32'], help="e.g. 'float32,bfloat16'")
+    q.add_argument('--threads', type=_list(int), default=[None], help="torch.set_num_threads values, e.g. '1,4'")
+    q.add_argument('--stages', type=_list(), default=['*'],
+                   help="fnmatch patterns among mapping, block.RxR, epilogue.RxR[.fused], conv_up.RxR.{folded,fused,unfused}, g_all[.static]")
+    q.add_argument('--repeat', type=int, default=5)
+    q.add_argument('--warmup', type=int, default=1)
+    q.add_argument('--device', default=None)
+    q.add_argument('--eager', action='store_true', help='do not freeze the layers')
+    q.add_argument('--channels-last', action='store_true', help='channels_last synthesis activations')
+    q.add_argument('--out', default=None, help='write the results as JSON')
+    q.add_argument('--baseline', default=None, help='JSON of a previous run to compare with (exit 1 on regression)')
+    q.add_argument('--threshold', type=float, default=0.1, help='relative slowdown reported as a regression')
+    q.set_defaults(func=bench_suite)
+
+    q = bench_sub.add_parser('compare', help='compare two suite JSON files (exit 1 on regression)')
+    q.add_argument('baseline')
+    q.add_argument('current')
+    q.add_argument('--threshold', type=float, default=0.1)
+    q.set_defaults(func=bench_compare)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
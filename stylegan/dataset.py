@@ -0,0 +1,208 @@
+"""Sharded, resumable dataset generation over worker processes.
+
+    python -m stylegan dataset out/ --seeds 0-199999 --workers 4 --shard-size 1000
+
+The seed list is cut in shards of shard_size consecutive seeds. A shard is rendered by one worker
+and written as
+ - shard-NNNNN.npy (uint8 [N, H, W, 3]) or shard-NNNNN.tar (one seedSSSSSS.png per image),
+ - shard-NNNNN.latents.npy (float32 [N, 512], the W of each seed before truncation),
+ - shard-NNNNN.json (seeds, noise seeds, psi, avg_latent hash, ...), written last : it marks the shard done.
+Files are written under a temporary name then renamed, so a killed job leaves no partial shard
+and running it again renders only the shards without a .json. dataset.json holds the job options
+and refuses a resume with different ones; batch size, threads, workers and --static may change
+(the images of a shard then differ by float rounding, at most one uint8 level). psi != 1 needs the
+avg_latent of the checkpoint (see avg_latent.py), whose hash is part of the job.
+
+Workers are forked before anything runs in the parent. Each one is pinned to its own set of cores
+(os.sched_setaffinity) with as many torch threads, and maps the weights from the blob checkpoint
+(see checkpoint.py), so the processes share one copy through the page cache. Images use
+np.random.RandomState(seed) latents and NoiseBank('seeded') noise of the same seed, as `generate`.
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+from .networks import DLatents
+
+
+def shard_name(index):
+    return 'shard-%05d' % index
+
+
+def _write(path, write):
+    """write(binary file) to a temporary file renamed to path"""
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _write_tar(f, seeds, images):
+    import io, tarfile
+    from .encode import encode_image
+    with tarfile.open(fileobj=f, mode='w') as tar:
+        for seed, image in zip(seeds, images):
+            data = encode_image(image, 'png')
+            info = tarfile.TarInfo('seed%06d.png' % seed)
+            info.size, info.mtime = len(data), time.time()
+            tar.addfile(info, io.BytesIO(data))
+
+
+def render_shard(g_all, seeds, psi, batch_size, noise_bank, device='cpu'):
+    """(uint8 images [N, H, W, 3], float32 W [N, 512]) of seeds. With static execution the last
+    batch is padded to batch_size (repeating its last seed), so that a single arena is planned"""
+    from .render import to_uint8
+    images, latents = [], []
+    with torch.no_grad():
+        for start in range(0, len(seeds), batch_size):
+            batch = seeds[start:start + batch_size]
+            n = len(batch)
+            if g_all.g_synthesis.static:
+                batch = batch + batch[-1:] * (batch_size - n)
+            z = torch.from_numpy(np.stack([np.random.RandomState(s).randn(512) for s in batch])).float().to(device)
+            w = g_all.g_mapping(z)
+            latents.append((w.vectors[:n, 0] if isinstance(w, DLatents) else w[:n, 0]).float().cpu().numpy())
+            with noise_bank.use(batch):
+                images.append(to_uint8(g_all.g_synthesis(g_all.truncation(w, psi)))[:n])
+    return np.concatenate(images), np.concatenate(latents)
+
+
+def _write_json(path, value):
+    _write(path, lambda f: f.write(json.dumps(value).encode()))
+
+
+def write_shard(out, index, seeds, images, latents, options, truncation_max_layer):
+    name = os.path.join(out, shard_name(index))
+    if options['format'] == 'tar':
+        _write(name + '.tar', lambda f: _write_tar(f, seeds, images))
+    else:
+        _write(name + '.npy', lambda f: np.save(f, images))
+    _write(name + '.latents.npy', lambda f: np.save(f, latents))
+    _write_json(name + '.json', {'shard': index, 'seeds': seeds, 'noise_seeds': seeds, 'psi': options['psi'],
+                                 'avg_latent': options['avg_latent'], 'truncation_max_layer': truncation_max_layer,
+                                 'shape': list(images.shape)})
+
+
+_dataset_worker = {}
+
+
+def _dataset_init(checkpoint, options, core_sets):
+    cores = core_sets.get()
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(options['threads'] or max(1, len(cores or os.sched_getaffinity(0))))
+    _dataset_worker['g_all'], _dataset_worker['noise_bank'] = _load_model(checkpoint, options)
+
+
+def _load_model(checkpoint, options):
+    from .checkpoint import load_g_all
+    from .noise import NoiseBank
+    g_all = load_g_all(checkpoint, options['device'])
+    if options['psi'] != 1 and g_all.truncation.avg_latent is None:
+        raise FileNotFoundError('no avg_latent for %s, psi=%s would not truncate' % (checkpoint, options['psi']))
+    if options['dtype'] != 'float32':
+        g_all.g_synthesis.set_precision(getattr(torch, options['dtype']), channels_last=True)
+    if options['static']:
+        g_all.g_synthesis.set_static()
+    return g_all, NoiseBank('seeded').attach(g_all)
+
+
+def _dataset_job(args):
+    out, index, seeds, options = args
+    t0 = time.perf_counter()
+    g_all = _dataset_worker['g_all']
+    images, latents = render_shard(g_all, seeds, options['psi'], options['batch_size'],
+                                   _dataset_worker['noise_bank'], options['device'])
+    write_shard(out, index, seeds, images, latents, options, g_all.truncation.max_layer)
+    return index, len(seeds), time.perf_counter() - t0
+
+
+def core_sets(nb_workers):
+    """the cores of this process split in nb_workers disjoint sets (shared round robin when there are fewer cores)"""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+    if not cores:
+        return [None] * nb_workers
+    if len(cores) < nb_workers:
+        return [[cores[i % len(cores)]] for i in range(nb_workers)]
+    return [[int(c) for c in part] for part in np.array_split(cores, nb_workers)]
+
+
+def done_shards(out):
+    return {int(f[len('shard-'):-len('.json')]) for f in os.listdir(out)
+            if f.startswith('shard-') and f.endswith('.json')}
+
+
+def _avg_latent_hash(checkpoint, psi):
+    """sha1 of the avg_latent the images are truncated toward ('none' for psi=1). Raises when psi != 1
+    and there is none : the truncation would silently do nothing"""
+    from .avg_latent import avg_latent_path, load_avg_latent
+    if psi == 1:
+        return 'none'
+    if not os.path.exists(avg_latent_path(checkpoint)):
+        raise FileNotFoundError('psi=%s needs the avg_latent of %s : run `python -m stylegan avg-latent` first, '
+                                'or use psi=1' % (psi, checkpoint))
+    return hashlib.sha1(load_avg_latent(checkpoint).float().numpy().tobytes()).hexdigest()
+
+
+def generate_dataset(checkpoint, out, seeds, shard_size=1000, nb_workers=1, psi=0.7, batch_size=8,
+                     format='npy', dtype='float32', static=False, threads=None, device='cpu', log=sys.stderr):
+    """renders seeds in shards under out (see the module docstring), resuming a previous run of the same
+    job. threads : torch threads per worker (default : its number of cores). returns the rendering stats"""
+    from .checkpoint import blob_path, save_blob
+    from .noise import RNG
+    assert format in ('npy', 'tar')
+    seeds = [int(s) for s in seeds]
+    avg_latent = _avg_latent_hash(checkpoint, psi)
+    shards = [seeds[i:i + shard_size] for i in range(0, len(seeds), shard_size)]
+    options = {'checkpoint': os.path.abspath(checkpoint), 'psi': psi, 'format': format, 'shard_size': shard_size,
+               'seeds': hashlib.sha1(np.array(seeds, np.int64).tobytes()).hexdigest(), 'nb_seeds': len(seeds), 'dtype': dtype, 'static': static,
+               'batch_size': batch_size, 'threads': threads, 'device': device, 'noise': RNG, 'avg_latent': avg_latent}
+    # the options that change the images
+    job = ('checkpoint', 'psi', 'avg_latent', 'format', 'shard_size', 'seeds', 'nb_seeds', 'dtype', 'noise')
+    os.makedirs(out, exist_ok=True)
+    path = os.path.join(out, 'dataset.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        changed = [k for k in job if previous.get(k) != options[k]]
+        if changed:
+            raise ValueError('%s is a dataset with other %s, use another directory' % (out, ', '.join(changed)))
+    else:
+        _write_json(path, options)
+    if not os.path.exists(blob_path(checkpoint)):
+        # mapped by every worker instead of one torch.load copy each
+        save_blob(torch.load(checkpoint, map_location='cpu'), blob_path(checkpoint))
+
+    done = done_shards(out)
+    pending = [(out, i, shard, options) for i, shard in enumerate(shards) if i not in done]
+    print('%d shards, %d done, %d to render with %d worker(s)' % (len(shards), len(done), len(pending), nb_workers),
+          file=log)
+    nb_images, t0 = 0, time.perf_counter()
+    def report(index, n, seconds):
+        nonlocal nb_images
+        nb_images += n
+        elapsed = time.perf_counter() - t0
+        print('%s : %d images in %.1f s, total %d images, %.2f images/s' %
+              (shard_name(index), n, seconds, nb_images, nb_images / elapsed), file=log)
+    if nb_workers > 1 and len(pending) > 1:
+        import multiprocessing
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        for cores in core_sets(nb_workers):
+            queue.put(cores)
+        # fork : nothing has run in the parent yet, the workers load (map) the model themselves
+        with context.Pool(nb_workers, _dataset_init, (checkpoint, options, queue)) as pool:
+            for result in pool.imap_unordered(_dataset_job, pending):
+                report(*result)
+    elif pending:
+        _dataset_worker['g_all'], _dataset_worker['noise_bank'] = _load_model(checkpoint, options)
+        for job in pending:
+            report(*_dataset_job(job))
+    elapsed = time.perf_counter() - t0
+    return {'shards': len(shards), 'rendered': len(pending), 'images': nb_images, 'seconds': elapsed,
+            'images_per_second': nb_images / elapsed if nb_images else 0.}
@@ -0,0 +1,183 @@
+"""Face embeddings (facenet_pytorch InceptionResnetV1) of generated images, with an on-disk cache.
+
+    embedder = FaceEmbedder(device='cpu')           # InceptionResnetV1(pretrained='vggface2')
+    cache = EmbeddingCache('embeddings/', g_all, embedder, psi=0.7)
+    embeddings, logits = embed_seeds(g_all, embedder, range(100000), psi=0.7, cache=cache)
+
+FaceEmbedder takes the generator output as it is ([B, 3, H, W] in [-1, 1], which is the
+(x - 127.5) / 128 whitening of facenet up to 0.4%), on its device : no uint8 / PIL round trip. It is
+resized to image_size on the device and a single batched forward gives both the L2 normalized
+embeddings and the class logits (the features before the normalization go through resnet.logits).
+
+The cache is keyed by (generator weights hash, psi, embedder weights hash, image_size, noise RNG) for a
+directory and by (seed, noise seed) for a row. Rows are appended to raw float32 files, keys last,
+so an interrupted run loses at most the rows it was writing. facenet_pytorch is only needed to
+build the default embedder.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from .noise import RNG, NoiseBank
+
+
+def state_hash(model):
+    """sha1 of the names and values of the state_dict of model (parameters and buffers, avg_latent included)"""
+    h = hashlib.sha1()
+    for name, t in model.state_dict().items():
+        h.update(name.encode())
+        h.update(t.detach().cpu().contiguous().view(-1).view(torch.uint8).numpy())
+    return h.hexdigest()
+
+
+class FaceEmbedder:
+    def __init__(self, resnet=None, image_size=160, batch_size=32, device='cpu'):
+        """resnet : an InceptionResnetV1 (default : pretrained='vggface2'). image_size : side the images are
+        resized to (160, that of the facenet training crops; None : as generated). batch_size : images per forward"""
+        if resnet is None:
+            from facenet_pytorch import InceptionResnetV1
+            resnet = InceptionResnetV1(pretrained='vggface2')
+        self.resnet = resnet.eval().to(device)
+        self.image_size = image_size
+        self.batch_size = batch_size
+        self.device = device
+        logits = getattr(resnet, 'logits', None)
+        self.nb_classes = None if logits is None else logits.out_features
+        self._features = None
+        resnet.last_bn.register_forward_hook(lambda module, inputs, output: setattr(self, '_features', output))
+
+    def features(self, x):
+        """pre-normalization features [B, 512] of x [B, 3, H, W] in [-1, 1] on the embedder device,
+        differentiable (see project.py)"""
+        if self.image_size is not None and x.shape[-2:] != (self.image_size, self.image_size):
+            x = F.interpolate(x, size=(self.image_size, self.image_size), mode='area')
+        classify, self.resnet.classify = self.resnet.classify, False # the embedding head, logits from the hook
+        try:
+            self.resnet(x.clamp(-1, 1))
+        finally:
+            self.resnet.classify = classify
+        features, self._features = self._features, None
+        return features
+
+    def __call__(self, imgs):
+        """imgs [B, 3, H, W] in [-1, 1] -> (embeddings [B, 512], logits [B, n_classes] or None), float32 cpu"""
+        embeddings, logits = [], []
+        with torch.no_grad():
+            for start in range(0, imgs.size(0), self.batch_size):
+                features = self.features(imgs[start:start + self.batch_size].to(self.device, torch.float32))
+                embeddings.append(F.normalize(features, p=2, dim=1).cpu())
+                if self.nb_classes:
+                    logits.append(self.resnet.logits(features).cpu())
+        return torch.cat(embeddings), torch.cat(logits) if logits else None
+
+
+def _check_truncation(g_all, psi):
+    # without an avg_latent the truncation silently does nothing, the images would not be the psi ones
+    if psi != 1 and g_all.truncation.avg_latent is None:
+        raise FileNotFoundError('psi=%s needs the avg_latent of the generator : run `python -m stylegan avg-latent` '
+                                'first, or use psi=1' % psi)
+
+
+class EmbeddingCache:
+    def __init__(self, root, g_all, embedder, psi):
+        """embeddings of the images of g_all at truncation psi, under root/<hash of the configuration>"""
+        _check_truncation(g_all, psi)
+        key = '%s-%s-%s-%s-%s' % (state_hash(g_all), psi, state_hash(embedder.resnet), embedder.image_size, RNG)
+        self.path = os.path.join(root, hashlib.sha1(key.encode()).hexdigest()[:20])
+        os.makedirs(self.path, exist_ok=True)
+        meta = os.path.join(self.path, 'meta.json')
+        if not os.path.exists(meta):
+            with open(meta, 'w') as f:
+                json.dump({'key': key, 'nb_classes': embedder.nb_classes}, f)
+        with open(meta) as f:
+            self.nb_classes = json.load(f)['nb_classes']
+        self._files = {name: os.path.join(self.path, name) for name in ('keys.i64', 'embeddings.f32', 'logits.f32')}
+        keys, embeddings = self._read('keys.i64', np.int64, 2), self._read('embeddings.f32', np.float32, 512)
+        logits = self._read('logits.f32', np.float32, self.nb_classes or 0)
+        n = min(len(keys), len(embeddings), len(logits) if self.nb_classes else len(keys))
+        # an interrupted append may have left rows (or part of one) past n : drop them, so that the
+        # next append writes row n of every file at the same place
+        widths = {'keys.i64': 2 * 8, 'embeddings.f32': 512 * 4, 'logits.f32': (self.nb_classes or 0) * 4}
+        for name, row_bytes in widths.items():
+            if os.path.exists(self._files[name]):
+                with open(self._files[name], 'ab') as f:
+                    f.truncate(n * row_bytes)
+        self._arrays = [keys[:n], embeddings[:n], logits[:n]]
+        self._chunks = [[], [], []]
+        self._nb_rows = n
+        self.index = {(int(s), int(ns)): i for i, (s, ns) in enumerate(keys[:n])}
+
+    def _read(self, name, dtype, width):
+        path = self._files[name]
+        if width == 0 or not os.path.exists(path):
+            return np.zeros((0, width), dtype)
+        a = np.fromfile(path, dtype)
+        return a[:len(a) // width * width].reshape(-1, width)
+
+    def __len__(self):
+        return len(self.index)
+
+    def lookup(self, seeds, noise_seeds):
+        """row of each (seed, noise seed), -1 when not cached"""
+        return np.array([self.index.get((int(s), int(ns)), -1) for s, ns in zip(seeds, noise_seeds)], np.int64)
+
+    def append(self, seeds, noise_seeds, embeddings, logits=None):
+        keys = np.stack([np.asarray(seeds, np.int64), np.asarray(noise_seeds, np.int64)], 1)
+        embeddings = np.ascontiguousarray(embeddings, np.float32)
+        logits = np.zeros((len(keys), 0), np.float32) if logits is None else np.ascontiguousarray(logits, np.float32)
+        assert logits.shape[1] == (self.nb_classes or 0)
+        # keys last : a row counts once its key is written
+        for name, a in (('embeddings.f32', embeddings), ('logits.f32', logits), ('keys.i64', keys)):
+            if a.size:
+                with open(self._files[name], 'ab') as f:
+                    f.write(a.tobytes())
+        for chunks, a in zip(self._chunks, (keys, embeddings, logits)):
+            chunks.append(a)
+        for key in keys:
+            self.index[int(key[0]), int(key[1])] = self._nb_rows
+            self._nb_rows += 1
+
+    def get(self, rows):
+        """(embeddings, logits or None) of rows"""
+        if self._chunks[0]:
+            self._arrays = [np.concatenate([a] + chunks) for a, chunks in zip(self._arrays, self._chunks)]
+            self._chunks = [[], [], []]
+        return self._arrays[1][rows], self._arrays[2][rows] if self.nb_classes else None
+
+
+def embed_seeds(g_all, embedder, seeds, psi=0.7, noise_seeds=None, batch_size=8, cache=None):
+    """(embeddings [N, 512], logits [N, n_classes] or None) numpy float32 of the images of seeds
+    (latents and noise as `generate`, noise_seeds default : the seeds). Only the images missing
+    from cache are rendered, and added to it. Raises FileNotFoundError for psi != 1 without an avg_latent."""
+    _check_truncation(g_all, psi)
+    seeds = [int(s) for s in seeds]
+    noise_seeds = seeds if noise_seeds is None else [int(s) for s in noise_seeds]
+    rows = cache.lookup(seeds, noise_seeds) if cache is not None else np.full(len(seeds), -1)
+    missing = list({(seeds[i], noise_seeds[i]): i for i in range(len(seeds)) if rows[i] < 0}.values())
+    new = {}
+    if missing:
+        device = next(g_all.parameters()).device
+        noise_bank = NoiseBank('seeded').attach(g_all)
+        try:
+            with torch.no_grad():
+                for start in range(0, len(missing), batch_size):
+                    batch = missing[start:start + batch_size]
+                    z = torch.from_numpy(np.stack([np.random.RandomState(seeds[i]).randn(512) for i in batch]))
+                    with noise_bank.use([noise_seeds[i] for i in batch]):
+                        embeddings, logits = embedder(g_all(z.float().to(device), psi=psi))
+                    embeddings = embeddings.numpy()
+                    logits = None if logits is None else logits.numpy()
+                    if cache is not None:
+                        cache.append([seeds[i] for i in batch], [noise_seeds[i] for i in batch], embeddings, logits)
+                    for j, i in enumerate(batch):
+                        new[seeds[i], noise_seeds[i]] = (embeddings[j], None if logits is None else logits[j])
+        finally:
+            NoiseBank.detach(g_all)
+    if cache is not None:
+        return cache.get(cache.lookup(seeds, noise_seeds))
+    rows = [new[key] for key in zip(seeds, noise_seeds)]
+    return np.stack([r[0] for r in rows]), np.stack([r[1] for r in rows]) if rows[0][1] is not None else None
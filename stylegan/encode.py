@@ -0,0 +1,82 @@
+"""Image encoding off the generation thread.
+
+    with EncodePool(workers=2) as pool:
+        for seeds, z in batches:
+            for seed, image in zip(seeds, to_uint8(g_all(z))):
+                pool.submit(image, path='seed%06d.png' % seed)
+
+PNG / JPEG / WebP encoding (PIL, which releases the GIL while it compresses) runs in a bounded
+pool while the caller renders the next batch. submit() only blocks when max_pending images are in
+flight, so memory stays bounded when encoding is slower than generation. Completion callbacks run
+in submission order, on the thread calling submit / flush / close, whatever order the encodes
+finish in.
+"""
+import io
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+FORMATS = {'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG', 'webp': 'WEBP'}
+
+
+def encode_image(image, format='png', path=None, **params):
+    """uint8 [H, W, C] array -> encoded bytes, or written to path (and path returned).
+    params go to PIL.Image.save (e.g. quality=90 for jpeg / webp, compress_level=1 for png)"""
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.fromarray(image).save(buf, format=FORMATS[format.lower()], **params)
+    if path is None:
+        return buf.getvalue()
+    with open(path, 'wb') as f:
+        f.write(buf.getbuffer())
+    return path
+
+
+class EncodePool:
+    def __init__(self, workers=2, max_pending=None, processes=False):
+        """workers threads (processes=True : forked processes, for encoders holding the GIL), at most
+        max_pending (default 2 * workers) submitted images not completed yet"""
+        if processes:
+            import multiprocessing
+            self._executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+        else:
+            self._executor = ThreadPoolExecutor(workers, thread_name_prefix='encode')
+        self.max_pending = max_pending or 2 * workers
+        self._pending = deque() # (future, callback) in submission order
+
+    def submit(self, image, callback=None, format='png', path=None, **params):
+        """encodes image (see encode_image); callback(bytes or path) once it and every image
+        submitted before it are done"""
+        while len(self._pending) >= self.max_pending:
+            self._complete()
+        future = self._executor.submit(encode_image, image, format, path, **params)
+        self._pending.append((future, callback))
+        while self._pending and self._pending[0][0].done():
+            self._complete()
+        return future
+
+    def _complete(self):
+        future, callback = self._pending.popleft()
+        result = future.result()
+        if callback is not None:
+            callback(result)
+
+    def flush(self):
+        """waits for every submitted image and runs the remaining callbacks"""
+        while self._pending:
+            self._complete()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is not None:
+            for future, _ in self._pending:
+                future.cancel()
+            self._pending.clear()
+        self.close()
@@ -0,0 +1,228 @@
+"""Static-shape generator for graph capture and ahead-of-time export.
+
+StaticGenerator is z [batch_size, 512] -> image, with everything that the eager model decides at
+run time resolved when it is built : fused or unfused upscale per block, blur (folded into the
+upscale conv, see networks.resample2d), the first block,
+the truncation (psi, max_layer), the noise (planes baked as buffers, or drawn inside the graph)
+and the equalized-lr scaling (pre-scaled weights). Its forward is straight-line tensor code, so
+tracing it gives the same graph as scripting it would.
+
+    export_generator(g_all, 'g.ts', 'torchscript')  # torch.jit.load('g.ts')
+    export_generator(g_all, 'g.pt2', 'export')      # torch.export.load('g.pt2').module()
+    export_generator(g_all, 'g.onnx', 'onnx')       # needs the onnx package
+
+The artifacts load without this package. check_parity() compares one with the eager model.
+"""
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .networks import BlurLayer, MyLinear, NoiseLayer, PixelNormLayer, _foldable, resample2d
+from .noise import NoiseBank
+
+FORMATS = ('torchscript', 'export', 'onnx')
+
+
+def _epilogue_ops(epi):
+    """the top_epi layers of a LayerEpilogue as (kind, parameter) pairs"""
+    ops = []
+    for m in epi.top_epi.children():
+        if isinstance(m, NoiseLayer):
+            ops.append(('noise', m.weight.detach().view(1, -1, 1, 1).clone()))
+        elif isinstance(m, nn.LeakyReLU):
+            ops.append(('lrelu', m.negative_slope))
+        elif isinstance(m, PixelNormLayer):
+            ops.append(('pixel_norm', m.epsilon))
+        elif isinstance(m, nn.InstanceNorm2d):
+            assert not m.affine
+            ops.append(('instance_norm', m.eps))
+        else:
+            raise NotImplementedError('no static version of %r' % m)
+    return ops
+
+
+class StaticGenerator(nn.Module):
+    def __init__(self, g_all, batch_size=1, psi=None, noise='const', seed=0):
+        """psi : truncation (default : that of g_all.truncation, 1 unless set; none without avg_latent).
+        noise : 'const' bakes the planes of NoiseBank('cached', seed), shared by the batch
+        (same images as the eager model with that bank); 'random' draws them in the graph; 'none'."""
+        super().__init__()
+        assert noise in ('const', 'random', 'none')
+        g_mapping, g_synthesis, truncation = g_all.g_mapping, g_all.g_synthesis, g_all.truncation
+        self.batch_size = batch_size
+        self.noise = noise
+        with torch.no_grad():
+            dense = [m.scaled_params() for m in g_mapping.children() if isinstance(m, MyLinear)]
+            for i, (w, b) in enumerate(dense):
+                self.register_buffer('mapping_w%d' % i, w.detach().clone())
+                self.register_buffer('mapping_b%d' % i, b.detach().clone())
+            self.mapping_depth = len(dense)
+            self.mapping_slope = [m for m in g_mapping.children() if isinstance(m, nn.LeakyReLU)][0].negative_slope
+            self.mapping_eps = [m for m in g_mapping.children() if isinstance(m, PixelNormLayer)][0].epsilon
+
+            psi = truncation.threshold if psi is None else psi
+            self.truncate = truncation.avg_latent is not None and psi != 1 and truncation.max_layer > 0
+            self.psi = float(psi)
+            self.max_layer = min(truncation.max_layer, g_synthesis.num_layers)
+            self.register_buffer('avg_latent', truncation.avg_latent.clone() if self.truncate else torch.zeros(512))
+
+            table = g_synthesis.style_table()
+            self.register_buffer('style_weight', table['weight'].detach().clone())
+            self.register_buffer('style_bias', table['bias'].detach().clone())
+            self.style_bounds = [(int(b0), int(b1)) for b0, b1 in table['bounds']]
+
+            bank = NoiseBank('cached', seed=seed)
+            self.layers = [] # ('const' | 'conv' | 'epi', ...), resolved once
+            n_epi = n_conv = 0
+            for i, block in enumerate(g_synthesis.blocks.values()):
+                size = 2**(i + 2)
+                if i == 0:
+                    self.register_buffer('const', (block.const + block.bias.view(1, -1, 1, 1)).detach().clone())
+                    convs = [None, block.conv]
+                else:
+                    convs = [block.conv0_up, block.conv1]
+                for conv, epi in zip(convs, (block.epi1, block.epi2)):
+                    if conv is not None:
+                        self.layers.append(('conv', self._static_conv(conv, size // 2 if conv.upscale else size,
+                                                                      'conv%d' % n_conv)))
+                        n_conv += 1
+                    ops = []
+                    for kind, param in _epilogue_ops(epi):
+                        if kind == 'noise':
+                            if noise == 'none':
+                                continue
+                            self.register_buffer('noise_w%d' % n_epi, param)
+                            if noise == 'const':
+                                plane = bank.plane(seed, n_epi, size, size).view(1, 1, size, size)
+                                self.register_buffer('noise%d' % n_epi, plane.clone())
+                            param = (n_epi, size)
+                        ops.append((kind, param))
+                    self.layers.append(('epi', (ops, n_epi)))
+                    n_epi += 1
+            self.torgb = self._static_conv(g_synthesis.torgb, 2**(len(g_synthesis.blocks) + 1), 'torgb')
+
+    def _static_conv(self, conv, in_size, name):
+        fused = conv.upscale is not None and in_size * 2 >= conv.fuse_min_size
+        if conv.upscale is not None and in_size * 2 >= conv.fold_min_size and _foldable(conv.intermediate):
+            weight, bias, edges = conv.folded_params(fused)
+            self.register_buffer(name + '_w', weight.detach().clone())
+            self.register_buffer(name + '_b', bias.detach().clone())
+            for i, (kernel, blur) in enumerate(edges):
+                self.register_buffer('%s_edge%d' % (name, i), kernel.detach().clone())
+                self.register_buffer('%s_edge_blur%d' % (name, i), blur.detach().clone())
+            return {'name': name, 'folded': True}
+        weight, bias = conv.scaled_params(fused)
+        self.register_buffer(name + '_w', weight.detach().clone())
+        if bias is not None:
+            self.register_buffer(name + '_b', bias.detach().clone())
+        blur = conv.intermediate
+        if blur is not None:
+            assert isinstance(blur, BlurLayer)
+            self.register_buffer(name + '_blur', blur.kernel.clone())
+        return {'name': name, 'folded': False, 'fused': fused, 'upscale': conv.upscale is not None and not fused,
+                'padding': conv.kernel_size // 2, 'blur': blur is not None, 'bias': bias is not None,
+                'blur_stride': blur.stride if blur is not None else 1}
+
+    def _conv(self, x, spec):
+        weight = getattr(self, spec['name'] + '_w')
+        if spec['folded']:
+            edges = [(getattr(self, '%s_edge%d' % (spec['name'], i)), getattr(self, '%s_edge_blur%d' % (spec['name'], i)))
+                     for i in range(4)]
+            return resample2d(x, weight, getattr(self, spec['name'] + '_b'), edges)
+        bias = getattr(self, spec['name'] + '_b') if spec['bias'] else None
+        if spec['fused']:
+            x = F.conv_transpose2d(x, weight, stride=2, padding=(weight.size(-1) - 1) // 2)
+        else:
+            if spec['upscale']:
+                x = F.interpolate(x, scale_factor=2, mode='nearest')
+            x = F.conv2d(x, weight, None if spec['blur'] else bias, padding=spec['padding'])
+            if not spec['blur']:
+                return x
+        if spec['blur']:
+            kernel = getattr(self, spec['name'] + '_blur')
+            x = F.conv2d(x, kernel.expand(x.size(1), -1, -1, -1), stride=spec['blur_stride'],
+                         padding=(kernel.size(-1) - 1) // 2, groups=x.size(1))
+        if bias is not None:
+            x = x + bias.view(1, -1, 1, 1)
+        return x
+
+    def forward(self, z):
+        x = z * torch.rsqrt(torch.mean(z**2, dim=1, keepdim=True) + self.mapping_eps)
+        for i in range(self.mapping_depth):
+            x = F.leaky_relu(F.linear(x, getattr(self, 'mapping_w%d' % i), getattr(self, 'mapping_b%d' % i)),
+                             self.mapping_slope)
+        styles = torch.addmm(self.style_bias, x, self.style_weight.t())
+        if self.truncate:
+            w_t = torch.lerp(self.avg_latent, x, self.psi)
+            styles_t = torch.addmm(self.style_bias, w_t, self.style_weight.t())
+
+        x = self.const.expand(z.size(0), -1, -1, -1)
+        for kind, spec in self.layers:
+            if kind == 'conv':
+                x = self._conv(x, spec)
+                continue
+            ops, layer = spec
+            for op, param in ops:
+                if op == 'noise':
+                    n, size = param
+                    if self.noise == 'const':
+                        noise = getattr(self, 'noise%d' % n)
+                    else:
+                        noise = torch.randn(x.size(0), 1, size, size, device=x.device, dtype=x.dtype)
+                    x = x + getattr(self, 'noise_w%d' % n) * noise
+                elif op == 'lrelu':
+                    x = F.leaky_relu(x, param)
+                elif op == 'pixel_norm':
+                    x = x * torch.rsqrt(torch.mean(x**2, dim=1, keepdim=True) + param)
+                else:
+                    x = F.instance_norm(x, eps=param)
+            b0, b1 = self.style_bounds[layer]
+            style = (styles_t if self.truncate and layer < self.max_layer else styles)[:, b0:b1]
+            style = style.view(-1, 2, x.size(1), 1, 1)
+            x = x * (style[:, 0] + 1) + style[:, 1]
+        return self._conv(x, self.torgb)
+
+
+def export_generator(g_all, path, format='torchscript', batch_size=1, psi=None, noise='const', seed=0):
+    """builds the StaticGenerator of g_all and saves it as an artifact that loads without this package"""
+    assert format in FORMATS
+    model = StaticGenerator(g_all, batch_size, psi, noise, seed).eval()
+    z = torch.randn(batch_size, 512, device=next(g_all.parameters()).device)
+    with torch.no_grad():
+        if format == 'torchscript':
+            torch.jit.save(torch.jit.trace(model, z), path)
+        elif format == 'export':
+            torch.export.save(torch.export.export(model, (z,)), path)
+        else:
+            torch.onnx.export(model, (z,), path, input_names=['z'], output_names=['image'])
+    return path
+
+
+def load_generator(path, format='torchscript'):
+    if format == 'torchscript':
+        return torch.jit.load(path)
+    if format == 'export':
+        return torch.export.load(path).module()
+    import onnxruntime
+    session = onnxruntime.InferenceSession(path)
+    return lambda z: torch.from_numpy(session.run(None, {'z': z.cpu().numpy()})[0])
+
+
+def check_parity(g_all, path, format='torchscript', batch_size=1, psi=None, seed=0, atol=1e-4):
+    """max abs difference between the artifact (exported with noise='const') and the eager model
+    with NoiseBank('cached', seed) on the same z. Raises AssertionError above atol."""
+    z = torch.from_numpy(np.random.RandomState(seed).randn(batch_size, 512)).float()
+    z = z.to(next(g_all.parameters()).device)
+    NoiseBank('cached', seed=seed).attach(g_all)
+    try:
+        with torch.no_grad():
+            ref = g_all(z, psi=psi)
+    finally:
+        NoiseBank.detach(g_all)
+    with torch.no_grad():
+        out = load_generator(path, format)(z)
+    error = (out - ref).abs().max().item()
+    print('%s %s : max abs diff %.2e vs eager' % (format, path, error))
+    assert error <= atol, 'exported generator differs from the eager model (%.2e > %.2e)' % (error, atol)
+    return error
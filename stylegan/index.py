@@ -0,0 +1,315 @@
+"""k-NN index over per-seed vectors (W latents, face embeddings) in memory-mapped files.
+
+    index = VectorIndex('index/w', dim=512, metric='l2')
+    index_dataset(index, 'out/')                  # the W of the dataset shards not indexed yet
+    ids, dist = index.search(queries, k=10)       # exact : blocked matmul over the mapped vectors
+    index.train_ivf(nlist=1024, m=16)             # then approximate (IVF-PQ) search :
+    ids, dist = index.search(queries, k=10, nprobe=16, rerank=100)
+
+A VectorIndex directory holds ids.i64 (int64, e.g. seeds) and vectors.f32 ([N, dim] float32),
+append-only raw files read through np.memmap, so millions of vectors cost page cache, not heap.
+Appends write the vectors then the ids : a row exists once its id is written.
+
+metric 'l2' (squared distances, smaller is closer) or 'ip' (inner products, larger is closer;
+cosine for the L2 normalized facenet embeddings).
+
+IVF-PQ : a k-means coarse quantizer of nlist centroids, trained on a sample, and a product
+quantizer of the residuals (m sub-vectors of 256 centroids : m bytes per vector). Queries visit
+the nprobe closest lists and score their codes with per-query lookup tables (ADC); rerank > 0
+rescores that many candidates exactly from the mapped vectors. Rows appended after training are
+assigned and encoded by the next search, the trained centroids do not change (train again when
+the data has drifted).
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+
+def _fromfile(path, dtype, width):
+    if not os.path.exists(path) or os.path.getsize(path) < width * np.dtype(dtype).itemsize:
+        return np.zeros((0, width), dtype)
+    n = os.path.getsize(path) // (width * np.dtype(dtype).itemsize)
+    return np.memmap(path, dtype, mode='r', shape=(n, width))
+
+
+def _append(path, a):
+    with open(path, 'ab') as f:
+        f.write(np.ascontiguousarray(a).tobytes())
+
+
+def _scores(queries, vectors, metric, norms=None):
+    """[Q, N] : squared l2 distances or inner products"""
+    dots = queries @ vectors.T
+    if metric == 'ip':
+        return dots
+    if norms is None:
+        norms = np.einsum('ij,ij->i', vectors, vectors)
+    return np.einsum('ij,ij->i', queries, queries)[:, None] - 2 * dots + norms[None]
+
+
+def _top_k(scores, ids, k, metric, best=None):
+    """merges the k best of scores [Q, n] (with ids [n] or [Q, n]) into best (ids, scores)"""
+    if best is not None:
+        ids = np.concatenate([best[0], np.broadcast_to(ids, scores.shape)], 1)
+        scores = np.concatenate([best[1], scores], 1)
+    else:
+        ids = np.broadcast_to(ids, scores.shape)
+    key = scores if metric == 'l2' else -scores
+    k = min(k, scores.shape[1])
+    part = np.argpartition(key, k - 1, axis=1)[:, :k] if k < scores.shape[1] else np.broadcast_to(np.arange(k), scores.shape)
+    part = np.take_along_axis(part, np.argsort(np.take_along_axis(key, part, 1), axis=1), 1)
+    return np.take_along_axis(ids, part, 1), np.take_along_axis(scores, part, 1)
+
+
+def kmeans(x, k, nb_iter=20, seed=0, block_size=65536):
+    """Lloyd k-means of x [N, d] float32 -> centroids [k, d]. Empty clusters take a random point."""
+    rng = np.random.RandomState(seed)
+    centroids = x[rng.choice(len(x), k, replace=len(x) < k)].astype(np.float32)
+    for _ in range(nb_iter):
+        assign = assign_l2(x, centroids, block_size)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        starts = np.cumsum(counts) - counts
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(x[np.argsort(assign, kind='stable')], starts[~empty])
+        centroids = np.where(empty[:, None], x[rng.randint(len(x), size=k)], sums / np.maximum(counts, 1)[:, None])
+        centroids = centroids.astype(np.float32)
+    return centroids
+
+
+def assign_l2(x, centroids, block_size=65536):
+    """index of the closest centroid (l2) of each row of x"""
+    norms = np.einsum('ij,ij->i', centroids, centroids)
+    return np.concatenate([np.argmin(norms[None] - 2 * np.asarray(x[i:i + block_size], np.float32) @ centroids.T, 1)
+                           for i in range(0, len(x), block_size)] or [np.zeros(0, np.int64)])
+
+
+class VectorIndex:
+    def __init__(self, path, dim=512, metric='l2'):
+        """opens (or creates) the index directory path"""
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        meta = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta):
+            with open(meta, 'w') as f:
+                json.dump({'dim': dim, 'metric': metric}, f)
+        with open(meta) as f:
+            meta = json.load(f)
+        if (meta['dim'], meta['metric']) != (dim, metric):
+            raise ValueError('%s is a %s index of dim %d' % (path, meta['metric'], meta['dim']))
+        self.dim, self.metric = dim, metric
+        self.ivf = None
+        self._open()
+        ivf = os.path.join(path, 'ivf.npz')
+        if os.path.exists(ivf):
+            with np.load(ivf) as f:
+                self.ivf = {'centroids': f['centroids'], 'codebooks': f['codebooks']}
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _open(self):
+        ids = _fromfile(self._file('ids.i64'), np.int64, 1)
+        vectors = _fromfile(self._file('vectors.f32'), np.float32, self.dim)
+        n = min(len(ids), len(vectors))
+        self.ids, self.vectors = ids[:n, 0], vectors[:n]
+        self._lists = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, ids, vectors):
+        vectors = np.asarray(vectors, np.float32).reshape(-1, self.dim)
+        ids = np.asarray(ids, np.int64).reshape(-1)
+        assert len(ids) == len(vectors)
+        # a previous interrupted append may have left vectors without ids, or part of a row in either file
+        for name, row_bytes in (('vectors.f32', self.dim * 4), ('ids.i64', 8)):
+            with open(self._file(name), 'ab') as f:
+                f.truncate(len(self) * row_bytes)
+        _append(self._file('vectors.f32'), vectors)
+        _append(self._file('ids.i64'), ids)
+        self._open()
+
+    # exact search
+
+    def search(self, queries, k=10, nprobe=None, rerank=0, block_size=65536):
+        """(ids [Q, k], scores [Q, k]) of the k nearest rows of each query, best first.
+        nprobe=None : exact, else IVF-PQ over nprobe lists (see train_ivf)"""
+        queries = np.asarray(queries, np.float32).reshape(-1, self.dim)
+        if nprobe is not None:
+            return self._search_ivf(queries, k, nprobe, rerank)
+        best = None
+        for start in range(0, len(self), block_size):
+            block = np.asarray(self.vectors[start:start + block_size])
+            best = _top_k(_scores(queries, block, self.metric), self.ids[start:start + block_size], k, self.metric, best)
+        if best is None:
+            return np.zeros((len(queries), 0), np.int64), np.zeros((len(queries), 0), np.float32)
+        return best
+
+    # IVF-PQ
+
+    def train_ivf(self, nlist=1024, m=16, train_size=None, nb_iter=20, seed=0):
+        """trains the coarse quantizer and the product quantizer on a sample of the rows, then encodes them all"""
+        if self.dim % m:
+            raise ValueError('m=%d does not divide dim=%d' % (m, self.dim))
+        rng = np.random.RandomState(seed)
+        train_size = min(len(self), train_size or max(nlist * 40, 256 * 40))
+        sample = np.asarray(self.vectors[np.sort(rng.choice(len(self), train_size, replace=False))])
+        centroids = kmeans(sample, nlist, nb_iter, seed)
+        residuals = (sample - centroids[assign_l2(sample, centroids)]).reshape(len(sample), m, -1)
+        codebooks = np.stack([kmeans(np.ascontiguousarray(residuals[:, j]), 256, nb_iter, seed + j) for j in range(m)])
+        np.savez(self._file('ivf.npz'), centroids=centroids, codebooks=codebooks)
+        for name in ('ivf_lists.i32', 'ivf_codes.u8'):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+        self.ivf = {'centroids': centroids, 'codebooks': codebooks}
+        self._lists = None
+        self._encode()
+
+    def _encode(self, block_size=65536):
+        """assigns and encodes the rows appended since the last call"""
+        centroids, codebooks = self.ivf['centroids'], self.ivf['codebooks']
+        m = len(codebooks)
+        done = len(_fromfile(self._file('ivf_lists.i32'), np.int32, 1))
+        codes_done = len(_fromfile(self._file('ivf_codes.u8'), np.uint8, m))
+        if codes_done != done: # interrupted : codes are written first
+            with open(self._file('ivf_codes.u8'), 'ab') as f:
+                f.truncate(done * m)
+        for start in range(done, len(self), block_size):
+            x = np.asarray(self.vectors[start:start + block_size])
+            lists = assign_l2(x, centroids)
+            residuals = (x - centroids[lists]).reshape(len(x), m, -1)
+            codes = np.stack([assign_l2(residuals[:, j], codebooks[j]) for j in range(m)], 1).astype(np.uint8)
+            _append(self._file('ivf_codes.u8'), codes)
+            _append(self._file('ivf_lists.i32'), lists.astype(np.int32))
+
+    def _load_lists(self):
+        if self._lists is None or self._lists[2] != len(self):
+            self._encode()
+            lists = _fromfile(self._file('ivf_lists.i32'), np.int32, 1)[:len(self), 0]
+            codes = _fromfile(self._file('ivf_codes.u8'), np.uint8, len(self.ivf['codebooks']))[:len(self)]
+            order = np.argsort(lists, kind='stable')
+            offsets = np.searchsorted(lists[order], np.arange(len(self.ivf['centroids']) + 1))
+            self._lists = (order, offsets, len(self), np.asarray(codes)[order])
+        return self._lists
+
+    def _search_ivf(self, queries, k, nprobe, rerank):
+        if self.ivf is None:
+            raise ValueError('no IVF in %s, see train_ivf' % self.path)
+        order, offsets, _, codes = self._load_lists()
+        centroids, codebooks = self.ivf['centroids'], self.ivf['codebooks']
+        m, dsub = codebooks.shape[0], codebooks.shape[2]
+        coarse = _scores(queries, centroids, self.metric)
+        probes = np.argsort(coarse if self.metric == 'l2' else -coarse, 1)[:, :nprobe]
+        nb_candidates = max(k, rerank)
+        all_ids = np.full((len(queries), nb_candidates), -1, np.int64)
+        all_scores = np.full((len(queries), nb_candidates), np.inf if self.metric == 'l2' else -np.inf, np.float32)
+        for qi, q in enumerate(queries):
+            cells = probes[qi]
+            sizes = offsets[cells + 1] - offsets[cells]
+            if not sizes.sum():
+                continue
+            rows = np.concatenate([np.arange(offsets[c], offsets[c + 1]) for c in cells])
+            cell = np.repeat(np.arange(len(cells)), sizes)
+            if self.metric == 'l2':
+                # ||q - c - r||^2 : sum over the sub-vectors of ||(q - c)_j - codebook_j[code_j]||^2
+                tables = (((q[None] - centroids[cells]).reshape(-1, m, 1, dsub) - codebooks[None]) ** 2).sum(-1)
+                scores = tables[cell[:, None], np.arange(m)[None], codes[rows]].sum(1)
+            else:
+                # q.(c + r) = q.c + sum over the sub-vectors of q_j.codebook_j[code_j]
+                table = (q.reshape(m, 1, dsub) * codebooks).sum(-1)
+                scores = coarse[qi, cells][cell] + table[np.arange(m)[None], codes[rows]].sum(1)
+            ids, scores = _top_k(scores[None], order[rows], nb_candidates, self.metric)
+            all_ids[qi, :ids.shape[1]], all_scores[qi, :ids.shape[1]] = ids[0], scores[0]
+        if rerank:
+            exact = np.stack([_scores(q[None], np.asarray(self.vectors[np.maximum(rows, 0)]), self.metric)[0]
+                              for q, rows in zip(queries, all_ids)])
+            exact[all_ids < 0] = np.inf if self.metric == 'l2' else -np.inf
+            rows, scores = _top_k(exact, all_ids, k, self.metric)
+        else:
+            rows, scores = all_ids[:, :k], all_scores[:, :k]
+        return np.where(rows >= 0, self.ids[np.maximum(rows, 0)], -1), scores
+
+    def near_duplicates(self, threshold, k=10, nprobe=None, block_size=4096):
+        """ids to drop so that no two kept rows are closer than threshold (l2 : squared distance below it,
+        ip : inner product above it), scanning the k nearest neighbours of each row; the earlier row is kept"""
+        position = {int(i): p for p, i in enumerate(self.ids)}
+        dropped = set()
+        for start in range(0, len(self), block_size):
+            ids, scores = self.search(self.vectors[start:start + block_size], k + 1, nprobe)
+            close = scores < threshold if self.metric == 'l2' else scores > threshold
+            for p, (row_ids, row_close) in enumerate(zip(ids, close), start):
+                if int(self.ids[p]) in dropped:
+                    continue
+                for i in row_ids[row_close]:
+                    if position.get(int(i), -1) > p:
+                        dropped.add(int(i))
+        return sorted(dropped)
+
+
+def index_dataset(index, directory):
+    """appends the W of the shards of a dataset directory (see dataset.py) not in index yet, returns their number"""
+    done_path = os.path.join(index.path, 'shards.json')
+    done = set()
+    if os.path.exists(done_path):
+        with open(done_path) as f:
+            done = set(json.load(f))
+    from .dataset import done_shards, shard_name
+    new = [shard_name(i) for i in sorted(done_shards(directory)) if shard_name(i) not in done]
+    for name in new:
+        with open(os.path.join(directory, name + '.json')) as f:
+            seeds = json.load(f)['seeds']
+        index.append(seeds, np.load(os.path.join(directory, name + '.latents.npy')))
+        done.add(name)
+        with open(done_path + '.tmp', 'w') as f:
+            json.dump(sorted(done), f)
+        os.replace(done_path + '.tmp', done_path)
+    return len(new)
+
+
+def synthetic_vectors(n, dim=512, nb_clusters=1000, intrinsic_dim=16, spread=0.5, noise=0.05, normalize=False, seed=0):
+    """clusters spread along a shared low dimensional subspace, plus a little isotropic noise : closer to
+    embeddings and W latents than isotropic noise in dim dimensions (where no index can do better than a scan)"""
+    rng = np.random.RandomState(seed % 2**31)
+    structure = np.random.RandomState(12345)
+    centers = structure.randn(nb_clusters, dim).astype(np.float32)
+    basis = (structure.randn(intrinsic_dim, dim) / np.sqrt(intrinsic_dim)).astype(np.float32)
+    x = centers[rng.randint(nb_clusters, size=n)] + spread * rng.randn(n, intrinsic_dim).astype(np.float32) @ basis * np.sqrt(dim)
+    x += noise * np.sqrt(dim / intrinsic_dim) * rng.randn(n, dim).astype(np.float32)
+    if normalize:
+        x /= np.linalg.norm(x, axis=1, keepdims=True)
+    return x
+
+
+def bench_index(path, n=200000, dim=512, metric='ip', nb_queries=100, k=10, nlist=None, m=32,
+                nprobes=(1, 4, 16, 64), rerank=100, seed=0):
+    """builds a synthetic index at path (appended in shards) and prints the query latency and the
+    recall@k of exact and IVF-PQ search (recall : fraction of the exact k nearest found)"""
+    nlist = nlist or int(4 * np.sqrt(n))
+    index = VectorIndex(path, dim, metric)
+    shard = 50000
+    t0 = time.perf_counter()
+    for start in range(len(index), n, shard):
+        index.append(np.arange(start, min(n, start + shard)),
+                     synthetic_vectors(min(n, start + shard) - start, dim, normalize=metric == 'ip', seed=seed + start))
+    print('%d vectors (%.0f MB) appended in %.1f s' % (len(index), len(index) * dim * 4 / 2**20, time.perf_counter() - t0))
+    queries = synthetic_vectors(nb_queries, dim, normalize=metric == 'ip', seed=seed + n + 1)
+    report = {}
+    t0 = time.perf_counter()
+    truth, _ = index.search(queries, k)
+    report['exact'] = {'ms_per_query': (time.perf_counter() - t0) / nb_queries * 1e3, 'recall': 1.}
+    t0 = time.perf_counter()
+    index.train_ivf(nlist, m, seed=seed)
+    print('ivf-pq nlist=%d m=%d trained and encoded in %.1f s' % (nlist, m, time.perf_counter() - t0))
+    for nprobe in nprobes:
+        for r in (0, rerank):
+            t0 = time.perf_counter()
+            ids, _ = index.search(queries, k, nprobe, r)
+            ms = (time.perf_counter() - t0) / nb_queries * 1e3
+            recall = np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(ids, truth)])
+            report['nprobe=%d rerank=%d' % (nprobe, r)] = {'ms_per_query': ms, 'recall': recall}
+    for name, r in report.items():
+        print('%-22s %8.2f ms/query  recall@%d %.3f' % (name, r['ms_per_query'], k, r['recall']))
+    return report
@@ -0,0 +1,241 @@
+"""Int8 inference for the equalized-lr layers (MyConv2d of g_synthesis, MyLinear of g_mapping).
+
+Weights are quantized per output channel (symmetric qint8), activations per tensor (affine quint8)
+from ranges calibrated on sampled latents. The layers run the fbgemm / x86 quantized kernels and
+hand float tensors to the rest of the network (noise, instance norm, styles stay float).
+
+    layers = calibrate(g_all, torch.randn(64, 512))
+    quantize(g_all, layers, exclude=['g_synthesis.torgb'])  # mixed precision : torgb stays float
+    ...
+    dequantize(g_all)
+
+quantization_report() compares int8 configs against float32 on the same seeds and noise, and
+picks the fastest one within a PSNR budget by leaving the most sensitive layers in float.
+Tiled blocks (G_synthesis.set_tiling) do not use the int8 layers.
+"""
+import fnmatch
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from .networks import MyConv2d, MyLinear, StyleMod, polyphase_weight, upscale2d
+from .noise import NoiseBank
+
+
+def quantizable_layers(g_all):
+    """(name, layer) of the MyConv2d / MyLinear run by their forward (not the StyleMod affines,
+    which go through the style table)"""
+    style_lins = {id(m.lin) for m in g_all.modules() if isinstance(m, StyleMod)}
+    return [(name, m) for name, m in g_all.named_modules()
+            if isinstance(m, (MyConv2d, MyLinear)) and id(m) not in style_lins]
+
+
+def _qparams(lo, hi, reduce_range):
+    """scale and zero point of a quint8 tensor covering [lo, hi] (and 0)"""
+    lo, hi = min(lo, 0.), max(hi, 0.)
+    levels = 127 if reduce_range else 255 # reduce_range : 7 bits, no overflow in the x86 kernels
+    scale = max((hi - lo) / levels, 1e-8)
+    return scale, int(np.clip(round(-lo / scale), 0, levels))
+
+
+def _qweight(w):
+    """per output channel symmetric qint8"""
+    scale = (w.abs().flatten(1).amax(1) / 127).clamp(min=1e-8).double()
+    return torch.quantize_per_channel(w.float().contiguous(), scale, torch.zeros_like(scale, dtype=torch.long),
+                                      0, torch.qint8)
+
+
+class _Int8Layer:
+    """float forward that records the activation ranges until convert(), int8 forward after"""
+    def __init__(self, layer):
+        self.layer = layer
+        self.ranges = {}
+        self.packed = {}
+
+    def _observe(self, kind, x, y):
+        r = self.ranges.get(kind, (np.inf, -np.inf, np.inf, -np.inf))
+        self.ranges[kind] = (min(r[0], x.min().item()), max(r[1], x.max().item()),
+                             min(r[2], y.min().item()), max(r[3], y.max().item()))
+
+    def convert(self, reduce_range=True):
+        for kind, (x_lo, x_hi, y_lo, y_hi) in self.ranges.items():
+            weight, bias = self._float_params(kind)
+            self.packed[kind] = (self._prepack(kind, _qweight(weight), None if bias is None else bias.float()),
+                                 _qparams(x_lo, x_hi, reduce_range), _qparams(y_lo, y_hi, False))
+        return self
+
+    def _run(self, kind, x, upscale=False):
+        if kind not in self.packed:
+            # calibration (or a shape seen for the first time after it : stays float)
+            if upscale:
+                x = upscale2d(x)
+            y = self._float_op(kind, x, *self._float_params(kind))
+            self._observe(kind, x, y)
+            return y
+        packed, (x_scale, x_zp), (y_scale, y_zp) = self.packed[kind]
+        qx = torch.quantize_per_tensor(x.float(), x_scale, x_zp, torch.quint8)
+        if upscale:
+            qx = F.interpolate(qx, scale_factor=2, mode='nearest') # = upscale2d
+        return self._int8_op(kind, qx, packed, y_scale, y_zp).dequantize().to(x.dtype)
+
+
+class Int8Linear(_Int8Layer):
+    def _float_params(self, kind):
+        return self.layer.scaled_params()
+
+    def _float_op(self, kind, x, weight, bias):
+        return F.linear(x, weight, bias)
+
+    def _prepack(self, kind, qweight, bias):
+        return torch.ops.quantized.linear_prepack(qweight, bias)
+
+    def _int8_op(self, kind, qx, packed, scale, zero_point):
+        return torch.ops.quantized.linear(qx, packed, scale, zero_point)
+
+    def __call__(self, x):
+        return self._run('linear', x)
+
+
+class Int8Conv2d(_Int8Layer):
+    """plain, upscale (unfused : nearest + conv, fused : polyphase conv) and blur-intermediate convs.
+    The conv runs in int8, the blur and the bias that follows it in float."""
+    def _float_params(self, kind):
+        conv = self.layer
+        fold_bias = conv.intermediate is None
+        if kind == 'fused':
+            weight, bias = conv.scaled_params(fused=True)
+            weight = polyphase_weight(weight)
+            bias = None if bias is None or not fold_bias else bias.repeat(4)
+            return weight, bias
+        weight, bias = conv.scaled_params()
+        return weight, bias if fold_bias else None
+
+    def _padding(self, kind):
+        return 1 if kind == 'fused' else self.layer.kernel_size // 2
+
+    def _float_op(self, kind, x, weight, bias):
+        return F.conv2d(x, weight, bias, padding=self._padding(kind))
+
+    def _prepack(self, kind, qweight, bias):
+        p = self._padding(kind)
+        return torch.ops.quantized.conv2d_prepack(qweight, bias, [1, 1], [p, p], [1, 1], 1)
+
+    def _int8_op(self, kind, qx, packed, scale, zero_point):
+        return torch.ops.quantized.conv2d(qx, packed, scale, zero_point)
+
+    def __call__(self, x):
+        conv = self.layer
+        if conv.upscale is not None and min(x.shape[2:]) * 2 >= conv.fuse_min_size:
+            b, _, h, w = x.shape
+            y = self._run('fused', x)
+            y = torch.stack([y[:, k*y.size(1)//4:(k+1)*y.size(1)//4, a:a+h, c:c+w]
+                             for k, (a, c) in enumerate([(0, 0), (0, 1), (1, 0), (1, 1)])], 2)
+            y = y.view(b, -1, 2, 2, h, w).permute(0, 1, 4, 2, 5, 3).reshape(b, -1, 2*h, 2*w)
+        else:
+            y = self._run('plain', x, upscale=conv.upscale is not None)
+        if conv.intermediate is None:
+            return y
+        y = conv.intermediate(y)
+        bias = conv.scaled_params()[1]
+        if bias is not None:
+            y = y + bias.view(1, -1, 1, 1).to(y.dtype)
+        return y
+
+
+def calibrate(g_all, latents, batch_size=8, reduce_range=True):
+    """runs g_all in float on latents while recording the activation ranges of every quantizable
+    layer, then converts them. Returns {name: int8 layer}, to give to quantize()."""
+    layers = {name: (Int8Conv2d if isinstance(m, MyConv2d) else Int8Linear)(m) for name, m in quantizable_layers(g_all)}
+    modules = dict(quantizable_layers(g_all))
+    try:
+        for name, layer in layers.items():
+            modules[name].int8 = layer
+        with torch.no_grad():
+            for i in range(0, len(latents), batch_size):
+                g_all(latents[i:i + batch_size])
+    finally:
+        dequantize(g_all)
+    return {name: layer.convert(reduce_range) for name, layer in layers.items()}
+
+
+def quantize(g_all, layers, exclude=()):
+    """switches the layers of calibrate() to int8, except the names matching one of the fnmatch
+    patterns of exclude (mixed precision fallback). Returns the names of the int8 layers."""
+    modules = dict(quantizable_layers(g_all))
+    names = []
+    for name, layer in layers.items():
+        int8 = not any(fnmatch.fnmatch(name, p) for p in exclude)
+        modules[name].int8 = layer if int8 else None
+        if int8:
+            names.append(name)
+    return names
+
+
+def dequantize(g_all):
+    for _, m in quantizable_layers(g_all):
+        m.int8 = None
+    return g_all
+
+
+def quantization_report(g_all, psnr_budget=30., nb_samples=8, nb_calibration=64, batch_size=4, seed=0,
+                        reduce_range=True):
+    """int8 vs float32 on the same seeds and noise :
+    - PSNR of each layer quantized alone (its sensitivity)
+    - all layers int8, then the most sensitive layers back to float one at a time, until the
+      PSNR reaches psnr_budget.
+    Prints a table and returns (report rows, exclude list of the chosen config)."""
+    from .bench import psnr
+    device = next(g_all.parameters()).device
+    rng = np.random.RandomState(seed)
+    calibration = torch.from_numpy(rng.randn(nb_calibration, 512)).float().to(device)
+    z = torch.from_numpy(rng.randn(nb_samples, 512)).float().to(device)
+    NoiseBank('cached', seed=seed).attach(g_all)
+
+    def render():
+        with torch.no_grad():
+            g_all(z[:batch_size]) # warm-up
+            t0 = time.perf_counter()
+            out = torch.cat([g_all(z[i:i + batch_size]) for i in range(0, nb_samples, batch_size)])
+        return out, (time.perf_counter() - t0) / nb_samples
+
+    try:
+        dequantize(g_all)
+        ref, ref_time = render()
+        layers = calibrate(g_all, calibration, batch_size, reduce_range)
+        sensitivity = {}
+        for name in layers:
+            quantize(g_all, {name: layers[name]})
+            sensitivity[name] = psnr(render()[0], ref).mean().item()
+            dequantize(g_all)
+        print('%-40s %9s' % ('layer quantized alone', 'PSNR dB'))
+        for name, value in sorted(sensitivity.items(), key=lambda kv: kv[1]):
+            print('%-40s %9.2f' % (name, value))
+
+        rows, chosen = [{'float_layers': [], 'psnr': np.inf, 'max_abs_error': 0., 'ms': ref_time * 1e3,
+                         'label': 'float32'}], None
+        order = sorted(sensitivity, key=sensitivity.get)
+        for k in range(len(order) + 1):
+            exclude = order[:k]
+            quantize(g_all, layers, exclude)
+            out, t = render()
+            values = psnr(out, ref)
+            rows.append({'float_layers': exclude, 'psnr': values.mean().item(), 'psnr_min': values.min().item(),
+                         'max_abs_error': (out.clamp(-1, 1) - ref.clamp(-1, 1)).abs().max().item(), 'ms': t * 1e3,
+                         'label': 'int8, %d float layer(s)' % k})
+            if rows[-1]['psnr'] >= psnr_budget:
+                chosen = exclude
+                break
+    finally:
+        dequantize(g_all)
+        NoiseBank.detach(g_all)
+    print('%-28s %9s %9s %9s %9s' % ('config', 'PSNR dB', 'max err', 'ms/img', 'speed-up'))
+    for row in rows:
+        print('%-28s %9.2f %9.4f %9.1f %9.2f' % (row['label'], row['psnr'], row['max_abs_error'], row['ms'],
+                                                  ref_time * 1e3 / row['ms']))
+    if chosen is None:
+        print('no int8 config within %.1f dB' % psnr_budget)
+    else:
+        print('chosen : int8 with float %s' % (chosen or 'none'))
+    return rows, chosen
@@ -0,0 +1,297 @@
+"""Batch size from a memory budget : how many samples G_synthesis can render at once.
+
+    planner = MemoryPlanner(g_all.g_synthesis).probe()   # estimate, checked by one measured run
+    batch_size = planner.max_batch_size(8 << 30)           # largest batch within 8 GiB
+    images = planner.run(lambda z: g_all(z), z)            # any number of z, in sub-batches
+
+Activations grow linearly with the batch and only the input and output of a block outlive it, so
+the peak of a forward is the largest peak of a block (or of the final torgb). The estimate of a
+block counts, per sample, the maps its ops hold at the same time, from its channels (fmap_base,
+fmap_max), resolution and activation dtype, in the execution mode of the model :
+ - upscale conv : its input, the upscaled copy (unfused) or not (fused / folded), conv and blur outputs;
+ - epilogues : out of place ops (dynamic) or in place (fused), plus the float32 copy the instance
+   norm statistics read in reduced precision;
+ - tiled blocks : whole input and output, one tile of the above and its float64 statistics pass;
+ - static execution : the arena slabs (see arena.py), which the levels share.
+probe() runs the blocks one by one on a small batch and measures their peak : the peak RSS
+(VmHWM, reset through /proc/self/clear_refs after a malloc_trim) on CPU, the allocator peak on
+CUDA. What the probe measures above the estimate is taken as a per-call constant (workspaces,
+weight reorders), so a model whose estimate is short is planned on what it actually uses.
+"""
+import ctypes
+import math
+import sys
+
+import torch
+
+from .networks import REDUCED_DTYPES, _foldable
+
+
+def _element_size(dtype):
+    return torch.empty((), dtype=dtype).element_size()
+
+
+def _upconv_mode(conv, size):
+    """'folded', 'fused' or 'unfused' : the upscale conv path MyConv2d.forward takes for an output of size"""
+    if size >= conv.fold_min_size and _foldable(conv.intermediate):
+        return 'folded'
+    return 'fused' if size >= conv.fuse_min_size else 'unfused'
+
+
+def _block_bytes(c_in, c, size, s, reduced, upconv, fused):
+    """bytes per sample held at the peak of a dynamic GSynthesisBlock : (upscale conv peak, epilogue peak)"""
+    e_in, e = c_in * (size // 2)**2 * s, c * size**2 * s
+    f = c * size**2 * 4 if reduced else 0 # float32 copy read by the instance norm statistics
+    if upconv == 'unfused':
+        up = e_in + max(4 * e_in + e, 3 * e) # upscaled input + conv output, then blur and bias outputs
+    else:
+        up = e_in + 3 * e
+    epi = (2 * e + f) if fused else (5 * e + 2 * f)
+    return up, epi
+
+
+class MemoryPlanner:
+    def __init__(self, g_synthesis, device=None):
+        self.g_synthesis = g_synthesis
+        self.device = torch.device(device) if device is not None else next(g_synthesis.parameters()).device
+        self.measured = None # bytes per block at the probe batch size
+        self.probe_batch_size = None
+
+    def mode(self):
+        g = self.g_synthesis
+        if g.static and g.tile_size is None:
+            return 'static'
+        if g.tile_size is not None:
+            return 'tiled'
+        return 'fused' if all(b.epi1.fused and b.epi2.fused for b in g.blocks.values()) else 'dynamic'
+
+    def estimate(self):
+        """[{'name', 'size', 'bytes'}] : the per-sample peak of each block, then of torgb ('output'), in the
+        current mode and dtype. In static mode, one 'arena' row : the arena per sample"""
+        g = self.g_synthesis
+        s = _element_size(g.dtype)
+        reduced = g.dtype in REDUCED_DTYPES
+        mode = self.mode()
+        fused = mode in ('fused', 'static') or all(b.epi1.fused and b.epi2.fused for b in g.blocks.values())
+        n_rgb = g.torgb.weight.size(0)
+        rows, slabs = [], [0, 0, 0, 0] # static : slab 0, slab 1, scratch 0, scratch 1
+        c_in = None
+        for i, (name, block) in enumerate(g.blocks.items()):
+            size = 2**(i + 2)
+            if i == 0:
+                c = block.conv.weight.size(0)
+                e = c * size**2 * 4
+                rows.append({'name': name, 'size': size, 'bytes': 4 * e})
+                slabs = [max(a, b) for a, b in zip(slabs, (c * size**2 * s, e, e + (e if reduced else 0), 0))]
+                c_in = c
+                continue
+            c = block.conv1.weight.size(0)
+            upconv = _upconv_mode(block.conv0_up, size)
+            e_in, e, f = c_in * (size // 2)**2 * s, c * size**2 * s, (c * size**2 * 4 if reduced else 0)
+            if mode == 'static':
+                scratch = {'folded': e, 'fused': c * (size + 2)**2 * s, 'unfused': 4 * e_in}[upconv]
+                blur = e if upconv != 'folded' and block.conv0_up.intermediate is not None else 0
+                slabs = [max(a, b) for a, b in zip(slabs, (e, e, max(scratch, f), blur))]
+            elif mode == 'tiled' and size >= g.tile_min_resolution:
+                t = min(g.tile_size, size) + 8 # tile and halo
+                up, epi = _block_bytes(c_in, c, t, s, reduced, upconv, fused)
+                stats = 2 * c * t**2 * 8 # float64 statistics pass over a tile
+                last = i == len(g.blocks) - 1
+                out = n_rgb * size**2 * 4 if last else e
+                rows.append({'name': name, 'size': size, 'bytes': e_in + out + max(up, epi) + stats})
+            else:
+                up, epi = _block_bytes(c_in, c, size, s, reduced, upconv, fused)
+                rows.append({'name': name, 'size': size, 'bytes': max(up, epi, 2 * e)})
+            c_in = c
+        rgb = n_rgb * size**2 * 4
+        if mode == 'static':
+            if reduced:
+                slabs[2] = max(slabs[2], c_in * size**2 * 4) # float32 torgb input
+            return [{'name': 'arena', 'size': size, 'bytes': sum(slabs) + 2 * rgb}]
+        if not (mode == 'tiled' and size >= g.tile_min_resolution):
+            rows.append({'name': 'output', 'size': size, 'bytes': c_in * size**2 * (s + (4 if reduced else 0)) + 2 * rgb})
+        return rows
+
+    def _current(self):
+        """bytes held : allocated on CUDA, resident on CPU (after returning the freed heap to the system,
+        so that its reuse does not hide growth)"""
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            return torch.cuda.memory_allocated(self.device)
+        _trim()
+        return _status('VmRSS')
+
+    def _held(self):
+        """_current(), or without /proc the peak RSS of the process (getrusage, an upper bound), or 0
+        where neither exists : the budget is then all free room"""
+        if self.device.type == 'cuda':
+            return self._current()
+        try:
+            return self._current()
+        except (OSError, KeyError):
+            pass
+        try:
+            import resource
+        except ImportError:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024 # bytes on macOS, KiB elsewhere
+
+    def _reset(self):
+        """current bytes, the peak counter being reset to it"""
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+        else:
+            held = self._current()
+            _reset_rss_peak()
+            return held
+        return self._current()
+
+    def _peak(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            return torch.cuda.max_memory_allocated(self.device)
+        return _status('VmHWM')
+
+    def probe(self, batch_size=2, seed=0):
+        """measures the peak of each estimate row on one forward of batch_size samples (after an unmeasured
+        one at batch size 1, which caches the weights). On CPU without /proc, keeps the estimate only."""
+        if self.device.type != 'cuda' and not _reset_rss_peak():
+            print('no /proc/self/clear_refs : batch sizes from the estimate only', file=sys.stderr)
+            return self
+        g = self.g_synthesis
+        generator = torch.Generator().manual_seed(seed)
+        w = torch.randn(batch_size, 1, g.dlatent_size, generator=generator).to(self.device)
+        dlatents = w.expand(-1, g.num_layers, -1)
+        measured = []
+        with torch.no_grad():
+            g(dlatents[:1]) # warm-up : frozen weight caches, oneDNN primitives
+            styles = g.styles(dlatents)
+            if self.mode() == 'static':
+                base = self._reset()
+                g._arenas = {} # planned again, inside the measurement
+                g(dlatents, styles)
+                measured.append(self._peak() - base)
+            else:
+                x = None
+                for i in range(len(g.blocks)):
+                    base = self._reset()
+                    held = 0 if x is None else x.numel() * x.element_size()
+                    x, done = g._run_blocks(dlatents, styles, x, i, i + 1)
+                    measured.append(self._peak() - base + held)
+                if not done:
+                    base = self._reset()
+                    held = x.numel() * x.element_size()
+                    g.torgb(x.float() if x.dtype in REDUCED_DTYPES else x).contiguous()
+                    measured.append(self._peak() - base + held)
+        self.measured = measured
+        self.probe_batch_size = batch_size
+        return self
+
+    def rows(self):
+        """estimate rows with 'measured' (bytes at the probe batch size) and 'fixed' (per call bytes) when probed"""
+        rows = self.estimate()
+        for i, row in enumerate(rows):
+            if self.measured is not None:
+                row['measured'] = self.measured[i]
+                row['fixed'] = max(0, self.measured[i] - self.probe_batch_size * row['bytes'])
+            else:
+                row['fixed'] = 0
+        return rows
+
+    def peak(self, batch_size):
+        """planned peak bytes of a forward of batch_size samples"""
+        return max(row['fixed'] + batch_size * row['bytes'] for row in self.rows())
+
+    def max_batch_size(self, budget=None, safety=0.8, limit=1024):
+        """largest batch whose planned peak fits in safety * budget minus what the process already holds.
+        budget : total bytes for the process (default : what it holds plus MemAvailable, Linux only). At least 1."""
+        held = self._held()
+        if budget is None:
+            available = _available()
+            if available is None:
+                raise ValueError('no /proc/meminfo to read the available memory from : give a budget')
+            budget = held + available
+        room = safety * budget - held
+        batch_size = min(int((room - row['fixed']) // max(row['bytes'], 1)) for row in self.rows())
+        if batch_size < 1:
+            print('budget of %.0f MB too small for one sample (%.0f MB held, %.0f MB planned) : batch 1'
+                  % (budget / 2**20, held / 2**20, self.peak(1) / 2**20), file=sys.stderr)
+        return max(1, min(batch_size, limit))
+
+    def split(self, n, batch_size):
+        """sizes of the sub-batches of a request of n samples : balanced (dynamic) or all batch_size but the
+        last (static, whose arenas are per batch size : see run)"""
+        if n <= batch_size:
+            return [n]
+        if self.g_synthesis.static:
+            return [batch_size] * (n // batch_size) + ([n % batch_size] if n % batch_size else [])
+        nb = math.ceil(n / batch_size)
+        return [n // nb + (i < n % nb) for i in range(nb)]
+
+    def run(self, fn, inputs, batch_size=None, budget=None):
+        """fn(sub-batch of inputs) over sub-batches of at most batch_size (default : max_batch_size(budget)),
+        outputs concatenated. In static mode the last sub-batch is padded to batch_size (one arena) and
+        the arena views are copied out."""
+        batch_size = batch_size or self.max_batch_size(budget)
+        outputs, start = [], 0
+        for n in self.split(len(inputs), batch_size):
+            sub = inputs[start:start + n]
+            if self.g_synthesis.static and n < batch_size:
+                sub = torch.cat([sub, sub[-1:].expand(batch_size - n, *sub.shape[1:])])
+            out = fn(sub)
+            outputs.append(out[:n].clone() if self.g_synthesis.static else out)
+            start += n
+        return torch.cat(outputs)
+
+    def report(self, budgets=()):
+        """prints the estimate (and probe) of each row, then the batch size of each budget"""
+        for row in self.rows():
+            line = '%-8s %5d : %8.1f MB/sample' % (row['name'], row['size'], row['bytes'] / 2**20)
+            if 'measured' in row:
+                estimated = self.probe_batch_size * row['bytes']
+                line += ', measured %8.1f MB at batch %d (%.2fx the estimate)' % (
+                    row['measured'] / 2**20, self.probe_batch_size, row['measured'] / max(estimated, 1))
+            print(line)
+        for budget in budgets:
+            batch_size = self.max_batch_size(budget)
+            print('budget %6.0f MB : batch %4d, activations %8.1f MB at the peak'
+                  % (budget / 2**20, batch_size, self.peak(batch_size) / 2**20))
+
+
+def _status(key):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(key + ':'):
+                return int(line.split()[1]) * 1024
+    raise KeyError(key)
+
+
+def _trim():
+    """returns the freed heap to the system (glibc), so that its reuse does not hide growth from the RSS"""
+    trim = getattr(ctypes.CDLL(None), 'malloc_trim', None)
+    if trim is not None:
+        trim(0)
+
+
+def _reset_rss_peak():
+    """resets the peak RSS (VmHWM) to the current RSS. False without /proc/self/clear_refs"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _available():
+    """MemAvailable bytes, None without /proc/meminfo"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
@@ -0,0 +1,1053 @@
+"""StyleGAN generator networks (mapping, synthesis and their layers).
+
+Importing this module has no side effects beyond importing torch and numpy.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+# Inference mode : MyLinear and MyConv2d can be frozen, in which case the equalized-lr scaling
+# (and the fused upscale or folded resampling kernel) is computed once and cached. The cache is
+# keyed on the parameters' version counter and storage, so load_state_dict, in-place updates or
+# .to(device) invalidate it.
+
+def _params_key(*params):
+    return tuple((p._version, p.data_ptr(), p.dtype, p.device) for p in params if p is not None)
+
+
+# Reduced precision mode (G_synthesis.set_precision) : the parameters stay float32, the layers cast
+# them to the dtype and memory format of their input. InstanceNorm statistics, PixelNorm and torgb
+# are computed in float32.
+
+REDUCED_DTYPES = (torch.bfloat16, torch.float16)
+
+
+def _channels_last(x):
+    return x.dim() == 4 and not x.is_contiguous() and x.is_contiguous(memory_format=torch.channels_last)
+
+
+class MyLinear(nn.Module):
+    """Linear layer with equalized learning rate and custom learning rate multiplier."""
+    int8 = None # int8 replacement of forward, see int8.py
+    def __init__(self, input_size, output_size, gain=2**(0.5), use_wscale=False, lrmul=1, bias=True):
+        super().__init__()
+        he_std = gain * input_size**(-0.5) # He init
+        # Equalized learning rate and custom learning rate multiplier.
+        if use_wscale:
+            init_std = 1.0 / lrmul
+            self.w_mul = he_std * lrmul
+        else:
+            init_std = he_std / lrmul
+            self.w_mul = lrmul
+        self.weight = torch.nn.Parameter(torch.randn(output_size, input_size) * init_std)
+        if bias:
+            self.bias = torch.nn.Parameter(torch.zeros(output_size))
+            self.b_mul = lrmul
+        else:
+            self.bias = None
+        self.frozen = False
+        self._cache = None
+
+    def freeze(self, mode=True):
+        """inference only : cache the scaled weight and bias instead of recomputing them at each call"""
+        self.frozen = mode
+        self._cache = None
+        return self
+
+    def scaled_params(self):
+        if not self.frozen:
+            bias = self.bias
+            if bias is not None:
+                bias = bias * self.b_mul
+            return self.weight * self.w_mul, bias
+        key = _params_key(self.weight, self.bias)
+        if self._cache is None or self._cache[0] != key:
+            with torch.no_grad():
+                bias = None if self.bias is None else self.bias * self.b_mul
+                self._cache = (key, self.weight * self.w_mul, bias)
+        return self._cache[1:]
+
+    def forward(self, x):
+        if self.int8 is not None:
+            return self.int8(x)
+        weight, bias = self.scaled_params()
+        return F.linear(x, weight, bias)
+
+
+class MyConv2d(nn.Module):
+    """Conv layer with equalized learning rate and custom learning rate multiplier."""
+    fuse_min_size = 128 # upscale convs whose output is at least this large use the fused kernel
+    fold_min_size = 256 # from this output size, upscale + conv + blur run as one folded conv (resample2d)
+    int8 = None # int8 replacement of forward, see int8.py
+    def __init__(self, input_channels, output_channels, kernel_size, gain=2**(0.5), use_wscale=False, lrmul=1, bias=True,
+                intermediate=None, upscale=False):
+        super().__init__()
+        if upscale:
+            self.upscale = Upscale2d()
+        else:
+            self.upscale = None
+        he_std = gain * (input_channels * kernel_size ** 2) ** (-0.5) # He init
+        self.kernel_size = kernel_size
+        if use_wscale:
+            init_std = 1.0 / lrmul
+            self.w_mul = he_std * lrmul
+        else:
+            init_std = he_std / lrmul
+            self.w_mul = lrmul
+        self.weight = torch.nn.Parameter(torch.randn(output_channels, input_channels, kernel_size, kernel_size) * init_std)
+        if bias:
+            self.bias = torch.nn.Parameter(torch.zeros(output_channels))
+            self.b_mul = lrmul
+        else:
+            self.bias = None
+        self.intermediate = intermediate
+        self.frozen = False
+        self._cache = None
+
+    def freeze(self, mode=True):
+        """inference only : cache the scaled weight, bias and fused upscale / folded kernels"""
+        self.frozen = mode
+        self._cache = None
+        return self
+
+    def _fused_weight(self, w):
+        # this is the fused upscale + conv from StyleGAN, sadly this seems incompatible with the non-fused way
+        # this really needs to be cleaned up and go into the conv...
+        w = w.permute(1, 0, 2, 3)
+        # probably applying a conv on w would be more efficient. also this quadruples the weight (average)?!
+        w = F.pad(w, (1,1,1,1))
+        return w[:, :, 1:, 1:]+ w[:, :, :-1, 1:] + w[:, :, 1:, :-1] + w[:, :, :-1, :-1]
+
+    def _cached(self, variant, build):
+        if not self.frozen:
+            return build()
+        key = _params_key(self.weight, self.bias)
+        if self._cache is None or self._cache['key'] != key:
+            self._cache = {'key': key}
+        if variant not in self._cache:
+            with torch.no_grad():
+                self._cache[variant] = build()
+        return self._cache[variant]
+
+    def scaled_params(self, fused=False, dtype=None, channels_last=False):
+        """returns (weight, bias) with the equalized-lr multipliers applied.
+        with fused=True, weight is the transposed kernel of the fused upscale + conv.
+        dtype and channels_last cast them for an input of that dtype and memory format."""
+        return self._cached((fused, dtype, channels_last), lambda: self._scaled_params(fused, dtype, channels_last))
+
+    def folded_params(self, fused, dtype=None, channels_last=False):
+        """(weight, bias, edges) of resample2d for upscale + conv + blur, fused or not"""
+        def build():
+            weight, bias = self._scaled_params(True, None, False)
+            if not fused:
+                weight = weight.flip(2, 3) # upscale + conv is the transposed conv by the flipped kernel
+            weight, bias, edges = fold_resample(weight, self.intermediate.kernel, bias)
+            weight = weight.to(dtype) if dtype is not None else weight
+            bias = bias.to(dtype) if dtype is not None and bias is not None else bias
+            edges = [(k.to(dtype), b.to(dtype)) for k, b in edges] if dtype is not None else edges
+            if channels_last:
+                weight = weight.contiguous(memory_format=torch.channels_last)
+            return weight, bias, edges
+        return self._cached(('folded', fused, dtype, channels_last), build)
+
+    def _scaled_params(self, fused, dtype, channels_last):
+        weight = self.weight * self.w_mul
+        bias = None if self.bias is None else self.bias * self.b_mul
+        if fused:
+            weight = self._fused_weight(weight)
+        if dtype is not None:
+            weight = weight.to(dtype)
+            bias = None if bias is None else bias.to(dtype)
+        if channels_last:
+            weight = weight.contiguous(memory_format=torch.channels_last)
+        return weight, bias
+
+    def forward(self, x):
+        if self.int8 is not None:
+            return self.int8(x)
+        fused = self.upscale is not None and min(x.shape[2:]) * 2 >= self.fuse_min_size
+        if self.upscale is not None and min(x.shape[2:]) * 2 >= self.fold_min_size and _foldable(self.intermediate):
+            return resample2d(x, *self.folded_params(fused, x.dtype, _channels_last(x)))
+        weight, bias = self.scaled_params(fused, x.dtype, _channels_last(x))
+
+        have_convolution = False
+        if fused:
+            x = F.conv_transpose2d(x, weight, stride=2, padding=(weight.size(-1)-1)//2)
+            have_convolution = True
+        elif self.upscale is not None:
+            x = self.upscale(x)
+    
+        if not have_convolution and self.intermediate is None:
+            return F.conv2d(x, weight, bias, padding=self.kernel_size//2)
+        elif not have_convolution:
+            x = F.conv2d(x, weight, None, padding=self.kernel_size//2)
+        
+        if self.intermediate is not None:
+            x = self.intermediate(x)
+        if bias is not None:
+            x = x + bias.view(1, -1, 1, 1)
+        return x
+
+
+class NoiseLayer(nn.Module):
+    """adds noise. noise is per pixel (constant over channels) with per-channel weight"""
+    def __init__(self, channels):
+        super().__init__()
+        self.weight = nn.Parameter(torch.zeros(channels))
+        self.noise = None
+        self.noise_bank = None # set by NoiseBank.attach
+        self.noise_index = None
+    
+    def get_noise(self, x):
+        """the noise to add to x (only its batch size and spatial shape matter), None for no noise"""
+        if self.noise is not None:
+            # here is a little trick: if you get all the noiselayers and set each
+            # modules .noise attribute, you can have pre-defined noise.
+            # Very useful for analysis
+            return self.noise
+        if self.noise_bank is not None:
+            return self.noise_bank.noise(self.noise_index, x) # None in const mode without planes
+        return torch.randn(x.size(0), 1, x.size(2), x.size(3), device=x.device, dtype=x.dtype)
+
+    def forward(self, x, noise=None):
+        if noise is None:
+            noise = self.get_noise(x)
+            if noise is None:
+                return x
+        x = x + self.weight.view(1, -1, 1, 1).to(x.dtype) * noise
+        return x
+
+
+class StyleMod(nn.Module):
+    def __init__(self, latent_size, channels, use_wscale):
+        super(StyleMod, self).__init__()
+        self.lin = MyLinear(latent_size,
+                            channels * 2,
+                            gain=1.0, use_wscale=use_wscale)
+        
+    def forward(self, x, latent, style=None):
+        if style is None:
+            style = self.lin(latent) # style => [batch_size, n_channels*2]
+        shape = [-1, 2, x.size(1)] + (x.dim() - 2) * [1]
+        style = style.view(shape)  # [batch_size, 2, n_channels, ...]
+        x = x * (style[:, 0] + 1.).to(x.dtype) + style[:, 1].to(x.dtype)
+        return x
+
+
+class PixelNormLayer(nn.Module):
+    def __init__(self, epsilon=1e-8):
+        super().__init__()
+        self.epsilon = epsilon
+    def forward(self, x):
+        x32 = x.float() if x.dtype in REDUCED_DTYPES else x
+        return (x32 * torch.rsqrt(torch.mean(x32**2, dim=1, keepdim=True) + self.epsilon)).to(x.dtype)
+
+
+class InstanceNorm2d(nn.InstanceNorm2d):
+    """nn.InstanceNorm2d with float32 statistics for bfloat16 / float16 inputs"""
+    def forward(self, x):
+        if x.dtype in REDUCED_DTYPES:
+            return super().forward(x.float()).to(x.dtype)
+        return super().forward(x)
+
+
+class BlurLayer(nn.Module):
+    def __init__(self, kernel=[1, 2, 1], normalize=True, flip=False, stride=1):
+        super(BlurLayer, self).__init__()
+        kernel=[1, 2, 1]
+        kernel = torch.tensor(kernel, dtype=torch.float32)
+        kernel = kernel[:, None] * kernel[None, :]
+        kernel = kernel[None, None]
+        if normalize:
+            kernel = kernel / kernel.sum()
+        if flip:
+            kernel = kernel[:, :, ::-1, ::-1]
+        self.register_buffer('kernel', kernel)
+        self.stride = stride
+    
+    def forward(self, x):
+        # expand kernel channels
+        kernel = self.kernel.to(x.dtype).expand(x.size(1), -1, -1, -1)
+        x = F.conv2d(
+            x,
+            kernel,
+            stride=self.stride,
+            padding=int((self.kernel.size(2)-1)/2),
+            groups=x.size(1)
+        )
+        return x
+
+
+# Folded resampling : nearest upscale + 3x3 conv is a stride 2 transposed conv by a 4x4 kernel (the
+# fused kernel, spatially flipped for the unfused way, which is why the two disagree) and the blur
+# after it folds into that kernel, giving a 6x6 one. resample2d runs it as a 3x3 conv to 4x the
+# channels (one slice per output phase) and a pixel_shuffle, so neither the upscaled input nor the
+# unblurred output is materialized. Folding the blur also picks up the one pixel ring around the
+# transposed conv output, which the separate blur sees as zero padding : the border rows and
+# columns are corrected from the matching input rows and columns. It does 2.25x the multiply-adds
+# of the fused kernel but wins where the activations are large (from 256x256 on CPU), below that
+# MyConv2d keeps the separate passes (see fold_min_size).
+
+def _foldable(blur):
+    return isinstance(blur, BlurLayer) and blur.stride == 1 and blur.kernel.shape[-2:] == (3, 3)
+
+
+def fold_resample(kernel, blur, bias=None):
+    """(weight, bias, edges) of resample2d for the stride 2, padding 1 transposed conv by kernel
+    [in, out, 4, 4] followed by the separable [1, 1, 3, 3] blur (padding 1), then bias"""
+    c_in, c_out = kernel.shape[:2]
+    blur = blur.to(kernel)
+    folded = F.conv2d(F.pad(kernel.reshape(c_in * c_out, 1, 4, 4), (2, 2, 2, 2)), blur).view(c_in, c_out, 6, 6)
+    taps = ([4, 2, 0], [5, 3, 1]) # folded kernel taps read by the 3x3 conv, for even and odd outputs
+    weight = torch.stack([folded[:, :, taps[i]][:, :, :, taps[j]].transpose(0, 1) for i in (0, 1) for j in (0, 1)], 1)
+    weight = weight.reshape(c_out * 4, c_in, 3, 3) # channel o * 4 + phase, as pixel_shuffle reads it
+    if bias is not None:
+        bias = bias.repeat_interleave(4)
+    b = blur[0, 0].sum(0) # 1d factor of the blur
+    row, col = b.view(1, 1, 1, 3).repeat(c_out, 1, 1, 1), b.view(1, 1, 3, 1).repeat(c_out, 1, 1, 1)
+    edges = [(kernel[:, :, :1].contiguous(), row * b[0]), (kernel[:, :, 3:].contiguous(), row * b[2]),
+             (kernel[..., :1].contiguous(), col * b[0]), (kernel[..., 3:].contiguous(), col * b[2])]
+    return weight, bias, edges
+
+
+def resample2d(x, weight, bias, edges):
+    """upscale + conv + blur from the folded parameters of fold_resample"""
+    return resample_edges(x, F.pixel_shuffle(F.conv2d(x, weight, bias, padding=1), 2), edges)
+
+
+def resample_edges(x, y, edges):
+    """corrects in place the border of y, the folded conv + pixel_shuffle of x"""
+    (top, top_b), (bottom, bottom_b), (left, left_b), (right, right_b) = edges
+    groups = y.size(1)
+    # ring of the transposed conv output : rows -1 and 2h with the corners, then columns -1 and 2w
+    y[:, :, :1] -= F.conv2d(F.conv_transpose2d(x[:, :, :1], top, stride=(1, 2)), top_b, groups=groups)
+    y[:, :, -1:] -= F.conv2d(F.conv_transpose2d(x[:, :, -1:], bottom, stride=(1, 2)), bottom_b, groups=groups)
+    y[..., :1] -= F.conv2d(F.conv_transpose2d(x[..., :1], left, stride=(2, 1), padding=(1, 0)), left_b,
+                           padding=(1, 0), groups=groups)
+    y[..., -1:] -= F.conv2d(F.conv_transpose2d(x[..., -1:], right, stride=(2, 1), padding=(1, 0)), right_b,
+                            padding=(1, 0), groups=groups)
+    return y
+
+
+def polyphase_weight(w):
+    """the transposed kernel [in, out, 4, 4] of the fused upscale conv (stride 2, padding 1) as a
+    regular [4*out, in, 2, 2] kernel : with padding 1 its output channels (a, b) hold the output
+    pixels (2i+a, 2j+b), read at [a:a+H, b:b+W]. It does the same number of multiply-adds as the
+    transposed conv, and the regular conv has per channel quantization and in place variants."""
+    taps = ([3, 1], [2, 0]) # kernel taps of output phase 0 and 1, for input offsets -1..0 and 0..1
+    return torch.cat([w[:, :, taps[a]][:, :, :, taps[b]].transpose(0, 1) for a in (0, 1) for b in (0, 1)])
+
+
+def upscale2d(x, factor=2, gain=1):
+    assert x.dim() == 4
+    if gain != 1:
+        x = x * gain
+    if factor != 1 and _channels_last(x):
+        return F.interpolate(x, scale_factor=factor, mode='nearest') # same values, keeps the memory format
+    if factor != 1:
+        shape = x.shape
+        x = x.view(shape[0], shape[1], shape[2], 1, shape[3], 1).expand(-1, -1, -1, factor, -1, factor)
+        x = x.contiguous().view(shape[0], shape[1], factor * shape[2], factor * shape[3])
+    return x
+
+
+class Upscale2d(nn.Module):
+    def __init__(self, factor=2, gain=1):
+        super().__init__()
+        assert isinstance(factor, int) and factor >= 1
+        self.gain = gain
+        self.factor = factor
+    def forward(self, x):
+        return upscale2d(x, factor=self.factor, gain=self.gain)
+
+
+class G_mapping(nn.Sequential):
+    def __init__(self, nonlinearity='lrelu', use_wscale=True):
+        act, gain = {'relu': (torch.relu, np.sqrt(2)),
+                     'lrelu': (nn.LeakyReLU(negative_slope=0.2), np.sqrt(2))}[nonlinearity]
+        layers = [
+            ('pixel_norm', PixelNormLayer()),
+            ('dense0', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
+            ('dense0_act', act),
+            ('dense1', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
+            ('dense1_act', act),
+            ('dense2', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
+            ('dense2_act', act),
+            ('dense3', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
+            ('dense3_act', act),
+            ('dense4', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
+            ('dense4_act', act),
+            ('dense5', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
+            ('dense5_act', act),
+            ('dense6', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
+            ('dense6_act', act),
+            ('dense7', MyLinear(512, 512, gain=gain, lrmul=0.01, use_wscale=use_wscale)),
+            ('dense7_act', act)
+        ]
+        super().__init__(OrderedDict(layers))
+        self.dlatent_broadcast = 18
+        
+    def forward(self, x, dense=False):
+        x = super().forward(x)
+        if dense:
+            # Broadcast
+            return x.unsqueeze(1).expand(-1, self.dlatent_broadcast, -1)
+        return DLatents(x, num_layers=self.dlatent_broadcast)
+
+
+# G_mapping returns compact dlatents : one W per sample instead of 18 copies of it.
+# Per-layer differences (truncation, style mixing, ...) are stored as extra vectors,
+# each layer pointing to the vector it uses. .dense() gives the usual [batch, 18, 512] tensor.
+
+class DLatents:
+    """Compact per-layer dlatents.
+    vectors : [batch_size, n_vectors, dlatent_size], the distinct W of each sample (0 is the base W)
+    layer_index : for each of the num_layers layers, the index of the vector it uses"""
+    __array_ufunc__ = None # let numpy scalars defer to our operators
+
+    def __init__(self, vectors, layer_index=None, num_layers=18):
+        if vectors.dim() == 2:
+            vectors = vectors.unsqueeze(1)
+        if layer_index is None:
+            layer_index = (0,) * num_layers
+        self.vectors = vectors
+        self.layer_index = tuple(layer_index)
+
+    @classmethod
+    def from_dense(cls, x):
+        return cls(x, range(x.size(1)))
+
+    @classmethod
+    def cat(cls, items):
+        if all(d.layer_index == items[0].layer_index for d in items):
+            return cls(torch.cat([d.vectors for d in items]), items[0].layer_index)
+        return cls.from_dense(torch.cat([d.dense() for d in items]))
+
+    @property
+    def num_layers(self):
+        return len(self.layer_index)
+
+    @property
+    def shape(self):
+        return torch.Size([self.vectors.size(0), self.num_layers, self.vectors.size(2)])
+
+    @property
+    def device(self):
+        return self.vectors.device
+
+    @property
+    def dtype(self):
+        return self.vectors.dtype
+
+    def size(self, dim=None):
+        return self.shape if dim is None else self.shape[dim]
+
+    def dim(self):
+        return 3
+
+    def __repr__(self):
+        return 'DLatents(shape=%s, n_vectors=%d)' % (list(self.shape), self.vectors.size(1))
+
+    def dense(self):
+        if self.vectors.size(1) == 1:
+            return self.vectors.expand(-1, self.num_layers, -1)
+        return self.vectors[:, list(self.layer_index)]
+
+    def layer(self, i):
+        return self.vectors[:, self.layer_index[i]]
+
+    def __getitem__(self, key):
+        # supports the slicing done by the synthesis blocks : [:, i] and [:, i:j]
+        if not isinstance(key, tuple):
+            key = (key,)
+        vectors = self.vectors[key[0]]
+        if vectors.dim() != 3:
+            raise IndexError('DLatents can not drop the batch dimension')
+        if len(key) == 1:
+            return DLatents(vectors, self.layer_index)
+        if isinstance(key[1], slice):
+            return DLatents(vectors, self.layer_index[key[1]])[(slice(None),) + key[2:]]
+        return vectors[:, self.layer_index[key[1]]][(slice(None),) + key[2:]]
+
+    def apply(self, fn, *args, **kwargs):
+        """new DLatents with fn applied on the vectors (fn must work row-wise)"""
+        return DLatents(fn(self.vectors, *args, **kwargs), self.layer_index)
+
+    def to(self, *args, **kwargs):
+        return self.apply(torch.Tensor.to, *args, **kwargs)
+
+    def detach(self):
+        return self.apply(torch.Tensor.detach)
+
+    def cpu(self):
+        return self.apply(torch.Tensor.cpu)
+
+    def compacted(self):
+        """drops the vectors that no layer uses"""
+        used = sorted(set(self.layer_index))
+        if len(used) == self.vectors.size(1):
+            return self
+        remap = {k: i for i, k in enumerate(used)}
+        return DLatents(self.vectors[:, used], [remap[k] for k in self.layer_index])
+
+    def combine(self, other, fn):
+        """elementwise fn(self, other), evaluated once per distinct pair of vectors.
+        other : DLatents, a number, a 0-dim tensor or a [B or 1, 1 or num_layers, dlatent_size] tensor"""
+        if not isinstance(other, DLatents):
+            if not torch.is_tensor(other) or other.dim() == 0:
+                return self.apply(fn, other)
+            if other.dim() != 3 or other.size(1) not in (1, self.num_layers):
+                # a [B, 512] tensor would broadcast against the [B, n, 512] vectors, row i on vector i
+                raise ValueError('DLatents combine with a [B, 1 or %d, %d] tensor, not %s'
+                                 % (self.num_layers, self.vectors.size(2), list(other.shape)))
+            if other.size(1) == self.num_layers > 1:
+                return DLatents.from_dense(fn(self.dense(), other))
+            return self.apply(fn, other)
+        assert self.num_layers == other.num_layers
+        pairs = sorted(set(zip(self.layer_index, other.layer_index)))
+        slot = {p: i for i, p in enumerate(pairs)}
+        a = self.vectors[:, [i for i, _ in pairs]]
+        b = other.vectors[:, [j for _, j in pairs]]
+        return DLatents(fn(a, b), [slot[p] for p in zip(self.layer_index, other.layer_index)])
+
+    def mix(self, other, layers):
+        """style mixing : layers (an iterable, or a start layer) take their W from other"""
+        if isinstance(layers, int):
+            layers = range(layers, self.num_layers)
+        layers = set(layers)
+        n = self.vectors.size(1)
+        index = [n + j if i in layers else k
+                 for i, (k, j) in enumerate(zip(self.layer_index, other.layer_index))]
+        return DLatents(torch.cat([self.vectors, other.vectors.to(self.vectors)], dim=1), index).compacted()
+
+    def lerp(self, other, weight):
+        return self.combine(other, lambda a, b: torch.lerp(a, b, weight))
+
+    def __add__(self, other):
+        return self.combine(other, torch.add)
+
+    def __sub__(self, other):
+        return self.combine(other, torch.sub)
+
+    def __mul__(self, other):
+        return self.combine(other, torch.mul)
+
+    def __truediv__(self, other):
+        return self.combine(other, torch.true_divide)
+
+    def __rsub__(self, other):
+        return self.combine(other, lambda a, b: b - a)
+
+    def __neg__(self):
+        return self.apply(torch.neg)
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+
+
+class Truncation(nn.Module):
+    """avg_latent=None (not estimated yet) or threshold=1 leave the dlatents untouched.
+    threshold and max_layer can be overridden per call, threshold per sample with a [batch_size] tensor."""
+    def __init__(self, avg_latent, max_layer=8, threshold=0.7):
+        super().__init__()
+        self.max_layer = max_layer
+        self.threshold = threshold
+        self.register_buffer('avg_latent', avg_latent)
+    def forward(self, x, threshold=None, max_layer=None):
+        threshold = self.threshold if threshold is None else threshold
+        max_layer = self.max_layer if max_layer is None else max_layer
+        if self.avg_latent is None or (not torch.is_tensor(threshold) and threshold == 1) or max_layer <= 0:
+            return x
+        if torch.is_tensor(threshold):
+            threshold = threshold.to(self.avg_latent).view(-1, 1, 1)
+        if isinstance(x, DLatents):
+            if self.avg_latent.dim() == 1:
+                # truncate each distinct W once, not the 18 copies
+                interp = x.apply(lambda v: torch.lerp(self.avg_latent, v, threshold))
+                return x.mix(interp, range(min(max_layer, x.num_layers)))
+            return DLatents.from_dense(self(x.dense(), threshold, max_layer))
+        assert x.dim() == 3
+        interp = torch.lerp(self.avg_latent, x, threshold)
+        do_trunc = (torch.arange(x.size(1), device=x.device) < max_layer).view(1, -1, 1)
+        return torch.where(do_trunc, interp, x)
+
+
+class LayerEpilogue(nn.Module):
+    """Things to do at the end of each layer."""
+    fused = False # see G_synthesis.set_fused_epilogue
+    def __init__(self, channels, dlatent_size, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer):
+        super().__init__()
+        layers = []
+        if use_noise:
+            layers.append(('noise', NoiseLayer(channels)))
+        layers.append(('activation', activation_layer))
+        if use_pixel_norm:
+            layers.append(('pixel_norm', PixelNormLayer()))
+        if use_instance_norm:
+            layers.append(('instance_norm', InstanceNorm2d(channels)))
+        self.top_epi = nn.Sequential(OrderedDict(layers))
+        if use_styles:
+            self.style_mod = StyleMod(dlatent_size, channels, use_wscale=use_wscale)
+        else:
+            self.style_mod = None
+    def forward(self, x, dlatents_in_slice=None, style=None):
+        if self.fused and self.fusable():
+            return self.fused_forward(x, dlatents_in_slice, style)
+        x = self.top_epi(x)
+        if self.style_mod is not None:
+            x = self.style_mod(x, dlatents_in_slice, style)
+        else:
+            assert dlatents_in_slice is None
+        return x
+
+    def fusable(self):
+        """[noise,] leaky relu, instance norm without affine : the layers fused_forward implements"""
+        layers = [m for m in self.top_epi.children() if not isinstance(m, NoiseLayer)]
+        return (len(layers) == 2 and isinstance(layers[0], nn.LeakyReLU) and isinstance(layers[1], nn.InstanceNorm2d)
+                and not layers[1].affine)
+
+    def fused_forward(self, x, dlatents_in_slice=None, style=None):
+        """same as forward, with the instance norm statistics computed in one read of x and the
+        normalization and style modulation folded into one per-channel multiply-add. With autograd
+        off, x is overwritten : every pass over it is done in place."""
+        inplace = not torch.is_grad_enabled()
+        layers = self.top_epi._modules
+        if 'noise' in layers:
+            noise = layers['noise'].get_noise(x)
+            if noise is not None:
+                weight = layers['noise'].weight.view(1, -1, 1, 1).to(x.dtype)
+                x = x.addcmul_(weight, noise) if inplace else torch.addcmul(x, weight, noise)
+        x = F.leaky_relu(x, layers['activation'].negative_slope, inplace=inplace)
+
+        var, mean = torch.var_mean(x.float() if x.dtype in REDUCED_DTYPES else x, dim=(2, 3), keepdim=True,
+                                   correction=0)
+        scale = torch.rsqrt(var + layers['instance_norm'].eps)
+        if self.style_mod is not None:
+            if style is None:
+                style = self.style_mod.lin(dlatents_in_slice)
+            style = style.view(-1, 2, x.size(1), 1, 1).to(scale.dtype)
+            scale, shift = scale * (style[:, 0] + 1), style[:, 1]
+        else:
+            assert dlatents_in_slice is None
+            shift = torch.zeros_like(scale)
+        # (x - mean) * scale + shift, not x * scale + (shift - mean * scale) which cancels on flat channels
+        mean, scale, shift = mean.to(x.dtype), scale.to(x.dtype), shift.to(x.dtype)
+        if inplace:
+            return torch.addcmul(shift, x.sub_(mean), scale, out=x)
+        return torch.addcmul(shift, x - mean, scale)
+
+
+class InputBlock(nn.Module):
+    def __init__(self, nf, dlatent_size, const_input_layer, gain, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer):
+        super().__init__()
+        self.const_input_layer = const_input_layer
+        self.nf = nf
+        if self.const_input_layer:
+            # called 'const' in tf
+            self.const = nn.Parameter(torch.ones(1, nf, 4, 4))
+            self.bias = nn.Parameter(torch.ones(nf))
+        else:
+            self.dense = MyLinear(dlatent_size, nf*16, gain=gain/4, use_wscale=use_wscale) # tweak gain to match the official implementation of Progressing GAN
+        self.epi1 = LayerEpilogue(nf, dlatent_size, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer)
+        self.conv = MyConv2d(nf, nf, 3, gain=gain, use_wscale=use_wscale)
+        self.epi2 = LayerEpilogue(nf, dlatent_size, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer)
+        
+    def forward(self, dlatents_in_range, styles=(None, None)):
+        batch_size = dlatents_in_range.size(0)
+        if self.const_input_layer:
+            x = self.const.expand(batch_size, -1, -1, -1)
+            x = x + self.bias.view(1, -1, 1, 1)
+        else:
+            x = self.dense(dlatents_in_range[:, 0]).view(batch_size, self.nf, 4, 4)
+        x = self.epi1(x, dlatents_in_range[:, 0], styles[0])
+        x = self.conv(x)
+        x = self.epi2(x, dlatents_in_range[:, 1], styles[1])
+        return x
+
+
+class GSynthesisBlock(nn.Module):
+    def __init__(self, in_channels, out_channels, blur_filter, dlatent_size, gain, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer):
+        # 2**res x 2**res # res = 3..resolution_log2
+        super().__init__()
+        if blur_filter:
+            blur = BlurLayer(blur_filter)
+        else:
+            blur = None
+        self.conv0_up = MyConv2d(in_channels, out_channels, kernel_size=3, gain=gain, use_wscale=use_wscale,
+                                 intermediate=blur, upscale=True)
+        self.epi1 = LayerEpilogue(out_channels, dlatent_size, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer)
+        self.conv1 = MyConv2d(out_channels, out_channels, kernel_size=3, gain=gain, use_wscale=use_wscale)
+        self.epi2 = LayerEpilogue(out_channels, dlatent_size, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, activation_layer)
+            
+    def forward(self, x, dlatents_in_range, styles=(None, None)):
+        x = self.conv0_up(x)
+        x = self.epi1(x, dlatents_in_range[:, 0], styles[0])
+        x = self.conv1(x)
+        x = self.epi2(x, dlatents_in_range[:, 1], styles[1])
+        return x
+
+
+class G_synthesis(nn.Module):
+    def __init__(self,
+        dlatent_size        = 512,          # Disentangled latent (W) dimensionality.
+        num_channels        = 3,            # Number of output color channels.
+        resolution          = 1024,         # Output resolution.
+        fmap_base           = 8192,         # Overall multiplier for the number of feature maps.
+        fmap_decay          = 1.0,          # log2 feature map reduction when doubling the resolution.
+        fmap_max            = 512,          # Maximum number of feature maps in any layer.
+        use_styles          = True,         # Enable style inputs?
+        const_input_layer   = True,         # First layer is a learned constant?
+        use_noise           = True,         # Enable noise inputs?
+        randomize_noise     = True,         # True = randomize noise inputs every time (non-deterministic), False = read noise inputs from variables.
+        nonlinearity        = 'lrelu',      # Activation function: 'relu', 'lrelu'
+        use_wscale          = True,         # Enable equalized learning rate?
+        use_pixel_norm      = False,        # Enable pixelwise feature vector normalization?
+        use_instance_norm   = True,         # Enable instance normalization?
+        dtype               = torch.float32,  # Data type to use for activations and outputs.
+        blur_filter         = [1,2,1],      # Low-pass filter to apply when resampling activations. None = no filtering.
+        ):
+        
+        super().__init__()
+        def nf(stage):
+            return min(int(fmap_base / (2.0 ** (stage * fmap_decay))), fmap_max)
+        self.dlatent_size = dlatent_size
+        resolution_log2 = int(np.log2(resolution))
+        assert resolution == 2**resolution_log2 and resolution >= 4
+
+        act, gain = {'relu': (torch.relu, np.sqrt(2)),
+                     'lrelu': (nn.LeakyReLU(negative_slope=0.2), np.sqrt(2))}[nonlinearity]
+        num_layers = resolution_log2 * 2 - 2
+        num_styles = num_layers if use_styles else 1
+        torgbs = []
+        blocks = []
+        for res in range(2, resolution_log2 + 1):
+            channels = nf(res-1)
+            name = '{s}x{s}'.format(s=2**res)
+            if res == 2:
+                blocks.append((name,
+                               InputBlock(channels, dlatent_size, const_input_layer, gain, use_wscale,
+                                      use_noise, use_pixel_norm, use_instance_norm, use_styles, act)))
+                
+            else:
+                blocks.append((name,
+                               GSynthesisBlock(last_channels, channels, blur_filter, dlatent_size, gain, use_wscale, use_noise, use_pixel_norm, use_instance_norm, use_styles, act)))
+            last_channels = channels
+        self.torgb = MyConv2d(channels, num_channels, 1, gain=1, use_wscale=use_wscale)
+        self.blocks = nn.ModuleDict(OrderedDict(blocks))
+        self.num_layers = num_layers
+        self.dtype = dtype
+        self.channels_last = False
+        self._style_table = None
+        self.tile_size = None
+        self.tile_min_resolution = None
+        self.static = False
+        self._arenas = {}
+
+    def set_tiling(self, tile_size=256, min_resolution=512):
+        """blocks of min_resolution and above run tile by tile (tile_size=None : untiled).
+        Output is the same as untiled, within float rounding : tiles carry the conv + blur halo
+        and InstanceNorm statistics come from a pre-pass over the whole map."""
+        self.tile_size = tile_size
+        self.tile_min_resolution = min_resolution
+        return self
+
+    def set_precision(self, dtype=torch.bfloat16, channels_last=True):
+        """activations of the blocks after 4x4 in dtype (and channels_last memory format).
+        Weights are cast on the fly (once when frozen); InstanceNorm statistics, PixelNorm and
+        torgb stay in float32 and the output is a float32 NCHW image whatever the mode."""
+        self.dtype = dtype
+        self.channels_last = channels_last
+        return self
+
+    def set_fused_epilogue(self, mode=True):
+        """run the layer epilogues as LayerEpilogue.fused_forward (those it can implement)"""
+        for block in self.blocks.values():
+            block.epi1.fused = block.epi2.fused = mode
+        return self
+
+    def set_static(self, mode=True):
+        """static shape execution (see arena.py) : without autograd, each (batch size, dtype, device)
+        runs in buffers planned on first use and reused by the next calls, which return a view of them"""
+        if mode:
+            for block in self.blocks.values():
+                if not (block.epi1.fusable() and block.epi2.fusable()):
+                    raise NotImplementedError('static execution needs the [noise,] lrelu, instance norm epilogue')
+        self.static = mode
+        self._arenas = {}
+        return self
+
+    def arena(self, batch_size, device):
+        """the Arena of (batch_size, device) in the current precision, planned again when a parameter changes"""
+        from .arena import Arena
+        key = (batch_size, self.dtype, torch.device(device))
+        arena = self._arenas.get(key)
+        if arena is None or arena.key != _params_key(*self.parameters()):
+            self._arenas[key] = arena = None # frees the previous buffers first
+            self._arenas[key] = arena = Arena(self, batch_size, device)
+        return arena
+
+    def style_mods(self):
+        """the StyleMod of every layer, in the order they consume dlatents"""
+        mods = []
+        for m in self.blocks.values():
+            mods += [m.epi1.style_mod, m.epi2.style_mod]
+        return mods
+
+    def style_table(self):
+        """all the StyleMod affines stacked in one [sum(2*channels), dlatent_size] matrix.
+        cached as long as the StyleMod layers are frozen and unchanged."""
+        lins = [sm.lin for sm in self.style_mods()]
+        frozen = all(lin.frozen for lin in lins)
+        key = _params_key(*[p for lin in lins for p in (lin.weight, lin.bias)])
+        if frozen and self._style_table is not None and self._style_table['key'] == key:
+            return self._style_table
+        with torch.set_grad_enabled(torch.is_grad_enabled() and not frozen):
+            params = [lin.scaled_params() for lin in lins]
+            weight = torch.cat([w for w, _ in params])
+            bias = torch.cat([b for _, b in params])
+        bounds = np.cumsum([0] + [w.size(0) for w, _ in params])
+        table = {'key': key, 'weight': weight, 'bias': bias, 'bounds': list(zip(bounds[:-1], bounds[1:])), 'groups': None}
+        self._style_table = table if frozen else None
+        return table
+
+    def _style_groups(self, table):
+        # layers of the same width, with their weights stacked for one bmm (dense dlatents only)
+        if table['groups'] is None:
+            widths = OrderedDict()
+            for i, (b0, b1) in enumerate(table['bounds']):
+                widths.setdefault(b1 - b0, []).append(i)
+            table['groups'] = [(layers,
+                                torch.stack([table['weight'][slice(*table['bounds'][i])].t() for i in layers]),
+                                torch.stack([table['bias'][slice(*table['bounds'][i])] for i in layers]).unsqueeze(1))
+                               for layers in widths.values()]
+        return table['groups']
+
+    def styles(self, dlatents_in):
+        """style precompute : the [batch_size, 2*channels] StyleMod output of every layer.
+        With DLatents this is a single GEMM over the distinct W vectors; the result can
+        be kept and passed back to forward() to render the same latents again."""
+        if self.blocks['4x4'].epi1.style_mod is None:
+            return [None] * self.num_layers
+        table = self.style_table()
+        if isinstance(dlatents_in, DLatents):
+            out = torch.addmm(table['bias'], dlatents_in.vectors.flatten(0, 1), table['weight'].t())
+            out = out.view(dlatents_in.vectors.size(0), dlatents_in.vectors.size(1), -1)
+            return [out[:, k, b0:b1] for k, (b0, b1) in zip(dlatents_in.layer_index, table['bounds'])]
+        styles = [None] * self.num_layers
+        for layers, weight, bias in self._style_groups(table):
+            out = torch.baddbmm(bias, dlatents_in[:, layers].transpose(0, 1), weight)
+            for j, i in enumerate(layers):
+                styles[i] = out[j]
+        return styles
+        
+    def _run_blocks(self, dlatents_in, styles, x=None, start=0, stop=None, crop=None):
+        """(x after the blocks start..stop-1, False) from x the output of block start-1,
+        (image, True) when the last block is tiled (it runs torgb and crop itself)"""
+        blocks = list(self.blocks.values())
+        stop = len(blocks) if stop is None else stop
+        for i in range(start, stop):
+            m = blocks[i]
+            if i == 0:
+                x = m(dlatents_in[:, 2*i:2*i+2], styles[2*i:2*i+2])
+                x = x.to(self.dtype, memory_format=torch.channels_last if self.channels_last else torch.preserve_format)
+            elif self.tile_size is not None and 2**(i+2) >= self.tile_min_resolution:
+                last = i == len(blocks) - 1
+                x = _tiled_block(m, x, styles[2*i:2*i+2], self.tile_size, self.torgb if last else None, crop)
+                if last:
+                    return x, True
+            else:
+                x = m(x, dlatents_in[:, 2*i:2*i+2], styles[2*i:2*i+2])
+        return x, False
+
+    def prefix(self, dlatents_in, k, styles=None):
+        """output of the first k blocks (k >= 1), which only depends on the layers below 2 * k :
+        forward(dlatents, resume=(k, prefix)) renders any dlatents sharing them (see prefix.py)"""
+        if styles is None:
+            styles = self.styles(dlatents_in)
+        return self._run_blocks(dlatents_in, styles, stop=k)[0]
+
+    def forward(self, dlatents_in, styles=None, crop=None, resume=None):
+        # Input: Disentangled latents (W) [minibatch, num_layers, dlatent_size], dense or DLatents.
+        # styles: optional output of self.styles(dlatents_in), computed here otherwise.
+        # crop: optional (y0, y1, x0, x1) box of the output to render.
+        # resume: optional (k, x), x = self.prefix(dlatents, k) : only the blocks from k on run.
+        # lod_in = tf.cast(tf.get_variable('lod', initializer=np.float32(0), trainable=False), dtype)
+        batch_size = dlatents_in.size(0)       
+        if styles is None:
+            styles = self.styles(dlatents_in)
+        if self.static and not torch.is_grad_enabled() and crop is None and self.tile_size is None and resume is None:
+            return self.arena(batch_size, dlatents_in.device)(styles)
+        start, x = (0, None) if resume is None else resume
+        x, done = self._run_blocks(dlatents_in, styles, x, start, crop=crop)
+        if done:
+            return x
+        if x.dtype in REDUCED_DTYPES:
+            x = x.float()
+        rgb = self.torgb(x)
+        if crop is not None:
+            rgb = rgb[:, :, crop[0]:crop[1], crop[2]:crop[3]]
+        return rgb.contiguous()
+
+
+# Tiled execution : a box is (y0, y1, x0, x1). Each function computes its output over a box
+# from an input that holds (at least) the in-image part of the needed halo, and pads with zeros
+# exactly where the untiled layer would.
+
+def _grow(box, n):
+    return (box[0] - n, box[1] + n, box[2] - n, box[3] + n)
+
+
+def _clip(box, size):
+    return (max(box[0], 0), min(box[1], size[0]), max(box[2], 0), min(box[3], size[1]))
+
+
+def _take(x, xbox, box, size):
+    """box of the map of the given size, x holding xbox of it, zero outside the map"""
+    c = _clip(box, size)
+    assert xbox[0] <= c[0] and c[1] <= xbox[1] and xbox[2] <= c[2] and c[3] <= xbox[3]
+    x = x[:, :, c[0]-xbox[0]:c[1]-xbox[0], c[2]-xbox[2]:c[3]-xbox[2]]
+    pad = (c[2] - box[2], box[3] - c[3], c[0] - box[0], box[1] - c[1])
+    return F.pad(x, pad) if any(pad) else x
+
+
+def _conv_region(conv, x, xbox, box, in_size):
+    """MyConv2d output over box, x holding xbox of its input map of size in_size"""
+    out_size = (2 * in_size[0], 2 * in_size[1]) if conv.upscale is not None else in_size
+    fused = conv.upscale is not None and min(in_size) * 2 >= conv.fuse_min_size # same choice as MyConv2d.forward
+    weight, bias = conv.scaled_params(fused, x.dtype, _channels_last(x))
+    halo = 0 if conv.intermediate is None else (conv.intermediate.kernel.size(-1) - 1) // 2
+    cbox = _clip(_grow(box, halo), out_size)
+    if fused:
+        ibox = ((cbox[0] - 1) // 2, cbox[1] // 2 + 1, (cbox[2] - 1) // 2, cbox[3] // 2 + 1)
+        y = F.conv_transpose2d(_take(x, xbox, ibox, in_size), weight, stride=2)
+        oy, ox = 2 * ibox[0] - 1, 2 * ibox[2] - 1 # output coords of y[0, 0]
+        y = y[:, :, cbox[0]-oy:cbox[1]-oy, cbox[2]-ox:cbox[3]-ox]
+    else:
+        pbox = _grow(cbox, conv.kernel_size // 2)
+        if conv.upscale is not None:
+            u = _clip(pbox, out_size)
+            ibox = (u[0] // 2, (u[1] + 1) // 2, u[2] // 2, (u[3] + 1) // 2)
+            xi = conv.upscale(_take(x, xbox, ibox, in_size))
+            xi = xi[:, :, u[0]-2*ibox[0]:u[1]-2*ibox[0], u[2]-2*ibox[2]:u[3]-2*ibox[2]]
+            xi = _take(xi, u, pbox, out_size)
+        else:
+            xi = _take(x, xbox, pbox, in_size)
+        y = F.conv2d(xi, weight, bias if conv.intermediate is None else None)
+    if conv.intermediate is None:
+        return y
+    blur = conv.intermediate
+    y = F.conv2d(_take(y, cbox, _grow(box, halo), out_size), blur.kernel.to(y.dtype).expand(y.size(1), -1, -1, -1),
+                 stride=blur.stride, groups=y.size(1))
+    if bias is not None:
+        y = y + bias.view(1, -1, 1, 1)
+    return y
+
+
+def _epi_region(epi, x, box, noise, style, stats=None):
+    """LayerEpilogue over box. stats=None stops right before the instance norm"""
+    for m in epi.top_epi.children():
+        if isinstance(m, NoiseLayer):
+            if noise is not None:
+                x = x + m.weight.view(1, -1, 1, 1).to(x.dtype) * noise[:, :, box[0]:box[1], box[2]:box[3]]
+        elif isinstance(m, nn.InstanceNorm2d):
+            if stats is None:
+                return x
+            mean, var = stats
+            dtype, x = x.dtype, x.to(mean.dtype)
+            x = (x - mean) * torch.rsqrt(var + m.eps)
+            if m.affine:
+                x = x * m.weight.view(1, -1, 1, 1) + m.bias.view(1, -1, 1, 1)
+            x = x.to(dtype)
+        else:
+            x = m(x)
+    if epi.style_mod is not None:
+        x = epi.style_mod(x, None, style)
+    return x
+
+
+def _instance_stats(epi, tiles, region):
+    """per-(sample, channel) mean and variance of the instance norm input, accumulated over tiles"""
+    if not any(isinstance(m, nn.InstanceNorm2d) for m in epi.top_epi.children()):
+        return ()
+    s1 = s2 = n = 0
+    for box in tiles:
+        y = region(box)
+        dtype, y = y.dtype, y.double()
+        s1 = s1 + y.sum((2, 3), keepdim=True)
+        s2 = s2 + (y * y).sum((2, 3), keepdim=True)
+        n += y.size(2) * y.size(3)
+    mean = s1 / n
+    dtype = torch.promote_types(dtype, torch.float32) # float32 statistics for reduced precision
+    return mean.to(dtype), (s2 / n - mean * mean).clamp(min=0).to(dtype)
+
+
+def _tiled_block(block, x, styles, tile_size, torgb=None, crop=None):
+    """GSynthesisBlock (followed by torgb if given) over tiles of its output.
+    x, the block input, is whole; the output is whole too, or only crop when torgb is given."""
+    in_size = tuple(x.shape[2:])
+    size = (2 * in_size[0], 2 * in_size[1])
+    whole = (0, in_size[0], 0, in_size[1])
+    ref = x.new_empty((x.size(0), 0) + size) # shape reference for the noise layers
+    noises = [epi.top_epi.noise.get_noise(ref) if hasattr(epi.top_epi, 'noise') else None
+              for epi in (block.epi1, block.epi2)]
+    tiles = [(y0, min(y0 + tile_size, size[0]), x0, min(x0 + tile_size, size[1]))
+             for y0 in range(0, size[0], tile_size) for x0 in range(0, size[1], tile_size)]
+
+    def epi1_region(box, stats):
+        y = _conv_region(block.conv0_up, x, whole, box, in_size)
+        return _epi_region(block.epi1, y, box, noises[0], styles[0], stats)
+
+    def epi2_region(box, stats1, stats2):
+        ebox = _clip(_grow(box, block.conv1.kernel_size // 2), size)
+        y = _conv_region(block.conv1, epi1_region(ebox, stats1), ebox, box, size)
+        return _epi_region(block.epi2, y, box, noises[1], styles[1], stats2)
+
+    stats1 = _instance_stats(block.epi1, tiles, lambda box: epi1_region(box, None))
+    stats2 = _instance_stats(block.epi2, tiles, lambda box: epi2_region(box, stats1, None))
+    if torgb is None:
+        out = torch.empty((x.size(0), block.conv1.weight.size(0)) + size, dtype=x.dtype, device=x.device,
+                          memory_format=torch.channels_last if _channels_last(x) else torch.contiguous_format)
+        for box in tiles:
+            out[:, :, box[0]:box[1], box[2]:box[3]] = epi2_region(box, stats1, stats2)
+        return out
+    crop = crop or (0, size[0], 0, size[1])
+    out = x.new_empty((x.size(0), torgb.weight.size(0), crop[1] - crop[0], crop[3] - crop[2]),
+                      dtype=torch.promote_types(x.dtype, torch.float32))
+    for box in tiles:
+        box = (max(box[0], crop[0]), min(box[1], crop[1]), max(box[2], crop[2]), min(box[3], crop[3]))
+        if box[0] >= box[1] or box[2] >= box[3]:
+            continue
+        y = epi2_region(box, stats1, stats2)
+        rgb = _conv_region(torgb, y.float() if y.dtype in REDUCED_DTYPES else y, box, box, size)
+        out[:, :, box[0]-crop[0]:box[1]-crop[0], box[2]-crop[2]:box[3]-crop[2]] = rgb
+    return out
+
+
+class G_style(nn.Sequential):
+    """g_mapping -> truncation -> g_synthesis. g_all[0] and g_all[1] are still the mapping and
+    synthesis networks. Truncation is opt-in : g_all(z, psi=0.7) (or truncation_psi), once its
+    avg_latent is set (see avg_latent.py)."""
+    def __init__(self, g_mapping, g_synthesis, truncation_max_layer=8, truncation_psi=1):
+        super().__init__(OrderedDict([
+            ('g_mapping', g_mapping),
+            ('g_synthesis', g_synthesis),
+        ]))
+        self.truncation = Truncation(None, truncation_max_layer, truncation_psi)
+
+    def forward(self, latents, psi=None, max_layer=None, **kwargs):
+        # kwargs go to g_synthesis (styles, crop)
+        w = self.truncation(self.g_mapping(latents), psi, max_layer)
+        return self.g_synthesis(w, **kwargs)
+
+
+def freeze(model, mode=True):
+    """puts every MyLinear / MyConv2d of model in (or out of) frozen inference mode.
+    Scaled weights are then computed on first use and reused until a parameter changes."""
+    for m in model.modules():
+        if isinstance(m, (MyLinear, MyConv2d)):
+            m.freeze(mode)
+    return model
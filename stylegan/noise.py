@@ -0,0 +1,93 @@
+"""Seed-addressable noise for the NoiseLayers.
+
+Instead of fresh torch.randn at every call, noise planes are addressed by (seed, layer) : each is
+drawn on the device by torch.randn from a generator seeded with the two mixed (plane_seed). The
+noise of a sample then only depends on its own seed, not on the batch it is rendered in (nor on
+the memo). The CPU and CUDA generators differ : planes are reproducible per device type.
+- 'seeded' : per-sample planes from (seed of the sample, layer), optionally memoized
+- 'cached' : one plane per layer from the bank seed, computed once and shared by the whole batch
+- 'const' : user supplied planes (e.g. the noise variables of the official model), no noise if none
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+from .networks import NoiseLayer
+
+
+RNG = 'torch.Generator/splitmix64' # how planes are drawn from (seed, layer) : part of dataset / cache keys
+
+
+def _splitmix64(x):
+    x = (x + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return x ^ (x >> 31)
+
+
+def plane_seed(seed, layer):
+    """generator seed of the (seed, layer) plane : the two mixed, so that nearby seeds and layers
+    start unrelated streams"""
+    return _splitmix64(_splitmix64(seed & 0xFFFFFFFFFFFFFFFF) ^ layer) >> 1 # manual_seed takes 63 bits
+
+
+class NoiseBank:
+    """Seed-addressable noise for the NoiseLayers of a model (see attach)."""
+    def __init__(self, mode='seeded', seed=0, cache_size=0, planes=None):
+        assert mode in ('seeded', 'cached', 'const')
+        self.mode = mode
+        self.seed = seed
+        self.cache_size = cache_size # max number of memoized per-sample planes, 'seeded' mode
+        self.planes = planes # 'const' mode : one [H, W] (or [1, 1, H, W]) tensor per noise layer
+        self.seeds = None # per-sample seeds of the batch being rendered, 'seeded' mode
+        self._cache = OrderedDict()
+
+    def attach(self, model):
+        """routes every NoiseLayer of model to this bank, numbered in forward order"""
+        for i, m in enumerate(m for m in model.modules() if isinstance(m, NoiseLayer)):
+            m.noise_bank, m.noise_index = self, i
+        return self
+
+    @staticmethod
+    def detach(model):
+        for m in model.modules():
+            if isinstance(m, NoiseLayer):
+                m.noise_bank = m.noise_index = None
+
+    @contextmanager
+    def use(self, seeds):
+        """renders inside the block use one noise seed per sample"""
+        previous, self.seeds = self.seeds, [int(s) for s in seeds]
+        try:
+            yield self
+        finally:
+            self.seeds = previous
+
+    def plane(self, seed, layer, height, width, device='cpu', dtype=torch.float32):
+        key = (seed, layer, height, width, str(device), dtype)
+        plane = self._cache.get(key)
+        if plane is None:
+            generator = torch.Generator(device=device).manual_seed(plane_seed(seed, layer))
+            plane = torch.randn((height, width), generator=generator, device=device).to(dtype)
+            if self.mode == 'cached' or self.cache_size > 0:
+                self._cache[key] = plane
+                if self.mode == 'seeded' and len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        return plane
+
+    def noise(self, layer, x):
+        """noise for the layer-th NoiseLayer, broadcastable to x [B, C, H, W]"""
+        height, width = x.shape[2:]
+        if self.mode == 'const':
+            if self.planes is None:
+                return None
+            return self.planes[layer].to(device=x.device, dtype=x.dtype).view(1, 1, height, width)
+        if self.mode == 'cached':
+            return self.plane(self.seed, layer, height, width, x.device, x.dtype).view(1, 1, height, width)
+        if self.seeds is None or len(self.seeds) != x.size(0):
+            raise ValueError("NoiseBank('seeded') needs one seed per sample, use `with bank.use(seeds):`")
+        planes = [self.plane(s, layer, height, width, x.device, x.dtype) for s in self.seeds]
+        return torch.stack(planes).unsqueeze(1)
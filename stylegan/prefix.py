@@ -0,0 +1,138 @@
+"""Activation prefix cache : resume G_synthesis after the blocks whose dlatents did not change.
+
+Block i of G_synthesis uses the layers 2i and 2i+1, so when only the layers from `layer` on
+change (style mixing, fine attribute edits), the output of the first layer // 2 blocks is the same
+and synthesis can resume from there (G_synthesis.prefix / forward(resume=...)). PrefixCache keeps
+these outputs per sample, keyed by (coarse dlatents, noise seed, k) with k the number of blocks,
+in LRU order under a byte budget. Noise comes from a NoiseBank('seeded') with the given per-sample
+noise seeds, so the cached prefixes are those the full forward would compute.
+
+style_mixing_grid renders the M x N grid of coarse x fine styles as one batch of compact DLatents,
+the prefix of each of the M coarse rows being computed (or found in the cache) once, not N times.
+"""
+import hashlib
+from collections import OrderedDict
+
+import torch
+
+from .networks import DLatents, _params_key
+from .noise import NoiseBank
+
+
+def _dense(dlatents):
+    return dlatents.dense() if isinstance(dlatents, DLatents) else dlatents
+
+
+class PrefixCache:
+    def __init__(self, g_synthesis, max_bytes=1 << 30):
+        self.g_synthesis = g_synthesis
+        self.max_bytes = max_bytes
+        self.noise_bank = NoiseBank('seeded')
+        self.nbytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._entries = OrderedDict()
+        self._model_key = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def _keys(self, dlatents, noise_seeds, k):
+        coarse = _dense(dlatents)[:, :2 * k].detach().float().cpu().contiguous()
+        return [(hashlib.sha1(c.numpy().tobytes()).hexdigest(), int(seed), k) for c, seed in zip(coarse, noise_seeds)]
+
+    def _check_model(self):
+        # prefixes depend on the weights and on the precision mode
+        key = (_params_key(*self.g_synthesis.parameters()), self.g_synthesis.dtype, self.g_synthesis.channels_last)
+        if key != self._model_key:
+            self.clear()
+            self._model_key = key
+
+    def _put(self, key, x):
+        size = x.numel() * x.element_size()
+        if size > self.max_bytes:
+            return
+        self._entries[key] = x
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, old = self._entries.popitem(last=False)
+            self.nbytes -= old.numel() * old.element_size()
+            self.stats['evictions'] += 1
+
+    def prefix(self, dlatents, k, noise_seeds, styles=None):
+        """output of the first k blocks for each sample, from the cache or computed (and cached)"""
+        self._check_model()
+        keys = self._keys(dlatents, noise_seeds, k)
+        missing = [i for i, key in enumerate(keys) if key not in self._entries]
+        self.stats['hits'] += len(keys) - len(missing)
+        self.stats['misses'] += len(missing)
+        if missing:
+            if styles is None:
+                styles = self.g_synthesis.styles(dlatents)
+            sub = torch.tensor(missing, device=_dense(dlatents).device)
+            sub_styles = [None if s is None else s[sub] for s in styles]
+            self.noise_bank.attach(self.g_synthesis)
+            try:
+                with torch.no_grad(), self.noise_bank.use([noise_seeds[i] for i in missing]):
+                    x = self.g_synthesis.prefix(dlatents[sub], k, sub_styles)
+            finally:
+                NoiseBank.detach(self.g_synthesis)
+            computed = {keys[i]: x[j] for j, i in enumerate(missing)}
+        else:
+            computed = {}
+        out = []
+        for key in keys:
+            if key in computed:
+                out.append(computed[key])
+            else:
+                self._entries.move_to_end(key)
+                out.append(self._entries[key])
+        for key, x in computed.items():
+            if key not in self._entries:
+                self._put(key, x.clone())
+        return torch.stack(out)
+
+    def render(self, dlatents, layer, noise_seeds, styles=None):
+        """images of dlatents [B, num_layers, 512] (dense or DLatents) whose layers below `layer` are
+        those of cached prefixes, noise from the per-sample noise seeds"""
+        k = layer // 2
+        with torch.no_grad():
+            styles = self.g_synthesis.styles(dlatents) if styles is None else styles
+            x = self.prefix(dlatents, k, noise_seeds, styles) if k else None
+        self.noise_bank.attach(self.g_synthesis)
+        try:
+            with torch.no_grad(), self.noise_bank.use(noise_seeds):
+                return self.g_synthesis(dlatents, styles, resume=None if x is None else (k, x))
+        finally:
+            NoiseBank.detach(self.g_synthesis)
+
+
+def style_mixing_grid(g_synthesis, coarse, fine, layer, noise_seeds=None, cache=None):
+    """[M, N, C, H, W] images : row i takes the layers below `layer` from coarse[i] ([M, 512] W vectors)
+    and column j the others from fine[j] ([N, 512]). noise_seeds : one per row (default 0).
+    Each coarse prefix is computed once per row (and reused across calls with a PrefixCache)."""
+    m, n = coarse.size(0), fine.size(0)
+    num_layers = g_synthesis.num_layers
+    noise_seeds = [0] * m if noise_seeds is None else [int(s) for s in noise_seeds]
+    cache = cache if cache is not None else PrefixCache(g_synthesis, max_bytes=0)
+    # vector 0 : coarse W of the row, vector 1 : fine W of the column
+    vectors = torch.stack([coarse.repeat_interleave(n, 0), fine.repeat(m, 1)], 1)
+    mixed = DLatents(vectors, [0 if i < layer else 1 for i in range(num_layers)])
+    k = layer // 2
+    with torch.no_grad():
+        styles = g_synthesis.styles(mixed)
+        if k == 0:
+            x = None
+        else:
+            rows = DLatents(coarse.unsqueeze(1), num_layers=num_layers)
+            x = cache.prefix(rows, k, noise_seeds).repeat_interleave(n, 0)
+        cache.noise_bank.attach(g_synthesis)
+        try:
+            with cache.noise_bank.use([s for s in noise_seeds for _ in range(n)]):
+                images = g_synthesis(mixed, styles, resume=None if x is None else (k, x))
+        finally:
+            NoiseBank.detach(g_synthesis)
+    return images.view(m, n, *images.shape[1:])
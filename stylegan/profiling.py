@@ -0,0 +1,170 @@
+"""Opt-in per-module instrumentation : wall time, activation bytes and peak memory of every call.
+
+    with instrument(g_all) as trace:
+        g_all(z)
+    trace.print_summary()
+    trace.save('trace.json') # chrome://tracing or https://ui.perfetto.dev
+
+The hooks only exist inside the with block : outside of it the model runs exactly the code
+it runs without this module, so it can stay in production code.
+"""
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+from .memory import _reset_rss_peak, _status, _trim
+from .networks import DLatents, G_mapping, G_synthesis, GSynthesisBlock, InputBlock, LayerEpilogue, NoiseLayer
+
+INSTRUMENTED = (G_mapping, G_synthesis, InputBlock, GSynthesisBlock, LayerEpilogue, NoiseLayer)
+
+
+def _nbytes(x):
+    if isinstance(x, torch.Tensor):
+        return x.numel() * x.element_size()
+    if isinstance(x, DLatents):
+        return _nbytes(x.vectors)
+    if isinstance(x, (list, tuple)):
+        return sum(_nbytes(v) for v in x)
+    return 0
+
+
+class Trace:
+    """events recorded by instrument(), one per module call, in the order the calls end"""
+    def __init__(self):
+        self.events = []
+        self.notes = [] # execution modes whose work some events do not show
+
+    def chrome_trace(self):
+        """the events in the Chrome trace event format (complete events, times in us)"""
+        return {'displayTimeUnit': 'ms',
+                'traceEvents': [{'name': e['name'], 'cat': e['type'], 'ph': 'X', 'pid': 0, 'tid': 0,
+                                 'ts': e['start'] * 1e6, 'dur': e['wall'] * 1e6,
+                                 'args': {'out_bytes': e['out_bytes'], 'io_bytes': e['io_bytes'],
+                                          'peak_bytes': e['peak_bytes']}}
+                                for e in self.events]}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self):
+        """per module : number of calls, total and mean wall time, max output, io and peak bytes
+        (peak None when it could not be measured)"""
+        rows = OrderedDict()
+        for e in sorted(self.events, key=lambda e: e['start']):
+            row = rows.setdefault(e['name'], {'name': e['name'], 'type': e['type'], 'calls': 0, 'wall': 0.,
+                                              'out_bytes': 0, 'io_bytes': 0, 'peak_bytes': None})
+            row['calls'] += 1
+            row['wall'] += e['wall']
+            row['out_bytes'] = max(row['out_bytes'], e['out_bytes'])
+            row['io_bytes'] = max(row['io_bytes'], e['io_bytes'])
+            if e['peak_bytes'] is not None:
+                row['peak_bytes'] = max(row['peak_bytes'] or 0, e['peak_bytes'])
+        for row in rows.values():
+            row['mean'] = row['wall'] / row['calls']
+        return list(rows.values())
+
+    def print_summary(self):
+        print('%-44s %-16s %6s %11s %11s %11s %11s %11s' % ('module', 'type', 'calls', 'total ms', 'mean ms',
+                                                            'out MB', 'io MB', 'peak MB'))
+        for row in self.summary():
+            peak = '-' if row['peak_bytes'] is None else '%.2f' % (row['peak_bytes'] / 2**20)
+            print('%-44s %-16s %6d %11.2f %11.2f %11.2f %11.2f %11s' % (
+                row['name'], row['type'], row['calls'], row['wall'] * 1e3, row['mean'] * 1e3,
+                row['out_bytes'] / 2**20, row['io_bytes'] / 2**20, peak))
+        for note in self.notes:
+            print('note : ' + note)
+
+
+@contextmanager
+def instrument(model, types=INSTRUMENTED, names=('torgb',), memory=True):
+    """records every call of the submodules of model that are instances of types or whose
+    attribute name is in names (g_synthesis.torgb by default).
+
+    wall : time of the call; on cuda the device is synchronized around every call.
+    out_bytes : size of the output activation. io_bytes : size of the inputs and outputs.
+    peak_bytes : the peak during the call above what was held before it : of the allocator on cuda,
+    of the resident set on cpu (VmHWM, reset through /proc/self/clear_refs as in memory.py; the
+    freed heap is returned to the system before each call). None on cpu without /proc, or with
+    memory=False. On cpu the measure costs a malloc_trim per call, which the wall time of the
+    enclosing calls includes : time with memory=False.
+
+    Calls the execution mode routes around the instrumented modules are listed in trace.notes :
+    tiled blocks do not go through GSynthesisBlock.forward, fused epilogues add the noise without
+    NoiseLayer calls and static execution (arena.py) runs G_synthesis as one call."""
+    trace = Trace()
+    stack = []
+    t_origin = time.perf_counter()
+    device = next(model.parameters()).device
+    cuda = device.type == 'cuda'
+
+    rss = memory and not cuda and _reset_rss_peak()
+    for m in model.modules():
+        if isinstance(m, G_synthesis):
+            if m.static and m.tile_size is None:
+                trace.notes.append('static execution : G_synthesis runs as one call, no block events')
+            elif m.tile_size is not None:
+                trace.notes.append('tiled blocks from %dpx : no GSynthesisBlock events for them' % m.tile_min_resolution)
+            if any(epi.fused and epi.fusable() for epi in m.modules() if isinstance(epi, LayerEpilogue)):
+                trace.notes.append('fused epilogues : the noise is added in LayerEpilogue, no NoiseLayer events')
+
+    def peak():
+        if cuda:
+            torch.cuda.synchronize(device)
+            return torch.cuda.max_memory_allocated(device)
+        return _status('VmHWM')
+
+    def reset():
+        """bytes held, the peak counter being reset to it"""
+        if cuda:
+            torch.cuda.reset_peak_memory_stats(device)
+            return torch.cuda.memory_allocated(device)
+        _trim()
+        held = _status('VmRSS')
+        _reset_rss_peak()
+        return held
+
+    measure = (memory and cuda) or rss
+
+    def pre_hook(module, args):
+        base = 0
+        if cuda:
+            torch.cuda.synchronize(device)
+        if measure:
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak())
+            base = reset()
+        stack.append({'start': time.perf_counter(), 'base': base, 'peak': 0, 'in_bytes': _nbytes(args)})
+
+    def post_hook(name):
+        def hook(module, args, output):
+            if cuda:
+                torch.cuda.synchronize(device)
+            end = time.perf_counter()
+            frame = stack.pop()
+            out_bytes = _nbytes(output)
+            peak_bytes = None
+            if measure:
+                top = max(frame['peak'], peak())
+                peak_bytes = top - frame['base']
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], top)
+                reset()
+            trace.events.append({'name': name, 'type': type(module).__name__, 'start': frame['start'] - t_origin,
+                                 'wall': end - frame['start'], 'out_bytes': out_bytes,
+                                 'io_bytes': frame['in_bytes'] + out_bytes, 'peak_bytes': peak_bytes})
+        return hook
+
+    handles = []
+    try:
+        for name, m in model.named_modules():
+            if isinstance(m, types) or name.split('.')[-1] in names:
+                handles.append(m.register_forward_pre_hook(pre_hook))
+                handles.append(m.register_forward_hook(post_hook(name)))
+        yield trace
+    finally:
+        for h in handles:
+            h.remove()
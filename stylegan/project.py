@@ -0,0 +1,219 @@
+"""Batched projection of target images into W (or W+) : GAN inversion.
+
+    projector = Projector(g_all, FaceEmbedder(), mode='w+', batch_size=8)
+    for result in projector.project((name, image) for name, image in targets):
+        save(result['key'], result['w'])           # completion order
+
+Many targets are optimized at once : every step is one forward / backward of G_synthesis over a
+batch of slots, each slot holding one target with its own W, Adam state and step count. A target
+leaves as soon as its loss stops improving (by more than tol, relatively, for patience steps) or
+after max_steps, and its slot is refilled from the target queue right away, so the batch stays
+full until the queue is drained.
+
+Initialization : a pool of nb_starts start points (the W mean and W of random z pulled halfway
+toward it) is rendered once and kept; each new target starts from the candidate of lowest loss
+against it, which costs only the loss, not a synthesis.
+
+Loss : mean squared error of the images downsampled to loss_size (targets of any size are
+resized), plus identity_weight times (1 - cosine) of their facenet embeddings (FaceEmbedder,
+optional). The noise inputs are fixed
+(NoiseBank('cached', noise_seed)) and the generator weights are not touched : gradients are taken
+with torch.autograd.grad w.r.t. W only, frozen layers keep their cached weights.
+"""
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from .networks import DLatents
+from .noise import NoiseBank
+
+
+def w_mean(g_mapping, nb_samples=10000, batch_size=1000, seed=0):
+    """mean of W = g_mapping(z), z ~ N(0, I), for models without an avg_latent"""
+    device = next(g_mapping.parameters()).device
+    generator = torch.Generator().manual_seed(seed)
+    ws = []
+    with torch.no_grad():
+        for start in range(0, nb_samples, batch_size):
+            w = g_mapping(torch.randn(min(batch_size, nb_samples - start), 512, generator=generator).to(device))
+            ws.append(w.vectors[:, 0] if isinstance(w, DLatents) else w[:, 0])
+    return torch.cat(ws).mean(0)
+
+
+class Projector:
+    def __init__(self, g_all, embedder=None, mode='w', batch_size=8, nb_starts=16, max_steps=500, lr=0.05,
+                 identity_weight=0.1, loss_size=256, tol=1e-3, patience=25, noise_seed=0, seed=0):
+        """mode : 'w' (one W per target) or 'w+' (one W per layer). embedder : a FaceEmbedder for the
+        identity loss (None : pixel loss only)"""
+        assert mode in ('w', 'w+')
+        self.g_all = g_all
+        self.g_synthesis = g_all.g_synthesis
+        self.embedder = embedder
+        self.mode = mode
+        self.batch_size = batch_size
+        self.max_steps = max_steps
+        self.lr = lr
+        self.identity_weight = identity_weight if embedder is not None else 0.
+        self.loss_size = min(loss_size, 2**(len(self.g_synthesis.blocks) + 1))
+        self.tol = tol
+        self.patience = patience
+        self.noise_bank = NoiseBank('cached', seed=noise_seed)
+        self.device = next(g_all.parameters()).device
+        self.nb_starts = nb_starts
+        self.seed = seed
+        self._starts = None
+        self.stats = {'targets': 0, 'steps': 0, 'seconds': 0.}
+
+    def _render(self, w):
+        """images of w [B, 1 or num_layers, 512]"""
+        num_layers = self.g_synthesis.num_layers
+        dlatents = DLatents(w, num_layers=num_layers) if w.size(1) == 1 else DLatents.from_dense(w)
+        return self.g_synthesis(dlatents)
+
+    def _prepare(self, imgs):
+        """(images at loss_size, normalized embeddings or None) of images in [-1, 1]"""
+        size = (self.loss_size, self.loss_size)
+        small = imgs if imgs.shape[-2:] == size else \
+            F.interpolate(imgs, size=size, mode='area' if imgs.size(-1) > self.loss_size else 'bilinear')
+        if not self.identity_weight:
+            return small, None
+        return small, F.normalize(self.embedder.features(imgs.to(self.embedder.device)), dim=1).to(self.device)
+
+    def _losses(self, prepared, targets):
+        """[B] loss of prepared images against prepared targets"""
+        loss = (prepared[0] - targets[0]).pow(2).flatten(1).mean(1)
+        if self.identity_weight:
+            loss = loss + self.identity_weight * (1 - (prepared[1] * targets[1]).sum(1))
+        return loss
+
+    def starts(self):
+        """(W [nb_starts, 1, 512], prepared images) of the start pool, computed once"""
+        if self._starts is None:
+            avg = self.g_all.truncation.avg_latent
+            avg = w_mean(self.g_all.g_mapping, seed=self.seed) if avg is None else avg.to(self.device)
+            generator = torch.Generator().manual_seed(self.seed)
+            z = torch.randn(self.nb_starts - 1, 512, generator=generator).to(self.device)
+            self.noise_bank.attach(self.g_synthesis)
+            try:
+                with torch.no_grad():
+                    w = self.g_all.g_mapping(z)
+                    w = w.vectors[:, 0] if isinstance(w, DLatents) else w[:, 0]
+                    w = torch.cat([avg[None], torch.lerp(avg, w, 0.5)]).unsqueeze(1)
+                    prepared = [self._prepare(self._render(w[i:i + self.batch_size]))
+                                for i in range(0, len(w), self.batch_size)]
+            finally:
+                NoiseBank.detach(self.g_synthesis)
+            self._starts = (w, (torch.cat([p[0] for p in prepared]),
+                                None if prepared[0][1] is None else torch.cat([p[1] for p in prepared])))
+        return self._starts
+
+    def _init(self, target):
+        """(W to start from, prepared target) of a target image [3, H, W]"""
+        w, images = self.starts()
+        with torch.no_grad():
+            prepared = self._prepare(target.to(self.device, torch.float32)[None])
+            expanded = (prepared[0].expand(len(w), -1, -1, -1), None if prepared[1] is None else prepared[1].expand(len(w), -1))
+            best = self._losses(images, expanded).argmin()
+        w = w[best]
+        if self.mode == 'w+':
+            w = w.expand(self.g_synthesis.num_layers, -1)
+        return w.clone(), prepared
+
+    def project(self, targets):
+        """yields {'key', 'w' ([1 or num_layers, 512] cpu), 'loss', 'steps'} for each (key, image [3, H, W]
+        in [-1, 1]) of targets, in completion order"""
+        queue = iter(targets)
+        slots = [] # key, prepared target, step, best loss, steps without improvement
+        w = m = v = best_w = None
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+        self.noise_bank.attach(self.g_synthesis)
+        t0 = time.perf_counter()
+        try:
+            while True:
+                # refill the free slots
+                new = []
+                while len(slots) + len(new) < self.batch_size:
+                    item = next(queue, None)
+                    if item is None:
+                        break
+                    key, image = item
+                    new.append((key,) + self._init(image))
+                if new:
+                    w_new = torch.stack([n[1] for n in new])
+                    w = w_new if w is None else torch.cat([w, w_new])
+                    best_w = w_new.clone() if best_w is None else torch.cat([best_w, w_new])
+                    m = torch.zeros_like(w) if m is None else torch.cat([m, torch.zeros_like(w_new)])
+                    v = torch.zeros_like(w) if v is None else torch.cat([v, torch.zeros_like(w_new)])
+                    slots += [[key, prepared, 0, float('inf'), 0] for key, _, prepared in new]
+                if not slots:
+                    break
+                # one step of every slot
+                w.requires_grad_(True)
+                prepared = self._prepare(self._render(w))
+                targets_batch = (torch.cat([s[1][0] for s in slots]),
+                                 None if slots[0][1][1] is None else torch.cat([s[1][1] for s in slots]))
+                losses = self._losses(prepared, targets_batch)
+                grad, = torch.autograd.grad(losses.sum(), [w])
+                w = w.detach()
+                steps = torch.tensor([s[2] + 1 for s in slots], dtype=w.dtype, device=w.device).view(-1, 1, 1)
+                m.mul_(beta1).add_(grad, alpha=1 - beta1)
+                v.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+                step = (m / (1 - beta1 ** steps)) / ((v / (1 - beta2 ** steps)).sqrt_() + eps)
+                self.stats['steps'] += len(slots)
+                # bookkeeping with the losses of the W before the update
+                done = []
+                for i, (slot, loss) in enumerate(zip(slots, losses.tolist())):
+                    slot[2] += 1
+                    if loss < slot[3] * (1 - self.tol):
+                        slot[3], slot[4] = loss, 0
+                        best_w[i] = w[i]
+                    else:
+                        slot[4] += 1
+                    if slot[4] >= self.patience or slot[2] >= self.max_steps:
+                        done.append(i)
+                w.sub_(step, alpha=self.lr)
+                for i in done:
+                    self.stats['targets'] += 1
+                    yield {'key': slots[i][0], 'w': best_w[i].cpu(), 'loss': slots[i][3], 'steps': slots[i][2]}
+                if done:
+                    keep = torch.tensor([i not in done for i in range(len(slots))], device=w.device)
+                    w, m, v, best_w = w[keep], m[keep], v[keep], best_w[keep]
+                    slots = [s for i, s in enumerate(slots) if i not in done]
+        finally:
+            NoiseBank.detach(self.g_synthesis)
+            self.stats['seconds'] += time.perf_counter() - t0
+
+    def targets_per_hour(self):
+        return self.stats['targets'] / max(self.stats['seconds'], 1e-9) * 3600
+
+
+def project_report(g_all, nb_targets=8, batch_sizes=(1, 4), embedder=None, mode='w', max_steps=100, seed=0):
+    """projects images generated from known seeds, one batch size after the other : prints targets/hour,
+    the mean final loss and steps, and the mean squared error of the recovered W"""
+    device = next(g_all.parameters()).device
+    rng = np.random.RandomState(seed + 1)
+    z = torch.from_numpy(rng.randn(nb_targets, 512)).float().to(device)
+    with torch.no_grad():
+        w_true = g_all.g_mapping(z)
+        w_true = w_true.vectors[:, 0] if isinstance(w_true, DLatents) else w_true[:, 0]
+        NoiseBank('cached', seed=seed).attach(g_all)
+        try:
+            images = g_all.g_synthesis(DLatents(w_true.unsqueeze(1), num_layers=g_all.g_synthesis.num_layers))
+        finally:
+            NoiseBank.detach(g_all)
+    report = {}
+    for batch_size in batch_sizes:
+        projector = Projector(g_all, embedder, mode, batch_size, max_steps=max_steps, noise_seed=seed, seed=seed)
+        projector.starts() # not timed : computed once per projector
+        results = sorted(projector.project(enumerate(images)), key=lambda r: r['key'])
+        w = torch.stack([r['w'] for r in results]).mean(1)
+        report[batch_size] = {'targets_per_hour': projector.targets_per_hour(),
+                              'loss': np.mean([r['loss'] for r in results]),
+                              'steps': np.mean([r['steps'] for r in results]),
+                              'w_mse': (w - w_true.cpu()).pow(2).mean().item()}
+        r = report[batch_size]
+        print('batch %2d : %7.1f targets/hour, loss %.4f, %.0f steps, w mse %.4f' %
+              (batch_size, r['targets_per_hour'], r['loss'], r['steps'], r['w_mse']))
+    return report
@@ -0,0 +1,95 @@
+"""Batched latent interpolation paths and streaming frame writers.
+
+Interpolation paths are generated lazily, a batch of frames at a time, so a long walk costs one
+batch of latents and images in memory. Keyframes are either z / w tensors [K, 512] or DLatents
+with K samples (interpolated on their vectors).
+"""
+import os
+
+import numpy as np
+import torch
+
+from .networks import DLatents
+
+
+def to_uint8(imgs, numpy=True):
+    """[B, C, H, W] in [-1, 1] -> [B, H, W, C] uint8 numpy (contiguous, numpy=False : a tensor on the
+    device of imgs). The quantization runs on that device and the conversion to uint8 writes the NHWC
+    layout in the same pass, so only the uint8 image (a quarter of the float32 one) crosses to the host."""
+    b, c, h, w = imgs.shape
+    out = torch.empty((b, h, w, c), dtype=torch.uint8, device=imgs.device)
+    out.permute(0, 3, 1, 2).copy_(imgs.clamp(-1, 1).add_(1).mul_(127.5).round_())
+    return out.cpu().numpy() if numpy else out
+
+
+def slerp(a, b, t):
+    """spherical interpolation along the last dim, t broadcast against a and b"""
+    a_n = a / a.norm(dim=-1, keepdim=True)
+    b_n = b / b.norm(dim=-1, keepdim=True)
+    omega = torch.acos((a_n * b_n).sum(-1, keepdim=True).clamp(-1, 1))
+    so = torch.sin(omega)
+    close = so.abs() < 1e-6 # (anti)parallel : fall back to lerp
+    so = torch.where(close, torch.ones_like(so), so)
+    wa = torch.where(close, 1 - t, torch.sin((1 - t) * omega) / so)
+    wb = torch.where(close, t, torch.sin(t * omega) / so)
+    return wa * a + wb * b
+
+
+def latent_path(keyframes, steps, method='lerp', loop=False, batch_size=8):
+    """yields batches of latents going through the keyframes, `steps` frames per segment.
+    without loop the last keyframe ends the path, with loop the path comes back to the first one."""
+    compact = isinstance(keyframes, DLatents)
+    vectors = keyframes.vectors if compact else keyframes
+    nb_keys = vectors.size(0)
+    nb_segments = nb_keys if loop else nb_keys - 1
+    nb_frames = nb_segments * steps + (0 if loop else 1)
+    interp = {'lerp': torch.lerp, 'slerp': slerp}[method]
+    for start in range(0, nb_frames, batch_size):
+        frame = torch.arange(start, min(start + batch_size, nb_frames), device=vectors.device)
+        segment = (frame // steps).clamp(max=nb_segments - 1)
+        t = ((frame - segment * steps).to(vectors.dtype) / steps).view([-1] + [1] * (vectors.dim() - 1))
+        batch = interp(vectors[segment], vectors[(segment + 1) % nb_keys], t)
+        yield DLatents(batch, keyframes.layer_index) if compact else batch
+
+
+def render_frames(model, path):
+    """streams uint8 frames : model is g_all for z paths, g_synthesis for w paths.
+    For a walk without flicker, attach a NoiseBank('cached') to the model first."""
+    with torch.no_grad():
+        for latents in path:
+            yield from to_uint8(model(latents))
+
+
+def write_png_sequence(frames, directory, pattern='frame%06d.png'):
+    from PIL import Image
+    os.makedirs(directory, exist_ok=True)
+    nb = 0
+    for frame in frames:
+        Image.fromarray(frame).save(os.path.join(directory, pattern % nb))
+        nb += 1
+    return nb
+
+
+def write_video(frames, path, fps=30, ffmpeg='ffmpeg'):
+    """pipes the frames to ffmpeg, or writes raw rgb24 frames if path ends with .rgb"""
+    import itertools, subprocess
+    frames = iter(frames)
+    first = next(frames)
+    height, width = first.shape[:2]
+    if path.endswith('.rgb'):
+        out, proc = open(path, 'wb'), None
+    else:
+        proc = subprocess.Popen([ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                                 '-s', '%dx%d' % (width, height), '-r', str(fps), '-i', '-',
+                                 '-pix_fmt', 'yuv420p', path], stdin=subprocess.PIPE)
+        out = proc.stdin
+    nb = 0
+    try:
+        for frame in itertools.chain([first], frames):
+            out.write(np.ascontiguousarray(frame).tobytes())
+            nb += 1
+    finally:
+        out.close()
+        if proc is not None and proc.wait() != 0:
+            raise RuntimeError('%s exited with code %d' % (ffmpeg, proc.returncode))
+    return nb
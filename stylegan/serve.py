@@ -0,0 +1,158 @@
+"""asyncio generation service with dynamic micro-batching.
+
+Single-image requests (seed or z, truncation psi, noise seed) from many asyncio clients are
+coalesced into batches : a batch leaves when it is full or max_delay after its oldest request.
+Inference runs on a worker thread, so the event loop keeps accepting requests meanwhile.
+The queue is bounded : when it is full, generate() waits (or raises QueueFull with wait=False).
+"""
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from .networks import G_mapping, G_synthesis, Truncation, freeze
+from .noise import NoiseBank
+from .render import to_uint8
+
+
+class GenerationService:
+    def __init__(self, g_mapping, g_synthesis, max_batch_size=8, max_delay=0.02, max_queue=256,
+                 avg_latent=None, truncation_max_layer=8, device='cpu'):
+        self.g_mapping = g_mapping.eval().to(device)
+        self.g_synthesis = g_synthesis.eval().to(device)
+        self.noise_bank = NoiseBank('seeded').attach(self.g_synthesis)
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self.truncation = Truncation(avg_latent, truncation_max_layer, 1.0).to(device)
+        self.device = device
+        self._queue = None
+        self._latencies = deque(maxlen=10000)
+        self._counts = {'requests': 0, 'rejected': 0, 'batches': 0, 'images': 0}
+
+    async def start(self):
+        self._closed = False
+        self._batch = []
+        self._queue = asyncio.Queue(self.max_queue)
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='g_synthesis')
+        self._task = asyncio.get_running_loop().create_task(self._batch_loop())
+        return self
+
+    async def stop(self):
+        # the flag covers wait_for swallowing the cancellation when a request arrives at the same time
+        self._closed = True
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        pending = self._batch
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for r in pending:
+            r[-1].cancel()
+        self._executor.shutdown()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def generate(self, seed=None, latent=None, psi=1.0, noise_seed=None, wait=True):
+        """renders one image, returned as [H, W, 3] uint8"""
+        if (seed is None) == (latent is None):
+            raise ValueError('give either a seed or a latent')
+        if psi != 1.0 and self.truncation.avg_latent is None:
+            raise ValueError('truncation needs avg_latent')
+        if noise_seed is None:
+            noise_seed = 0 if seed is None else seed
+        if not wait and self._queue.full():
+            self._counts['rejected'] += 1
+            raise asyncio.QueueFull()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((time.perf_counter(), seed, latent, psi, noise_seed, future))
+        self._counts['requests'] += 1
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while not self._closed:
+            self._batch = batch = [await self._queue.get()]
+            deadline = batch[0][0] + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    if timeout <= 0:
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+            batch = [r for r in batch if not r[-1].cancelled()]
+            if not batch:
+                continue
+            try:
+                images = await loop.run_in_executor(self._executor, self._render, batch)
+            except Exception as e:
+                for r in batch:
+                    if not r[-1].done():
+                        r[-1].set_exception(e)
+                continue
+            now = time.perf_counter()
+            for r, image in zip(batch, images):
+                if not r[-1].done():
+                    r[-1].set_result(image)
+                self._latencies.append(now - r[0])
+            self._counts['batches'] += 1
+            self._counts['images'] += len(batch)
+            self._batch = []
+
+    def _render(self, batch):
+        z = [np.random.RandomState(seed).randn(512) if latent is None else np.asarray(latent, dtype=np.float64).reshape(512)
+             for _, seed, latent, _, _, _ in batch]
+        z = torch.from_numpy(np.stack(z)).float().to(self.device)
+        psi = torch.tensor([r[3] for r in batch], dtype=torch.float32, device=self.device)
+        with torch.no_grad():
+            w = self.g_mapping(z)
+            if bool((psi != 1).any()):
+                w = self.truncation(w, psi)
+            with self.noise_bank.use([r[4] for r in batch]):
+                imgs = self.g_synthesis(w)
+        return list(to_uint8(imgs))
+
+    def metrics(self):
+        latencies = np.array(self._latencies) * 1e3
+        metrics = dict(self._counts, queue_depth=self._queue.qsize() if self._queue is not None else 0)
+        metrics['mean_batch_size'] = self._counts['images'] / max(self._counts['batches'], 1)
+        if len(latencies):
+            metrics['latency_ms'] = {'p50': np.percentile(latencies, 50), 'p95': np.percentile(latencies, 95),
+                                     'p99': np.percentile(latencies, 99), 'max': latencies.max()}
+        return metrics
+
+
+async def load_test(service, nb_clients=16, requests_per_client=4):
+    """nb_clients concurrent clients, each sending its requests one after the other"""
+    async def client(c):
+        for i in range(requests_per_client):
+            await service.generate(seed=c * requests_per_client + i)
+    t0 = time.perf_counter()
+    await asyncio.gather(*[client(c) for c in range(nb_clients)])
+    elapsed = time.perf_counter() - t0
+    metrics = service.metrics()
+    metrics['images_per_s'] = nb_clients * requests_per_client / elapsed
+    return metrics
+
+
+def bench_service(resolution=64, nb_clients=16, requests_per_client=4, **kwargs):
+    """local load generator against a randomly initialized generator on cpu"""
+    g_mapping, g_synthesis = freeze(G_mapping()), freeze(G_synthesis(resolution=resolution))
+    async def main():
+        async with GenerationService(g_mapping, g_synthesis, **kwargs) as service:
+            return await load_test(service, nb_clients, requests_per_client)
+    metrics = asyncio.run(main())
+    print(metrics)
+    return metrics
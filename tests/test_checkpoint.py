@@ -0,0 +1,79 @@
+import pickle
+import sys
+import types
+
+import numpy as np
+import torch
+
+from stylegan.avg_latent import avg_latent_path
+from stylegan.checkpoint import convert_tf_pickle, load_blob, open_blob
+from stylegan.networks import G_mapping, G_style, G_synthesis
+
+
+class Network:
+    # pickled under the name of the official dnnlib.tflib.network.Network
+    def __init__(self, variables, components=None):
+        self.state = {'variables': list(variables.items()), 'components': components or {}}
+    def __getstate__(self):
+        return self.state
+
+
+def _official_variables(resolution=32):
+    """variables of the official G_mapping and G_synthesis, with their tf names and layout"""
+    rng = np.random.RandomState(0)
+    def randn(*shape):
+        return rng.randn(*shape).astype(np.float32)
+    mapping = {}
+    for i in range(8):
+        mapping['Dense%d/weight' % i], mapping['Dense%d/bias' % i] = randn(512, 512), randn(512)
+    synthesis, res, nb = {}, 4, 0
+    while res <= resolution:
+        for layer in ('Const', 'Conv') if res == 4 else ('Conv0_up', 'Conv1'):
+            prefix = '%dx%d/%s/' % (res, res, layer)
+            if layer == 'Const':
+                synthesis[prefix + 'const'] = randn(1, 512, 4, 4)
+            else:
+                synthesis[prefix + 'weight'] = randn(3, 3, 512, 512)
+            synthesis[prefix + 'bias'] = randn(512)
+            synthesis[prefix + 'Noise/weight'] = randn(512)
+            synthesis[prefix + 'StyleMod/weight'] = randn(512, 1024)
+            synthesis[prefix + 'StyleMod/bias'] = randn(1024)
+            synthesis['noise%d' % nb] = randn(1, 1, res, res)
+            nb += 1
+        lod = int(np.log2(resolution // res))
+        synthesis['ToRGB_lod%d/weight' % lod], synthesis['ToRGB_lod%d/bias' % lod] = randn(1, 1, 512, 3), randn(3)
+        res *= 2
+    synthesis['lod'] = np.float32(0)
+    return mapping, synthesis
+
+
+def test_convert_official_pickle(tmp_path, monkeypatch):
+    for name in ('dnnlib', 'dnnlib.tflib', 'dnnlib.tflib.network'):
+        monkeypatch.setitem(sys.modules, name, types.ModuleType(name))
+    monkeypatch.setattr(sys.modules['dnnlib.tflib.network'], 'Network', Network, raising=False)
+    monkeypatch.setattr(Network, '__module__', 'dnnlib.tflib.network')
+    mapping, synthesis = _official_variables()
+    dlatent_avg = np.random.RandomState(1).randn(512).astype(np.float32)
+    Gs = Network({'dlatent_avg': dlatent_avg},
+                 {'mapping': Network(mapping), 'synthesis': Network(synthesis)})
+    pkl = str(tmp_path / 'karras2019stylegan-ffhq-32x32.pkl')
+    with open(pkl, 'wb') as f:
+        pickle.dump((None, None, Gs), f)
+
+    path = convert_tf_pickle(pkl, str(tmp_path / 'g.blob'),
+                             model=G_style(G_mapping(), G_synthesis(resolution=32)))
+    g_all = G_style(G_mapping(), G_synthesis(resolution=32))
+    load_blob(g_all, path)
+    state = g_all.state_dict()
+    assert torch.equal(state['g_mapping.dense3.weight'], torch.from_numpy(mapping['Dense3/weight']).t())
+    assert torch.equal(state['g_synthesis.blocks.4x4.const'], torch.from_numpy(synthesis['4x4/Const/const']))
+    assert torch.equal(state['g_synthesis.blocks.8x8.conv0_up.weight'],
+                       torch.from_numpy(synthesis['8x8/Conv0_up/weight']).permute(3, 2, 0, 1))
+    assert torch.equal(state['g_synthesis.torgb.weight'],
+                       torch.from_numpy(synthesis['ToRGB_lod0/weight']).permute(3, 2, 0, 1))
+    assert torch.equal(state['g_synthesis.blocks.16x16.epi2.style_mod.lin.weight'],
+                       torch.from_numpy(synthesis['16x16/Conv1/StyleMod/weight']).t())
+    assert torch.equal(open_blob(path)['const_noise.7'], torch.from_numpy(synthesis['noise7'][0, 0]))
+    assert torch.equal(torch.load(avg_latent_path(path))['avg_latent'], torch.from_numpy(dlatent_avg))
+    with torch.no_grad():
+        assert g_all.eval()(torch.randn(1, 512)).shape == (1, 3, 32, 32)
@@ -0,0 +1,20 @@
+import pytest
+import torch
+
+from stylegan.networks import DLatents
+
+
+def test_combine_matches_dense():
+    d = DLatents(torch.randn(3, 2, 8), [0] * 4 + [1] * 4)
+    per_layer = torch.randn(3, 8, 8)
+    per_sample = torch.randn(3, 1, 8)
+    assert torch.allclose((d + per_layer).dense(), d.dense() + per_layer)
+    assert torch.allclose((d * per_sample).dense(), d.dense() * per_sample)
+    assert torch.allclose((d - torch.tensor(2.)).dense(), d.dense() - 2)
+    assert torch.allclose((1 - d).dense(), 1 - d.dense())
+
+
+def test_combine_rejects_2d():
+    d = DLatents(torch.randn(2, 2, 8), [0] * 4 + [1] * 4)
+    with pytest.raises(ValueError):
+        d + torch.randn(2, 8) # B == number of vectors : would broadcast row i on vector i
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import torch.nn as nn
+
+from stylegan.bench import random_g_all
+from stylegan.embed import EmbeddingCache, embed_seeds
+
+
+class _Embedder:
+    resnet = nn.Linear(2, 2)
+    image_size = 160
+    nb_classes = 3
+
+
+def _rows(seeds, value):
+    return np.full((len(seeds), 512), value, np.float32), np.full((len(seeds), 3), value, np.float32)
+
+
+def test_reopen_after_interrupted_append(tmp_path):
+    g_all = nn.Linear(2, 2)
+    cache = EmbeddingCache(str(tmp_path), g_all, _Embedder(), psi=1)
+    cache.append([1, 2, 3], [1, 2, 3], *_rows([1, 2, 3], 1.))
+    # killed during an append : embeddings and logits of two rows written, not their keys
+    embeddings, logits = _rows([8, 9], 99.)
+    with open(cache._files['embeddings.f32'], 'ab') as f:
+        f.write(embeddings.tobytes())
+    with open(cache._files['logits.f32'], 'ab') as f:
+        f.write(logits[:1].tobytes() + b'\0\0') # and part of a row
+
+    cache = EmbeddingCache(str(tmp_path), g_all, _Embedder(), psi=1)
+    assert len(cache) == 3
+    cache.append([4], [4], *_rows([4], 4.))
+    cache = EmbeddingCache(str(tmp_path), g_all, _Embedder(), psi=1)
+    embeddings, logits = cache.get(cache.lookup([1, 4], [1, 4]))
+    assert (embeddings[:, 0] == [1., 4.]).all() and (logits[:, 0] == [1., 4.]).all()
+    assert len(cache) == 4
+
+
+def test_psi_needs_avg_latent(tmp_path):
+    g_all = random_g_all(32)
+    assert g_all.truncation.avg_latent is None
+    with pytest.raises(FileNotFoundError):
+        EmbeddingCache(str(tmp_path), g_all, _Embedder(), psi=0.7)
+    with pytest.raises(FileNotFoundError):
+        embed_seeds(g_all, _Embedder(), [1, 2], psi=0.7)
@@ -0,0 +1,53 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from stylegan.networks import LayerEpilogue
+
+
+def _epilogue(channels=16):
+    torch.manual_seed(0)
+    epi = LayerEpilogue(channels, 512, use_wscale=True, use_noise=True, use_pixel_norm=False,
+                        use_instance_norm=True, use_styles=True, activation_layer=nn.LeakyReLU(0.2))
+    with torch.no_grad():
+        epi.top_epi.noise.weight.normal_()
+    return epi
+
+
+def _inputs(channels=16, batch_size=3, size=8):
+    x = torch.randn(batch_size, channels, size, size) * 3 + 1
+    w = torch.randn(batch_size, 512)
+    noise = torch.randn(batch_size, 1, size, size)
+    return x, w, noise
+
+
+@pytest.mark.parametrize('dtype, atol', [(torch.float32, 1e-5), (torch.bfloat16, 5e-2)])
+def test_fused_inplace_matches_unfused(dtype, atol):
+    epi = _epilogue()
+    x, w, noise = _inputs()
+    epi.top_epi.noise.noise = noise.to(dtype)
+    x = x.to(dtype)
+    with torch.no_grad():
+        ref = epi(x.clone(), w)
+        epi.fused = True
+        y = x.clone()
+        out = epi(y, w)
+    assert out.data_ptr() == y.data_ptr() # in place without autograd
+    assert out.dtype == dtype
+    assert torch.allclose(out.float(), ref.float(), atol=atol, rtol=atol)
+
+
+def test_fused_autograd_matches_unfused():
+    epi = _epilogue()
+    x, w, noise = _inputs()
+    epi.top_epi.noise.noise = noise
+    grads = []
+    for fused in (False, True):
+        epi.fused = fused
+        xi, wi = x.clone().requires_grad_(True), w.clone().requires_grad_(True)
+        out = epi(xi, wi)
+        assert torch.equal(xi, x) # not overwritten with autograd on
+        (out * torch.linspace(-1, 1, out.numel()).view_as(out)).sum().backward()
+        grads.append((out.detach(), xi.grad, wi.grad))
+    for ref, fused in zip(*grads):
+        assert torch.allclose(fused, ref, atol=1e-5, rtol=1e-4)
@@ -0,0 +1,24 @@
+import torch
+
+from stylegan.bench import random_g_all
+from stylegan.export import check_parity, export_generator
+from stylegan.networks import freeze
+
+
+def _g_all(resolution=32):
+    torch.manual_seed(0)
+    g_all = freeze(random_g_all(resolution))
+    g_all.truncation.avg_latent = torch.randn(512) * 0.1
+    return g_all
+
+
+def test_torchscript_matches_eager(tmp_path):
+    g_all = _g_all()
+    path = export_generator(g_all, str(tmp_path / 'g.pt'), 'torchscript', batch_size=2, psi=0.7)
+    assert check_parity(g_all, path, 'torchscript', batch_size=2, psi=0.7) <= 1e-4
+
+
+def test_untruncated_matches_eager(tmp_path):
+    g_all = _g_all()
+    path = export_generator(g_all, str(tmp_path / 'g.pt'), 'torchscript', batch_size=1, psi=1, seed=3)
+    assert check_parity(g_all, path, 'torchscript', batch_size=1, psi=1, seed=3) <= 1e-4
@@ -0,0 +1,24 @@
+import numpy as np
+
+from stylegan.index import VectorIndex
+
+
+def test_append_after_interrupted_append(tmp_path):
+    rng = np.random.RandomState(0)
+    vectors = rng.randn(5, 8).astype(np.float32)
+    index = VectorIndex(str(tmp_path), dim=8)
+    index.append([10, 11, 12], vectors[:3])
+    # killed during an append : a vector and a half written, and part of an id
+    with open(index._file('vectors.f32'), 'ab') as f:
+        f.write(rng.randn(12).astype(np.float32).tobytes())
+    with open(index._file('ids.i64'), 'ab') as f:
+        f.write(b'\1\2\3')
+
+    index = VectorIndex(str(tmp_path), dim=8)
+    assert len(index) == 3
+    index.append([13, 14], vectors[3:])
+    index = VectorIndex(str(tmp_path), dim=8)
+    assert index.ids.tolist() == [10, 11, 12, 13, 14]
+    assert np.array_equal(index.vectors, vectors)
+    ids, scores = index.search(vectors, k=1)
+    assert ids[:, 0].tolist() == [10, 11, 12, 13, 14] and np.allclose(scores, 0, atol=1e-4)
@@ -0,0 +1,47 @@
+import pytest
+import torch
+
+from stylegan import memory
+from stylegan.bench import random_g_all
+from stylegan.memory import MemoryPlanner
+from stylegan.noise import NoiseBank
+
+
+def _no_proc(monkeypatch):
+    def missing(*args):
+        raise FileNotFoundError('/proc/self/status')
+    monkeypatch.setattr(memory, '_status', missing)
+    monkeypatch.setattr(memory, '_reset_rss_peak', lambda: False)
+    monkeypatch.setattr(memory, '_available', lambda: None)
+
+
+def test_plans_without_proc(monkeypatch):
+    _no_proc(monkeypatch)
+    planner = MemoryPlanner(random_g_all(32).g_synthesis).probe() # estimate only
+    assert planner.measured is None
+    batch_size = planner.max_batch_size(2 << 30, limit=10**6)
+    room = 0.8 * (2 << 30) - planner._held() # held : the getrusage peak
+    assert 1 <= batch_size and planner.peak(batch_size) <= room < planner.peak(batch_size + 1)
+    with pytest.raises(ValueError):
+        planner.max_batch_size() # no MemAvailable : the budget must be given
+
+
+def test_split():
+    planner = MemoryPlanner(random_g_all(32).g_synthesis)
+    assert planner.split(10, 4) == [4, 3, 3]
+    assert planner.split(3, 4) == [3]
+    planner.g_synthesis.set_fused_epilogue().set_static()
+    assert planner.split(10, 4) == [4, 4, 2]
+
+
+def test_static_run_pads_a_last_batch_of_one():
+    torch.manual_seed(0)
+    g_all = random_g_all(32)
+    NoiseBank('const').attach(g_all) # no planes : no noise
+    z = torch.randn(9, 512)
+    with torch.no_grad():
+        ref = g_all(z)
+        synthesis = g_all.g_synthesis.set_fused_epilogue().set_static()
+        out = MemoryPlanner(synthesis).run(lambda z: g_all(z), z, batch_size=4) # 4, 4, 1
+    assert list(synthesis._arenas) and all(key[0] == 4 for key in synthesis._arenas)
+    assert torch.allclose(out, ref, atol=1e-4, rtol=1e-4)
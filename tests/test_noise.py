@@ -0,0 +1,25 @@
+import torch
+
+from stylegan.noise import NoiseBank
+
+
+def test_seeded_planes_do_not_depend_on_the_batch():
+    x = torch.empty(3, 8, 16, 16)
+    bank = NoiseBank('seeded')
+    with bank.use([5, 6, 7]):
+        batch = bank.noise(2, x)
+    with bank.use([6]):
+        alone = bank.noise(2, x[:1])
+    assert batch.shape == (3, 1, 16, 16)
+    assert torch.equal(batch[1], alone[0])
+    assert not torch.equal(batch[0], batch[1])
+    with bank.use([6]):
+        assert not torch.equal(bank.noise(3, x[:1]), alone) # another layer, another plane
+
+
+def test_memo_returns_the_same_planes():
+    memo = NoiseBank('seeded', cache_size=8)
+    with memo.use([1, 2]), NoiseBank('seeded').use([1, 2]) as plain:
+        first = memo.noise(0, torch.empty(2, 1, 8, 8))
+        assert torch.equal(memo.noise(0, torch.empty(2, 1, 8, 8)), first)
+        assert torch.equal(plain.noise(0, torch.empty(2, 1, 8, 8)), first)
@@ -0,0 +1,57 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from stylegan.networks import GSynthesisBlock, MyConv2d
+
+
+def _block(channels=16, size=16):
+    torch.manual_seed(0)
+    block = GSynthesisBlock(channels, channels, [1, 2, 1], 512, gain=2**0.5, use_wscale=True, use_noise=True,
+                            use_pixel_norm=False, use_instance_norm=True, use_styles=True,
+                            activation_layer=nn.LeakyReLU(0.2))
+    with torch.no_grad():
+        for p in block.parameters():
+            if p.dim() == 1:
+                p.normal_()
+    for epi in (block.epi1, block.epi2):
+        epi.top_epi.noise.noise = torch.randn(2, 1, size, size)
+    return block
+
+
+def _unfolded(monkeypatch, fn):
+    monkeypatch.setattr(MyConv2d, 'fold_min_size', 1 << 30)
+    out = fn()
+    monkeypatch.setattr(MyConv2d, 'fold_min_size', 0)
+    return out
+
+
+@pytest.mark.parametrize('fused_upscale', [False, True])
+def test_folded_conv_matches_unfolded(monkeypatch, fused_upscale):
+    monkeypatch.setattr(MyConv2d, 'fuse_min_size', 0 if fused_upscale else 1 << 30)
+    conv = _block().conv0_up.freeze()
+    x = torch.randn(2, 16, 8, 8) * 3 + 1
+    with torch.no_grad():
+        ref = _unfolded(monkeypatch, lambda: conv(x))
+        out = conv(x)
+    assert ('folded', fused_upscale, torch.float32, False) in conv._cache
+    assert out.shape == ref.shape == (2, 16, 16, 16)
+    border = torch.ones_like(ref, dtype=torch.bool)
+    border[:, :, 1:-1, 1:-1] = False
+    assert torch.allclose(out[border], ref[border], atol=1e-4, rtol=1e-4)
+    assert torch.allclose(out, ref, atol=1e-4, rtol=1e-4)
+
+
+@pytest.mark.parametrize('fused_epilogue', [False, True])
+@pytest.mark.parametrize('fused_upscale', [False, True])
+def test_folded_block_matches_unfolded(monkeypatch, fused_epilogue, fused_upscale):
+    monkeypatch.setattr(MyConv2d, 'fuse_min_size', 0 if fused_upscale else 1 << 30)
+    block = _block()
+    block.epi1.fused = block.epi2.fused = fused_epilogue
+    x, w = torch.randn(2, 16, 8, 8), torch.randn(2, 2, 512)
+    with torch.no_grad():
+        ref = _unfolded(monkeypatch, lambda: block(x, w))
+        out = block(x, w)
+    assert torch.allclose(out[..., 0, :], ref[..., 0, :], atol=1e-4, rtol=1e-4)
+    assert torch.allclose(out[..., -1], ref[..., -1], atol=1e-4, rtol=1e-4)
+    assert torch.allclose(out, ref, atol=1e-4, rtol=1e-4)